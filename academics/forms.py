@@ -1,5 +1,5 @@
 from django import forms
-from .models import SchoolClass, AcademicYear, Term
+from .models import SchoolClass, AcademicYear, Term, ScoreType
 import re
 
 # forms.py
@@ -135,3 +135,21 @@ class TermForm(forms.ModelForm):
             'name': forms.Select(attrs={'class': 'form-control', 'required': True}),
             'is_current': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
         }
+
+
+class ScoreTypeForm(forms.ModelForm):
+    class Meta:
+        model = ScoreType
+        fields = ['name', 'max_score', 'weight']
+
+    def clean_max_score(self):
+        max_score = self.cleaned_data['max_score']
+        if max_score <= 0:
+            raise forms.ValidationError('The maximum mark must be above 0')
+        return max_score
+
+    def clean_weight(self):
+        weight = self.cleaned_data['weight']
+        if weight < 0:
+            raise forms.ValidationError('The weight cannot be negative')
+        return weight
@@ -73,6 +73,10 @@ class Term(models.Model):
 
 class ScoreType(models.Model):
     name = models.CharField(max_length=20)  # 1stCA, 2ndCA, Exam
+    # Scores are entered out of max_score; weight is the type's share of the
+    # subject total, which is out of 100 (see students.totals)
+    max_score = models.DecimalField(max_digits=5, decimal_places=2, default=100)
+    weight = models.DecimalField(max_digits=5, decimal_places=2, default=100)
 
     def __str__(self):
         return self.name
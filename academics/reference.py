@@ -0,0 +1,157 @@
+"""
+In-process registry of the small reference tables: academic years, terms,
+classes, subjects and score types.
+
+The tables are loaded together, once per process, into an immutable
+Snapshot. Writes to these models bump the 'reference' tag in the shared
+cache (see core.caching and academics.signals). Each process compares its
+snapshot with the shared version once per request, or every CHECK_INTERVAL
+seconds outside requests, and reloads when another worker has written.
+
+    from academics import reference
+
+    year = reference.current_year()
+    term = reference.current_term()
+    context['classes'] = reference.classes()
+
+Snapshot rows are shared by every request in the process: read them, never
+modify or save them. Views that edit a row still load it from the database.
+"""
+import threading
+import time
+from dataclasses import dataclass
+
+from asgiref.sync import sync_to_async
+
+from core import caching
+from .models import AcademicYear, SchoolClass, ScoreType, Subject, Term
+
+TAG = 'reference'
+
+CHECK_INTERVAL = 5
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    version: int
+    years: tuple
+    terms: tuple
+    classes: tuple
+    subjects: tuple
+    score_types: tuple
+
+    @property
+    def current_year(self):
+        """The active academic year (latest first, like the model ordering)"""
+        return next((year for year in self.years if year.is_active), None)
+
+    @property
+    def current_term(self):
+        """The current term of the active year, else any term marked current"""
+        year = self.current_year
+        current = [term for term in self.terms if term.is_current]
+        if year is not None:
+            for term in current:
+                if term.academic_year_id == year.id:
+                    return term
+        return current[0] if current else None
+
+    def terms_for(self, academic_year):
+        year_id = getattr(academic_year, 'pk', academic_year)
+        return tuple(term for term in self.terms if term.academic_year_id == year_id)
+
+    def year(self, pk):
+        return _by_pk(self.years, pk)
+
+    def term(self, pk):
+        return _by_pk(self.terms, pk)
+
+    def school_class(self, pk):
+        return _by_pk(self.classes, pk)
+
+    def subject(self, pk):
+        return _by_pk(self.subjects, pk)
+
+
+def _by_pk(rows, pk):
+    try:
+        pk = int(pk)
+    except (TypeError, ValueError):
+        return None
+    return next((row for row in rows if row.pk == pk), None)
+
+
+def _load(version):
+    return Snapshot(
+        version=version,
+        years=tuple(AcademicYear.objects.all()),
+        terms=tuple(Term.objects.select_related('academic_year').order_by('id')),
+        classes=tuple(SchoolClass.objects.order_by('name', 'id')),
+        subjects=tuple(Subject.objects.order_by('name', 'id')),
+        score_types=tuple(ScoreType.objects.order_by('id')),
+    )
+
+
+_snapshot = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def snapshot():
+    """The current Snapshot, reloaded when the shared version has moved"""
+    global _snapshot, _checked_at
+    current = _snapshot
+    if current is not None and time.monotonic() - _checked_at < CHECK_INTERVAL:
+        return current
+
+    version = caching.tag_versions([TAG])[TAG]
+    with _lock:
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = _load(version)
+        _checked_at = time.monotonic()
+        return _snapshot
+
+
+asnapshot = sync_to_async(snapshot)
+
+
+def expire():
+    """Check the shared version on the next access"""
+    global _checked_at
+    _checked_at = 0.0
+
+
+def invalidate():
+    """Reference rows were written: every process reloads its snapshot"""
+    caching.invalidate(TAG)
+    expire()
+
+
+# Shortcuts for the common lookups
+
+def current_year():
+    return snapshot().current_year
+
+
+def current_term():
+    return snapshot().current_term
+
+
+def years():
+    return snapshot().years
+
+
+def terms():
+    return snapshot().terms
+
+
+def classes():
+    return snapshot().classes
+
+
+def subjects():
+    return snapshot().subjects
+
+
+def score_types():
+    return snapshot().score_types
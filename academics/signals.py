@@ -0,0 +1,23 @@
+# academics/signals.py
+from django.core.signals import request_started
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import reference
+from .models import AcademicYear, SchoolClass, ScoreType, Subject, Term
+
+
+@receiver([post_save, post_delete], sender=AcademicYear)
+@receiver([post_save, post_delete], sender=Term)
+@receiver([post_save, post_delete], sender=SchoolClass)
+@receiver([post_save, post_delete], sender=Subject)
+@receiver([post_save, post_delete], sender=ScoreType)
+def refresh_reference_data(sender, **kwargs):
+    """Reference tables changed: every process reloads its snapshot"""
+    reference.invalidate()
+
+
+@receiver(request_started)
+def check_reference_version(sender, **kwargs):
+    """Each request compares the snapshot with the shared version once"""
+    reference.expire()
@@ -1,3 +1,37 @@
-from django.test import TestCase
+from academics import reference
+from core import caching
+from core.testing import SchoolTestCase
+from .models import SchoolClass, ScoreType, Term
 
-# Create your tests here.
+
+class ReferenceTests(SchoolTestCase):
+    def test_snapshot_is_reused(self):
+        first = reference.snapshot()
+        with self.assertNumQueries(0):
+            self.assertIs(reference.snapshot(), first)
+            self.assertEqual(reference.current_year(), self.generated['academic_year'])
+            self.assertEqual(reference.snapshot().term(self.generated['term'].pk), self.generated['term'])
+
+    def test_writes_reload_the_snapshot(self):
+        first = reference.snapshot()
+        school_class = SchoolClass.objects.create(name='New class')
+        self.assertIn(school_class, reference.classes())
+        self.assertGreater(reference.snapshot().version, first.version)
+
+        term = Term.objects.get(pk=self.generated['term'].pk)
+        term.is_current = False
+        term.save()
+        self.assertIsNone(reference.current_term())
+
+        score_type = reference.score_types()[0]
+        ScoreType.objects.filter(pk=score_type.pk).delete()
+        self.assertNotIn(score_type, reference.score_types())
+
+    def test_other_processes_writes_are_seen_on_the_next_check(self):
+        first = reference.snapshot()
+        # Another worker wrote: only the shared version moves
+        caching.invalidate(reference.TAG)
+        self.assertIs(reference.snapshot(), first)
+
+        reference.expire()
+        self.assertIsNot(reference.snapshot(), first)
@@ -1,3 +1,4 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.shortcuts import redirect
 from django.urls import reverse
 
@@ -5,10 +6,17 @@ class RoleBasedAccessMiddleware:
     """
     Middleware to restrict access to URLs based on user role,
     with special handling for Django superusers.
+
+    Works in both sync (WSGI) and async (ASGI) stacks, so async views are
+    not pushed through a thread hop by this middleware.
     """
+    sync_capable = True
+    async_capable = True
 
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
         # Allowed paths per role
         self.allowed_paths = {
@@ -60,18 +68,28 @@ class RoleBasedAccessMiddleware:
         ]
 
     def __call__(self, request):
-        path = request.path
-
-        # Allow public paths
-        for public_path in self.public_paths:
-            if path.startswith(public_path):
-                return self.get_response(request)
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if self.is_public(request.path) or not request.user.is_authenticated:
+            return self.get_response(request)
+        return self.check_role(request, request.user) or self.get_response(request)
 
+    async def __acall__(self, request):
+        if self.is_public(request.path):
+            return await self.get_response(request)
+        user = await request.auser()
         # If user is not logged in, let Django handle it
-        if not request.user.is_authenticated:
-            return self.get_response(request)
+        if not user.is_authenticated:
+            return await self.get_response(request)
+        return self.check_role(request, user) or await self.get_response(request)
+
+    def is_public(self, path):
+        # Allow public paths
+        return any(path.startswith(public_path) for public_path in self.public_paths)
 
-        user = request.user
+    def check_role(self, request, user):
+        """Redirect to the user's dashboard when the path is not allowed for their role"""
+        path = request.path
 
         # --- SUPERUSER FIX ---
         # If the user is a superuser, always treat them as admin
@@ -82,7 +100,7 @@ class RoleBasedAccessMiddleware:
         # Check if path is allowed
         for allowed_path in allowed:
             if path.startswith(allowed_path):
-                return self.get_response(request)
+                return None
 
         # Not allowed → redirect to user's dashboard
         return redirect(reverse(self.dashboard_redirect[role]))
@@ -0,0 +1,23 @@
+from django.apps import AppConfig
+from django.contrib.staticfiles import apps as staticfiles_apps
+
+
+class CoreConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'core'
+
+    def ready(self):
+        from . import caching, outbox
+        # The outbox models are invalidated by the event consumer
+        caching.connect_signals(exclude=outbox.OUTBOX_MODELS)
+        outbox.connect_signals()
+
+
+class StaticFilesConfig(staticfiles_apps.StaticFilesConfig):
+    """django.contrib.staticfiles, without publishing the Roboto family.
+
+    Only the PDFs use Roboto, and they read it from static/Roboto on disk
+    (see students.utils.register_fonts).
+    """
+    default = False
+    ignore_patterns = [*staticfiles_apps.StaticFilesConfig.ignore_patterns, 'Roboto']
@@ -5,6 +5,37 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Deployment
+----------
+The dashboards (finance_dashboard, admin_dashboard, student_dashboard) are
+async views; every other view is sync and runs in Django's thread pool.
+Both deployments serve the same code:
+
+    # WSGI: threaded workers
+    gunicorn core.wsgi:application --workers 4 --threads 8 --timeout 60
+
+    # ASGI: uvicorn workers under gunicorn (both in requirements.txt)
+    gunicorn core.asgi:application -k uvicorn.workers.UvicornWorker --workers 4 --timeout 60
+
+    # ASGI, single process for local checks
+    uvicorn core.asgi:application --host 127.0.0.1 --port 8000
+
+Use the same worker count as the WSGI setup (about 2 x CPU cores). Keep
+CONN_MAX_AGE at 0 under ASGI: async requests do their database work on
+per-request threads, so persistent connections would pile up.
+
+Django's async ORM still runs each query through a thread, and the
+queries of one request share that request's connection. The dashboards'
+gathered queries are therefore awaited together but run one after another
+on the database. The gain is that a worker keeps serving other requests
+while one waits on MySQL.
+
+Compare the two deployments with:
+
+    python manage.py benchmark_dashboards --label wsgi-inprocess
+    python manage.py benchmark_dashboards --url http://127.0.0.1:8000 --label uvicorn \\
+        --baseline dashboard-benchmark.json --output uvicorn.json
 """
 
 import os
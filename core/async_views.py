@@ -0,0 +1,21 @@
+"""
+Helpers for async views (served concurrently under ASGI, see core/asgi.py).
+
+Async views must not touch the database lazily: load querysets with
+``alist`` or the a-prefixed QuerySet methods, and render with ``arender``.
+"""
+from asgiref.sync import sync_to_async
+from django.shortcuts import render
+
+
+async def alist(queryset):
+    """Evaluate a queryset (with its select/prefetch_related) from async code"""
+    return [obj async for obj in queryset]
+
+
+async def arender(request, template_name, context=None):
+    """
+    render() on the request's sync thread: templates and context processors
+    (request.user, lazy relations) may still run queries.
+    """
+    return await sync_to_async(render)(request, template_name, context)
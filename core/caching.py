@@ -0,0 +1,249 @@
+"""
+Shared cache tiers with tag-based invalidation.
+
+Each tier is a cache alias in settings.CACHES, with its own timeout and key
+prefix:
+
+    settings     SystemSettings
+    reference    academic years, terms, classes, fee structures
+    aggregates   dashboard figures, counts, invoice summaries
+    fragments    rendered template fragments
+    pdfs         generated report cards and receipts
+
+Production uses Redis for every tier; locally each tier is a directory of
+files under .cache/, and tests use locmem.
+
+Entries can carry tags. A tag is a version counter kept in the default
+cache and folded into the key, so bumping it orphans every entry stored
+under the old version; the orphans expire with their timeout.
+
+    from core import caching
+
+    summary = caching.get_or_set(
+        'aggregates', f"invoice_summary:{invoice.pk}", build,
+        tags=('invoices', 'payments'),
+    )
+    caching.invalidate('payments')
+
+Saving or deleting FeeType, FeeStructure, SystemSettings or GradingBand
+bumps their tags (see MODEL_TAGS) straight away. Invoice, Payment, StudentScore and
+StudentClass changes go through the outbox instead (core.outbox), whose
+consumer bumps each tag once per batch of events. Bulk writes skip model
+signals, so code that bulk-writes those models emits events or calls
+invalidate() itself.
+
+Hits and misses are counted per tier in each process and added to shared
+counters every STATS_FLUSH_SECONDS; ``manage.py cache_stats`` reports them.
+"""
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+TIERS = ('settings', 'reference', 'aggregates', 'fragments', 'pdfs')
+
+STATS_FLUSH_SECONDS = 30
+
+# Tags bumped when a row of the model is saved or deleted
+MODEL_TAGS = {
+    'finance.FeeType': lambda fee_type: ('fees',),
+    'finance.FeeStructure': lambda fee_structure: ('fees',),
+    'finance.Invoice': lambda invoice: ('invoices',),
+    'finance.Payment': lambda payment: ('payments', 'invoices'),
+    'students.StudentScore': lambda score: (
+        'scores', f"scores:{score.academic_session_id}:{score.term_id}",
+    ),
+    'students.StudentClass': lambda record: ('enrolment', f"enrolment:{record.academic_year_id}"),
+    'school_admin.SystemSettings': lambda system_settings: ('settings',),
+    # Report card PDFs carry the settings tag
+    'school_admin.GradingBand': lambda band: ('grading', 'settings'),
+}
+
+_MISSING = object()
+
+
+def tier(name):
+    """The cache for a tier; the default cache when the tier is not configured"""
+    return caches[name if name in settings.CACHES else 'default']
+
+
+# ======================
+# TAGS
+# ======================
+
+def _tag_key(tag):
+    return f"cache_tag:{tag}"
+
+
+def _new_version():
+    # Counters start from the clock, so a tag evicted from the cache never
+    # comes back with a version that entries were stored under
+    return time.time_ns() // 1000
+
+
+def tag_versions(tags):
+    """Current version of each tag"""
+    if not tags:
+        return {}
+    store = caches['default']
+    keys = {_tag_key(tag): tag for tag in tags}
+    found = store.get_many(keys)
+    if len(found) < len(keys):
+        for key in keys.keys() - found.keys():
+            store.add(key, _new_version(), None)
+        found = store.get_many(keys)
+    return {keys[key]: version for key, version in found.items()}
+
+
+def make_key(key, tags=()):
+    """``key`` with the current version of each tag appended"""
+    if not tags:
+        return key
+    versions = tag_versions(sorted(set(tags)))
+    return f"{key}|" + ",".join(f"{tag}.{versions[tag]}" for tag in sorted(versions))
+
+
+def _bump(tags):
+    store = caches['default']
+    for tag in tags:
+        key = _tag_key(tag)
+        try:
+            store.incr(key)
+        except ValueError:
+            store.set(key, _new_version(), None)
+
+
+def invalidate(*tags):
+    """
+    Bump each tag so entries stored under it are no longer found. Inside a
+    transaction the tags are bumped again on commit, dropping whatever
+    other processes cached from the old rows in the meantime.
+    """
+    tags = tuple(set(tags))
+    _bump(tags)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(tags))
+
+
+# ======================
+# READ / WRITE
+# ======================
+
+def get(name, key, default=None, tags=()):
+    value = tier(name).get(make_key(key, tags), _MISSING)
+    _record(name, value is not _MISSING)
+    return default if value is _MISSING else value
+
+
+def get_or_set(name, key, default, tags=(), timeout=_MISSING):
+    """
+    Cached value of ``key`` in tier ``name``; on a miss ``default`` (a value
+    or a callable) is stored and returned. ``timeout`` defaults to the tier's.
+    """
+    cache = tier(name)
+    versioned = make_key(key, tags)
+    value = cache.get(versioned, _MISSING)
+    _record(name, value is not _MISSING)
+    if value is _MISSING:
+        value = default() if callable(default) else default
+        if timeout is _MISSING:
+            cache.set(versioned, value)
+        else:
+            cache.set(versioned, value, timeout)
+    return value
+
+
+def delete(name, key, tags=()):
+    tier(name).delete(make_key(key, tags))
+
+
+def clear_all():
+    """Empty every configured cache (tests, or after a restore from backup)"""
+    for alias in settings.CACHES:
+        caches[alias].clear()
+    with _stats_lock:
+        _stats.clear()
+
+
+# ======================
+# SIGNALS
+# ======================
+
+def _model_changed(sender, instance, **kwargs):
+    invalidate(*MODEL_TAGS[sender._meta.label](instance))
+
+
+def connect_signals(exclude=()):
+    """Wire MODEL_TAGS, less ``exclude``, to post_save/post_delete (called from CoreConfig.ready)"""
+    for label in MODEL_TAGS.keys() - set(exclude):
+        for signal in (post_save, post_delete):
+            signal.connect(_model_changed, sender=label, dispatch_uid=f"cache_tags:{label}:{id(signal)}")
+
+
+# ======================
+# METRICS
+# ======================
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def _stats_key(name, outcome):
+    return f"cache_stats:{name}:{outcome}"
+
+
+def _record(name, hit):
+    global _last_flush
+    with _stats_lock:
+        _stats[(name, 'hits' if hit else 'misses')] += 1
+        due = time.monotonic() - _last_flush >= STATS_FLUSH_SECONDS
+        if due:
+            _last_flush = time.monotonic()
+    if due:
+        flush_stats()
+
+
+def flush_stats():
+    """Add this process's counts to the shared counters in the default cache"""
+    with _stats_lock:
+        pending = dict(_stats)
+        _stats.clear()
+    store = caches['default']
+    for (name, outcome), count in pending.items():
+        key = _stats_key(name, outcome)
+        # add() starts the counter; incr() is atomic on Redis
+        if not store.add(key, count, None):
+            try:
+                store.incr(key, count)
+            except ValueError:
+                store.set(key, count, None)
+
+
+def stats():
+    """{tier: {'hits', 'misses', 'hit_rate'}} across all processes, this one included"""
+    flush_stats()
+    store = caches['default']
+    counts = store.get_many([_stats_key(name, outcome) for name in TIERS for outcome in ('hits', 'misses')])
+    report = {}
+    for name in TIERS:
+        hits = counts.get(_stats_key(name, 'hits'), 0)
+        misses = counts.get(_stats_key(name, 'misses'), 0)
+        report[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+        }
+    return report
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+    caches['default'].delete_many([
+        _stats_key(name, outcome) for name in TIERS for outcome in ('hits', 'misses')
+    ])
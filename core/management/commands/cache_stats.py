@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import caching
+
+
+class Command(BaseCommand):
+    help = "Hit/miss counts of the cache tiers across all processes (see core.caching)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Zero the counters after reporting")
+        parser.add_argument('--clear', action='store_true', help="Empty every cache tier")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'Tier':<12} {'Backend':<16} {'Hits':>10} {'Misses':>10} {'Hit rate':>9}")
+        for name, counts in caching.stats().items():
+            backend = settings.CACHES.get(name, settings.CACHES['default'])['BACKEND'].rsplit('.', 1)[-1]
+            rate = f"{counts['hit_rate']:.1%}" if counts['hit_rate'] is not None else '-'
+            self.stdout.write(
+                f"{name:<12} {backend:<16} {counts['hits']:>10} {counts['misses']:>10} {rate:>9}"
+            )
+
+        if options['reset']:
+            caching.reset_stats()
+            self.stdout.write(self.style.SUCCESS("Counters reset"))
+        if options['clear']:
+            caching.clear_all()
+            self.stdout.write(self.style.SUCCESS("All cache tiers cleared"))
@@ -0,0 +1,47 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from core import outbox
+
+
+class Command(BaseCommand):
+    help = "Consume pending domain events from the outbox (see core.outbox)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the pending events and exit")
+        parser.add_argument('--batch-size', type=int, default=outbox.BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=outbox.POLL_SECONDS,
+                            help="Seconds to wait when nothing is pending")
+        parser.add_argument('--purge-after', type=int, default=7, metavar='DAYS',
+                            help="Delete events processed more than DAYS days ago (0 keeps them)")
+
+    def handle(self, *args, **options):
+        self.purge(options['purge_after'])
+        if options['once']:
+            count = outbox.drain(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Consumed {count} events"))
+            return
+
+        self.stdout.write(f"Consuming events ({outbox.pending_count()} pending), Ctrl-C to stop")
+        try:
+            while True:
+                close_old_connections()
+                try:
+                    consumed = outbox.consume(options['batch_size'])
+                except Exception:
+                    # Logged by consume(); the batch is retried after a pause
+                    consumed = 0
+                if not consumed:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def purge(self, days):
+        if days:
+            deleted = outbox.purge(timezone.now() - timedelta(days=days))
+            if deleted:
+                self.stdout.write(f"Purged {deleted} processed events")
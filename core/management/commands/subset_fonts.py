@@ -0,0 +1,45 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+ROBOTO_DIR = os.path.join(settings.BASE_DIR, 'static', 'Roboto', 'static')
+SUBSET_DIR = os.path.join(settings.BASE_DIR, 'static', 'Roboto', 'subset')
+
+# The faces the PDFs register (students.utils.register_fonts)
+FACES = ('Roboto-Regular', 'Roboto-Bold', 'Roboto-Italic', 'Roboto-BoldItalic')
+
+# Latin, Latin-1 and Latin Extended-A (names), punctuation, currency (₦) and ™
+UNICODES = [
+    *range(0x20, 0x7F), *range(0xA0, 0x180), *range(0x2000, 0x2070), *range(0x20A0, 0x20C1), 0x2122,
+]
+
+
+class Command(BaseCommand):
+    help = "Write Latin-only copies of the PDF Roboto faces to static/Roboto/subset (needs fonttools)"
+
+    def handle(self, *args, **options):
+        try:
+            from fontTools import subset
+        except ImportError:
+            raise CommandError("fonttools is not installed: pip install fonttools")
+
+        os.makedirs(SUBSET_DIR, exist_ok=True)
+        subset_options = subset.Options()
+        # Kerning and ligatures stay; hinting and other scripts' tables go
+        subset_options.hinting = False
+        subset_options.desubroutinize = True
+        subset_options.name_IDs = ['*']
+        subset_options.notdef_outline = True
+
+        for face in FACES:
+            source = os.path.join(ROBOTO_DIR, f'{face}.ttf')
+            target = os.path.join(SUBSET_DIR, f'{face}.ttf')
+            font = subset.load_font(source, subset_options)
+            subsetter = subset.Subsetter(subset_options)
+            subsetter.populate(unicodes=UNICODES)
+            subsetter.subset(font)
+            subset.save_font(font, target, subset_options)
+            before, after = os.path.getsize(source), os.path.getsize(target)
+            self.stdout.write(f"{face:<20} {before / 1024:>7.1f} KB -> {after / 1024:>6.1f} KB")
+        self.stdout.write(self.style.SUCCESS(f"Subsets written to {SUBSET_DIR}"))
@@ -0,0 +1,28 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+
+class DomainEvent(models.Model):
+    """
+    A change to a payment, invoice, score or class record, written in the
+    same transaction as the change itself (see core.outbox).
+    """
+    ACTIONS = [
+        ('saved', 'Saved'),
+        ('deleted', 'Deleted'),
+    ]
+
+    model = models.CharField(max_length=50)  # app label and model, e.g. 'finance.Payment'
+    object_id = models.BigIntegerField(null=True, blank=True)
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        # The consumer's queue: unprocessed events in id order
+        indexes = [models.Index(fields=['processed_at', 'id'])]
+
+    def __str__(self):
+        return f"{self.model} {self.object_id} {self.action}"
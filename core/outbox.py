@@ -0,0 +1,214 @@
+"""
+Transactional outbox for domain changes.
+
+Saving or deleting a Payment, Invoice, StudentScore or StudentClass writes
+a DomainEvent row in the same transaction (OUTBOX_MODELS lists the fields
+copied into its payload). Bulk writes send no model signals, so code that
+bulk-writes those models calls emit_many() itself. A rolled-back change
+takes its event with it. For the fields in OUTBOX_PREVIOUS the payload
+also has the value the row was loaded with, as ``previous_<field>``, so a
+handler sees where an update moved the row from.
+
+A consumer works through the events in batches and passes each batch to
+the handlers registered for its models:
+
+    from core import outbox
+
+    @outbox.handler('finance.Payment', 'finance.Invoice')
+    def refresh_totals(events):
+        ...
+
+A handler gets all the events of a batch at once, so it can collapse
+repeats: one cache bump per tag, one recomputation per invoice. The
+batch is handled and marked processed in one transaction. When a
+handler raises, the error is logged, nothing is marked and the batch is
+retried on the next pass.
+
+Run the consumer next to the web workers:
+
+    python manage.py consume_events              # polls every POLL_SECONDS
+    python manage.py consume_events --once       # drain and exit (cron)
+
+The Procfile runs it as the ``worker`` process and starts the web
+processes with OUTBOX_CONSUMER=1. Without that variable (and while DEBUG)
+settings.OUTBOX_INLINE is on: every transaction that emits events consumes
+them right after it commits, in the same process, so runserver, or a
+deployment without a worker, still keeps caches and snapshots current.
+The change is committed by then, so a failing handler is only logged; the
+request that made the change still succeeds.
+"""
+import logging
+from collections import defaultdict
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.utils import timezone
+
+from . import caching
+from .models import DomainEvent
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+POLL_SECONDS = 1
+
+# Fields copied from the row into the event payload
+OUTBOX_MODELS = {
+    'finance.Payment': ('invoice_id', 'student_id', 'payment_date', 'amount_paid', 'status'),
+    'finance.Invoice': ('student_id', 'academic_year_id', 'term_id', 'created_at'),
+    'students.StudentScore': ('student_id', 'subject_id', 'academic_session_id', 'term_id'),
+    'students.StudentClass': ('student_id', 'school_class_id', 'academic_year_id'),
+}
+
+# Fields whose loaded value is also in the payload, as previous_<field>
+OUTBOX_PREVIOUS = {
+    'finance.Payment': ('payment_date', 'invoice_id'),
+    'finance.Invoice': ('created_at',),
+}
+
+_handlers = defaultdict(list)
+
+
+def handler(*labels):
+    """Register ``func(events)`` for the events of the given models"""
+    def register(func):
+        for label in labels:
+            _handlers[label].append(func)
+        return func
+    return register
+
+
+# ======================
+# EMIT
+# ======================
+
+def _event(label, row, action):
+    if isinstance(row, dict):
+        object_id, get, previous = row.get('id'), row.get, row
+    else:
+        object_id, get = row.pk, lambda field: getattr(row, field, None)
+        previous = {f'previous_{field}': value for field, value in getattr(row, '_outbox_loaded', {}).items()}
+    payload = {field: get(field) for field in OUTBOX_MODELS[label]}
+    for field in OUTBOX_PREVIOUS.get(label, ()):
+        payload[f'previous_{field}'] = previous.get(f'previous_{field}')
+    return DomainEvent(model=label, object_id=object_id, action=action, payload=payload)
+
+
+def _remember(instance, fields):
+    # Read from __dict__: a deferred field is not worth a query here
+    instance._outbox_loaded = {field: instance.__dict__.get(field) for field in fields}
+
+
+def emit_many(label, rows, action='saved'):
+    """
+    Record changes to ``rows`` (instances, or dicts with the payload fields
+    and optionally 'id') of model ``label`` in the current transaction
+    """
+    events = [_event(label, row, action) for row in rows]
+    if not events:
+        return
+    DomainEvent.objects.bulk_create(events, batch_size=1000)
+    if getattr(settings, 'OUTBOX_INLINE', False):
+        # robust: the change is committed whatever the handlers do
+        transaction.on_commit(drain, robust=True)
+
+
+def emit(instance, action='saved'):
+    emit_many(instance._meta.label, [instance], action)
+
+
+def _model_loaded(sender, instance, **kwargs):
+    # New, unsaved instances have nothing to remember
+    if instance.pk is not None:
+        _remember(instance, OUTBOX_PREVIOUS[instance._meta.label])
+
+
+def _model_saved(sender, instance, **kwargs):
+    emit(instance, 'saved')
+    if instance._meta.label in OUTBOX_PREVIOUS:
+        # A later save of the same instance moves it from here
+        _remember(instance, OUTBOX_PREVIOUS[instance._meta.label])
+
+
+def _model_deleted(sender, instance, **kwargs):
+    emit(instance, 'deleted')
+
+
+def connect_signals():
+    """
+    Write events for OUTBOX_MODELS on post_save/post_delete and remember the
+    OUTBOX_PREVIOUS fields on post_init (called from CoreConfig.ready)
+    """
+    for label in OUTBOX_MODELS:
+        post_save.connect(_model_saved, sender=label, dispatch_uid=f"outbox:{label}:saved")
+        post_delete.connect(_model_deleted, sender=label, dispatch_uid=f"outbox:{label}:deleted")
+    for label in OUTBOX_PREVIOUS:
+        post_init.connect(_model_loaded, sender=label, dispatch_uid=f"outbox:{label}:loaded")
+
+
+# ======================
+# CONSUME
+# ======================
+
+def consume(batch_size=BATCH_SIZE):
+    """Handle one batch of pending events; returns how many there were"""
+    with transaction.atomic():
+        pending = DomainEvent.objects.filter(processed_at__isnull=True).order_by('id')
+        # Several consumers split the queue instead of waiting on each other
+        if connection.features.has_select_for_update_skip_locked:
+            pending = pending.select_for_update(skip_locked=True)
+        events = list(pending[:batch_size])
+        if not events:
+            return 0
+
+        batches = defaultdict(list)
+        for event in events:
+            for func in _handlers[event.model]:
+                batches[func].append(event)
+        for func, handled in batches.items():
+            try:
+                func(handled)
+            except Exception:
+                logger.exception(
+                    "Outbox handler %s failed on %d events; the batch of %d is retried",
+                    func.__qualname__, len(handled), len(events),
+                )
+                raise
+
+        DomainEvent.objects.filter(pk__in=[event.pk for event in events]).update(processed_at=timezone.now())
+    return len(events)
+
+
+def drain(batch_size=BATCH_SIZE):
+    """Consume until nothing is pending; returns the number of events"""
+    total = 0
+    while count := consume(batch_size):
+        total += count
+    return total
+
+
+def pending_count():
+    return DomainEvent.objects.filter(processed_at__isnull=True).count()
+
+
+def purge(before):
+    """Delete events processed before ``before``; returns how many"""
+    deleted, _ = DomainEvent.objects.filter(processed_at__lt=before).delete()
+    return deleted
+
+
+# ======================
+# HANDLERS
+# ======================
+
+@handler(*OUTBOX_MODELS)
+def invalidate_caches(events):
+    """Bump each cache tag the batch touched once (tags from caching.MODEL_TAGS)"""
+    tags = set()
+    for event in events:
+        tags.update(caching.MODEL_TAGS[event.model](SimpleNamespace(**event.payload)))
+    if tags:
+        caching.invalidate(*sorted(tags))
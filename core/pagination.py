@@ -0,0 +1,189 @@
+"""
+Keyset (cursor) pagination for long listings.
+
+Pages are fetched with ``WHERE (ordering columns) < cursor ... LIMIT n``
+instead of ``OFFSET``, so any page costs the same as the first one, and no
+``COUNT(*)`` runs per request. The total shown to users is an approximate
+count cached for a few minutes.
+
+    page = KeysetPaginator(queryset, 25, ordering=('-payment_date', '-id')).page(request)
+
+The last ordering field must be unique (normally ``id``) and none of the
+ordering fields may be NULL.
+"""
+import base64
+import hashlib
+import json
+
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.db.models import Q
+
+from . import caching
+
+CURSOR_PARAMS = ('after', 'before', 'last', 'page')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _field_name(ordering):
+    return ordering.lstrip('-')
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, fields):
+    """Cursor string -> Python values for ``fields`` (model fields, in ordering order)"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise ValueError
+        return [field.to_python(value) for field, value in zip(fields, values)]
+    except (ValueError, TypeError, ValidationError):
+        raise InvalidCursor(f"Invalid page cursor {cursor!r}")
+
+
+class KeysetPage:
+    """One page of results; iterates like a Django Page"""
+
+    def __init__(self, paginator, object_list, has_next, has_previous, params):
+        self.paginator = paginator
+        self.object_list = object_list
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+        self.params = params
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+    @property
+    def count(self):
+        """Approximate total number of rows (cached)"""
+        return self.paginator.count
+
+    def _query(self, **cursor):
+        params = self.params.copy()
+        for key in CURSOR_PARAMS:
+            params.pop(key, None)
+        for key, value in cursor.items():
+            params[key] = value
+        return params.urlencode()
+
+    @property
+    def first_query(self):
+        return self._query()
+
+    @property
+    def last_query(self):
+        return self._query(last='1')
+
+    @property
+    def next_query(self):
+        if not self.object_list:
+            return self._query()
+        return self._query(after=self.paginator.cursor_for(self.object_list[-1]))
+
+    @property
+    def previous_query(self):
+        if not self.object_list:
+            return self._query()
+        return self._query(before=self.paginator.cursor_for(self.object_list[0]))
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, per_page, ordering=('-id',), count_timeout=300):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.count_timeout = count_timeout
+        model = queryset.model
+        self.fields = [model._meta.get_field(_field_name(order)) for order in self.ordering]
+
+    @property
+    def count(self):
+        """
+        Row count cached per query for ``count_timeout`` seconds. It may lag
+        behind recent writes; use it for "about N results" labels only.
+        """
+        if not hasattr(self, '_count'):
+            try:
+                sql = str(self.queryset.order_by().query)
+            except EmptyResultSet:
+                self._count = 0
+            else:
+                key = f"keyset_count:{hashlib.md5(sql.encode()).hexdigest()}"
+                self._count = caching.get_or_set(
+                    'aggregates', key, self.queryset.order_by().count, timeout=self.count_timeout,
+                )
+        return self._count
+
+    def cursor_for(self, obj):
+        return encode_cursor([
+            field.value_to_string(obj) for field in self.fields
+        ])
+
+    def _seek(self, values, forward):
+        """Rows after (forward) or before the cursor row in this ordering"""
+        condition = Q()
+        for index, order in enumerate(self.ordering):
+            name = _field_name(order)
+            descending = order.startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            step = Q(**{f"{name}__{lookup}": values[index]})
+            for previous in range(index):
+                step &= Q(**{_field_name(self.ordering[previous]): values[previous]})
+            condition |= step
+        return condition
+
+    def _reverse(self):
+        return [order[1:] if order.startswith('-') else f"-{order}" for order in self.ordering]
+
+    def page(self, request):
+        """
+        Page selected by the request's ``after``/``before`` cursor or
+        ``last=1``; the first page otherwise. A bad cursor shows the first page.
+        """
+        params = request.GET
+        queryset = self.queryset
+        limit = self.per_page + 1
+
+        try:
+            if params.get('after'):
+                values = decode_cursor(params['after'], self.fields)
+                rows = list(queryset.filter(self._seek(values, forward=True)).order_by(*self.ordering)[:limit])
+                return KeysetPage(self, rows[:self.per_page], len(rows) > self.per_page, True, params)
+
+            if params.get('before'):
+                values = decode_cursor(params['before'], self.fields)
+                rows = list(queryset.filter(self._seek(values, forward=False)).order_by(*self._reverse())[:limit])
+                rows.reverse()
+                return KeysetPage(self, rows[-self.per_page:], True, len(rows) > self.per_page, params)
+        except InvalidCursor:
+            pass
+
+        if params.get('last'):
+            rows = list(queryset.order_by(*self._reverse())[:limit])
+            rows.reverse()
+            return KeysetPage(self, rows[-self.per_page:], False, len(rows) > self.per_page, params)
+
+        rows = list(queryset.order_by(*self.ordering)[:limit])
+        return KeysetPage(self, rows[:self.per_page], len(rows) > self.per_page, False, params)
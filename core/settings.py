@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -25,7 +26,7 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
-    'django.contrib.staticfiles',
+    'core.apps.StaticFilesConfig',  # django.contrib.staticfiles
     'django.contrib.humanize',
 
     'accounts',
@@ -34,7 +35,7 @@ INSTALLED_APPS = [
     "students",
     "academics",
     "finance",
-    
+    'core',
 ]
 
 MIDDLEWARE = [
@@ -66,6 +67,16 @@ TEMPLATES = [
     },
 ]
 
+if not DEBUG:
+    # Parse each template once per process (DEBUG keeps Django's reloading default)
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'core.wsgi.application'
 
 
@@ -92,6 +103,50 @@ else:
 
 
 
+# Caches
+# Named tiers used through core.caching. Redis in production (Django's own
+# backend, needs the redis package); one directory per tier locally.
+CACHE_TIERS = {
+    # tier: timeout in seconds
+    'default': 300,
+    'settings': 60 * 60,
+    'reference': 24 * 60 * 60,
+    'aggregates': 10 * 60,
+    'fragments': 60 * 60,
+    'pdfs': 24 * 60 * 60,
+}
+
+# Bump to drop every cached entry after a deploy that changes cached data
+CACHE_VERSION = 1
+
+if DEBUG:
+    CACHES = {
+        tier: {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': BASE_DIR / '.cache' / tier,
+            'TIMEOUT': timeout,
+            'VERSION': CACHE_VERSION,
+        }
+        for tier, timeout in CACHE_TIERS.items()
+    }
+else:
+    CACHES = {
+        tier: {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0'),
+            'KEY_PREFIX': f"alarabee:{tier}",
+            'TIMEOUT': timeout,
+            'VERSION': CACHE_VERSION,
+        }
+        for tier, timeout in CACHE_TIERS.items()
+    }
+
+# Domain events (core.outbox). Deployments run `manage.py consume_events`
+# (the Procfile's worker) and set OUTBOX_CONSUMER=1 on the web processes.
+# Without a consumer, and locally, each commit consumes its own events.
+OUTBOX_INLINE = DEBUG or not os.environ.get('OUTBOX_CONSUMER')
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -133,6 +188,16 @@ STATICFILES_DIRS = [BASE_DIR / 'static']  # your development static files
 # This is required for collectstatic in production
 STATIC_ROOT = BASE_DIR / 'staticfiles'  # folder where collectstatic will put all static files
 
+# Hashed, minified and precompressed on collectstatic; see core.staticfiles
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'core.staticfiles.StaticFilesStorage'},
+}
+
+# Deployments serve STATIC_ROOT from nginx (see core.staticfiles) and set
+# STATIC_FALLBACK=0. Otherwise Django answers /static/ itself when DEBUG is off.
+STATIC_FALLBACK = os.environ.get('STATIC_FALLBACK', '1') != '0'
+
 # Media files (user uploads)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
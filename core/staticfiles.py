@@ -0,0 +1,173 @@
+"""
+Static files for production: content-hashed, minified and precompressed.
+
+Build (run on every deploy, after pulling):
+
+    python manage.py subset_fonts
+    python manage.py collectstatic --noinput
+
+collectstatic goes through StaticFilesStorage below. CSS and JS files are
+minified before ManifestStaticFilesStorage hashes them, so {% static %}
+renders names like css/admin.3f2a9c1b04e7.css. Every hashed text file
+also gets a .gz copy, and a .br copy when the brotli package is installed.
+
+Deployments serve STATIC_ROOT from nginx in front of the ASGI server, which
+sends the precompressed copies itself and keeps static requests off the
+Python workers:
+
+    location /static/ {
+        alias /srv/school/staticfiles/;
+        gzip_static on;
+        brotli_static on;    # with ngx_brotli; drop the line without it
+        add_header Vary Accept-Encoding;
+        location ~ "[.][0-9a-f]{12}[.][a-z0-9]+$" {
+            add_header Cache-Control "public, max-age=31536000, immutable";
+            add_header Vary Accept-Encoding;
+        }
+    }
+
+and set STATIC_FALLBACK=0. Without a front-end server (and with DEBUG off)
+core.urls routes /static/ to serve() below as a fallback. It answers with
+the .br or .gz copy the browser accepts. Hashed names are sent with a
+one-year immutable Cache-Control, so repeat page loads fetch nothing.
+Other names are revalidated with If-Modified-Since.
+
+Minifying JS needs rjsmin; without it JS files are only compressed.
+"""
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+from functools import cache
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=0, must-revalidate'
+
+COMPRESS_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.map', '.txt', '.xml', '.ttf', '.otf', '.eot')
+
+# Smaller files gain less than the encoding headers cost
+MIN_COMPRESS_SIZE = 256
+
+_CSS_COMMENT = re.compile(r'/\*(?!!).*?\*/', re.S)
+_CSS_SPACE = re.compile(r'\s+')
+_CSS_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+
+
+def minify_css(css):
+    """Drop comments (except /*! ... */ licences) and the whitespace around punctuation"""
+    css = _CSS_COMMENT.sub('', css)
+    css = _CSS_SPACE.sub(' ', css)
+    css = _CSS_PUNCTUATION.sub(r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+def minify_js(js):
+    return rjsmin.jsmin(js, keep_bang_comments=True) if rjsmin else js
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+class StaticFilesStorage(ManifestStaticFilesStorage):
+    """Minify, then hash (ManifestStaticFilesStorage), then write .gz/.br copies"""
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            # Hash the minified copies in STATIC_ROOT, not the finders' originals
+            paths = {name: (self, name) if self.minify(name) else source for name, source in paths.items()}
+
+        yield from super().post_process(paths, dry_run, **options)
+
+        if not dry_run:
+            for name in set(self.hashed_files.values()):
+                self.compress(name)
+
+    def minify(self, name):
+        """Minify the collected copy of a CSS/JS file; True when it is a minified copy"""
+        root, extension = posixpath.splitext(name)
+        minifier = MINIFIERS.get(extension)
+        if minifier is None or root.endswith('.min'):
+            return False
+        path = self.path(name)
+        with open(path, encoding='utf-8') as f:
+            source = f.read()
+        minified = minifier(source)
+        # Unchanged when collectstatic kept last run's (already minified) copy
+        if minified != source:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(minified)
+        return True
+
+    def compress(self, name):
+        if not name.endswith(COMPRESS_EXTENSIONS):
+            return
+        path = self.path(name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+        encoded = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            encoded['.br'] = brotli.compress(data, quality=11)
+        for suffix, content in encoded.items():
+            # Not worth a second request format when it barely shrinks
+            if len(content) < len(data) * 0.95:
+                with open(path + suffix, 'wb') as f:
+                    f.write(content)
+
+
+@cache
+def _hashed_names():
+    return frozenset(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+
+def serve(request, path):
+    """A file from STATIC_ROOT, precompressed when the browser accepts it"""
+    name = posixpath.normpath(path).lstrip('/')
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, name)
+    except SuspiciousFileOperation:
+        raise Http404(path)
+    if not os.path.isfile(fullpath):
+        raise Http404(path)
+
+    mtime = os.stat(fullpath).st_mtime
+    hashed = name in _hashed_names()
+    if not hashed and not was_modified_since(request.headers.get('If-Modified-Since'), mtime):
+        return HttpResponseNotModified()
+
+    content_type, _ = mimetypes.guess_type(fullpath)
+    accepted = request.headers.get('Accept-Encoding', '')
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if candidate in accepted and os.path.isfile(fullpath + suffix):
+            encoding = candidate
+            fullpath += suffix
+            break
+
+    response = FileResponse(open(fullpath, 'rb'), content_type=content_type or 'application/octet-stream')
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Vary'] = 'Accept-Encoding'
+    response['Last-Modified'] = http_date(mtime)
+    response['Cache-Control'] = IMMUTABLE if hashed else REVALIDATE
+    return response
@@ -0,0 +1,79 @@
+"""
+{% fragment %}: cache a rendered block of a template in the 'fragments' tier.
+
+    {% load fragments %}
+    {% fragment "fees:filters" class_filter term_filter tags="fees" %}
+        ...
+    {% endfragment %}
+
+The entry is keyed on the fragment name and the values after it, and
+tagged with the reference-data version (see academics.reference) plus any
+``tags``, so editing a class, term, score type or tagged row re-renders
+it. ``skip=<expr>`` renders the block uncached while the expression is
+true, e.g. for a form bound to submitted data.
+
+A {% csrf_token %} inside the block is stored as a placeholder and
+replaced with the current request's token on every render.
+"""
+import hashlib
+
+from django import template
+from django.template.base import token_kwargs
+from django.utils.safestring import mark_safe
+
+from academics import reference
+from core import caching
+
+register = template.Library()
+
+CSRF_PLACEHOLDER = 'fragmentcsrftokenplaceholder'
+
+
+class FragmentNode(template.Node):
+    def __init__(self, nodelist, name, vary_on, tags, skip):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+        self.tags = tags
+        self.skip = skip
+
+    def render(self, context):
+        if self.skip is not None and self.skip.resolve(context):
+            return self.nodelist.render(context)
+
+        vary = ':'.join(str(var.resolve(context)) for var in self.vary_on)
+        key = f"fragment:{self.name.resolve(context)}:{hashlib.md5(vary.encode()).hexdigest()}"
+        tags = (reference.TAG,)
+        if self.tags is not None:
+            tags += tuple(str(self.tags.resolve(context)).split())
+
+        def render_block():
+            with context.push(csrf_token=CSRF_PLACEHOLDER):
+                return str(self.nodelist.render(context))
+
+        html = caching.get_or_set('fragments', key, render_block, tags=tags)
+        return mark_safe(html.replace(CSRF_PLACEHOLDER, str(context.get('csrf_token', ''))))
+
+
+@register.tag('fragment')
+def do_fragment(parser, token):
+    """{% fragment "name" [vary_on ...] [tags="a b"] [skip=expr] %}...{% endfragment %}"""
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires a fragment name")
+
+    vary_on = []
+    options = {}
+    for bit in bits[2:]:
+        kwarg = token_kwargs([bit], parser)
+        if kwarg:
+            options.update(kwarg)
+        else:
+            vary_on.append(parser.compile_filter(bit))
+    unknown = options.keys() - {'tags', 'skip'}
+    if unknown:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' got unknown option(s): {', '.join(sorted(unknown))}")
+
+    nodelist = parser.parse(('endfragment',))
+    parser.delete_first_token()
+    return FragmentNode(nodelist, parser.compile_filter(bits[1]), vary_on, options.get('tags'), options.get('skip'))
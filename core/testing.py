@@ -0,0 +1,75 @@
+"""
+Test helpers: a TestCase over a synthetic school, SQL fingerprints and
+duplicated-query reports.
+"""
+import re
+from collections import Counter
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from core import caching
+from school_admin.utils import generate_school
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN \((?:\s*\?\s*,?)+\)", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    """SQL with literals stripped, so the same query with other ids compares equal"""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def fingerprints(queries):
+    """Counter of fingerprints for captured queries"""
+    return Counter(fingerprint(query['sql']) for query in queries)
+
+
+def duplicated(queries, baseline=None, limit=5):
+    """
+    Fingerprints that run more than once (or more often than in ``baseline``),
+    most repeated first, as ``(count, fingerprint)`` pairs.
+    """
+    counts = fingerprints(queries)
+    before = fingerprints(baseline) if baseline is not None else Counter()
+    repeated = [
+        (count, sql) for sql, count in counts.items()
+        if count > max(before.get(sql, 0), 1)
+    ]
+    return sorted(repeated, reverse=True)[:limit]
+
+
+def format_duplicates(duplicates, width=300):
+    return '\n'.join(
+        f"  {count}x {sql[:width]}{'...' if len(sql) > width else ''}"
+        for count, sql in duplicates
+    )
+
+
+def capture(func, *args, **kwargs):
+    """Run ``func`` and return ``(result, captured queries)``"""
+    with CaptureQueriesContext(connection) as context:
+        result = func(*args, **kwargs)
+    return result, context.captured_queries
+
+
+class SchoolTestCase(TestCase):
+    """
+    TestCase over one synthetic school, created once per class from the
+    ``school`` arguments to generate_school(); the cache tiers are cleared
+    before every test.
+    """
+    school = dict(classes=1, students_per_class=2, subjects=1, score_types=1, terms=1)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.generated = generate_school(activate=True, **cls.school)
+
+    def setUp(self):
+        caching.clear_all()
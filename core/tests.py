@@ -0,0 +1,333 @@
+"""
+Query-count regression tests for every URL in core.urls, and tests of the
+cache tiers, fragment caching, static file serving and the outbox.
+
+Each GET view is requested against a small and a large synthetic school
+(see school_admin.utils.generate_school). The number of queries must not
+grow with the number of rows; when it does, the failure lists the SQL
+fingerprints that ran more often on the large school.
+
+    python manage.py test core --settings=core.test_settings
+"""
+import gzip
+import itertools
+import re
+import tempfile
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.db import transaction
+from django.template import Context, Template
+from django.test import Client, RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils import timezone
+
+from academics import reference
+from academics.models import SchoolClass, Term
+from finance import posting
+from finance.models import FeeStructure, FeeType, Invoice, Payment
+from school_admin.models import SystemSettings
+from school_admin.utils import generate_school
+from staff.models import TeacherSubject
+from students.models import StudentClass, StudentProfile, StudentScore
+
+from . import caching, outbox, staticfiles
+from .models import DomainEvent
+from .testing import SchoolTestCase, capture, duplicated, format_duplicates
+
+
+SMALL_SCHOOL = dict(classes=2, students_per_class=3, subjects=2, score_types=2, terms=2)
+LARGE_SCHOOL = dict(classes=3, students_per_class=12, subjects=5, score_types=3, terms=2)
+
+# URLs that cannot be measured meaningfully, with the reason
+SKIPPED = {
+    'logout': "ends the session",
+}
+
+# Extra queries a URL may run on the large school (keep this empty)
+ALLOWANCE = {}
+
+# Views already known to query per row. They are reported as skipped while
+# they still grow, and fail once fixed so the entry gets removed.
+KNOWN_PER_ROW = {
+    'teacher_reports': "class loaded per assignment",
+    'sponsorship_management': "current class looked up per sponsored student",
+}
+
+_PARAM = re.compile(r"<(?:\w+:)?(\w+)>")
+
+
+def project_urls(patterns=None, prefix=''):
+    """(route, name) for every routed view in core.urls, Django admin and media excluded"""
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    seen = set()
+    for pattern in patterns:
+        route = prefix + str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            if route == 'admin/':
+                continue
+            for url in project_urls(pattern.url_patterns, route):
+                if url not in seen:
+                    seen.add(url)
+                    yield url
+        elif isinstance(pattern, URLPattern) and pattern.name and not route.startswith('^'):
+            if (route, pattern.name) not in seen:
+                seen.add((route, pattern.name))
+                yield route, pattern.name
+
+
+class ViewQueryCountTests(TransactionTestCase):
+    # Student pages look up student id 2, so ids must restart for each school
+    reset_sequences = True
+
+    def school_objects(self, school):
+        """URL parameters and logins for the most recently generated school"""
+        academic_year = school['academic_year']
+        student = StudentProfile.objects.select_related('user').get(id=2)
+        invoice = Invoice.objects.filter(student=student).order_by('id').first()
+        school_class = SchoolClass.objects.filter(studentclass__student=student).first()
+        assignment = TeacherSubject.objects.filter(
+            academic_year=academic_year, class_assigned=school_class,
+        ).select_related('teacher__user').first()
+        return {
+            'params': {
+                'academic_year_id': academic_year.id,
+                'term_id': Term.objects.filter(academic_year=academic_year, is_current=True).first().id,
+                'class_id': school_class.id,
+                'subject_id': assignment.subject_id,
+                'student_id': student.id,
+                'teacher_id': assignment.teacher_id,
+                'invoice_id': invoice.id,
+                'payment_id': Payment.objects.filter(invoice__student=student).values_list('id', flat=True).first()
+                or Payment.objects.values_list('id', flat=True).first(),
+                'structure_id': FeeStructure.objects.values_list('id', flat=True).first(),
+                'type_id': FeeType.objects.values_list('id', flat=True).first(),
+            },
+            'users': {
+                'staff/': assignment.teacher.user,
+                'students/': student.user,
+                '': school['admin'],
+            },
+        }
+
+    def measure(self, size):
+        """Generate a school and capture the queries of every GET view"""
+        # Entries cached from the previous school would hide its queries
+        caching.clear_all()
+        school = generate_school(prefix='QC', seed=7, activate=True, **size)
+        objects = self.school_objects(school)
+
+        clients = {}
+        for prefix, user in objects['users'].items():
+            clients[prefix] = Client(raise_request_exception=False)
+            clients[prefix].force_login(user)
+
+        results = {}
+        for route, name in project_urls():
+            path = '/' + _PARAM.sub(lambda match: str(objects['params'][match.group(1)]), route)
+            client = next(clients[prefix] for prefix in clients if route.startswith(prefix))
+            # Roll back whatever a GET writes so later views see the same data
+            with transaction.atomic():
+                response, queries = capture(client.get, path)
+                transaction.set_rollback(True)
+            results[(route, name)] = (response.status_code, queries)
+        return results
+
+    def test_query_counts_do_not_grow_with_rows(self):
+        small = self.measure(SMALL_SCHOOL)
+
+        # Start again from an empty database with fresh ids
+        self._fixture_teardown()
+        self._fixture_setup()
+        large = self.measure(LARGE_SCHOOL)
+
+        for (route, name), (status, queries) in large.items():
+            with self.subTest(url=route, name=name):
+                if name in SKIPPED:
+                    self.skipTest(SKIPPED[name])
+                small_status, small_queries = small[(route, name)]
+                if status >= 500 or small_status >= 500:
+                    self.skipTest(f"view errors ({small_status} / {status})")
+
+                limit = len(small_queries) + ALLOWANCE.get(name, 0)
+                if name in KNOWN_PER_ROW:
+                    if len(queries) > limit:
+                        self.skipTest(f"known per-row queries: {KNOWN_PER_ROW[name]}")
+                    self.fail(f"{name} no longer grows with rows; remove it from KNOWN_PER_ROW")
+                if len(queries) > limit:
+                    self.fail(
+                        f"/{route} ran {len(queries)} queries on the large school, "
+                        f"{len(small_queries)} on the small one (limit {limit}).\n"
+                        f"Repeated SQL:\n{format_duplicates(duplicated(queries, small_queries))}"
+                    )
+
+
+class CacheTagTests(SchoolTestCase):
+    school = dict(SchoolTestCase.school, sponsorship_rate=0, payment_rate=0)
+
+    def setUp(self):
+        super().setUp()
+        self.builds = itertools.count()
+
+    def cached(self, tag):
+        """The number of builds so far for an entry under ``tag``"""
+        return caching.get_or_set('aggregates', f"test:{tag}", lambda: next(self.builds), tags=(tag,))
+
+    def assertInvalidates(self, write, *tags):
+        before = {tag: self.cached(tag) for tag in (*tags, 'untouched')}
+        # Outbox events are handled once the write commits
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        for tag in tags:
+            self.assertNotEqual(self.cached(tag), before[tag], tag)
+        self.assertEqual(self.cached('untouched'), before['untouched'])
+
+    def test_model_writes_bump_their_tags(self):
+        invoice = Invoice.objects.order_by('id').first()
+        score = StudentScore.objects.order_by('id').first()
+        record = StudentClass.objects.order_by('id').first()
+
+        self.assertInvalidates(invoice.save, 'invoices')
+        self.assertInvalidates(lambda: posting.record(Payment(
+            invoice=invoice, student_id=invoice.student_id, amount_paid=Decimal('1.00'),
+            payment_date=timezone.localdate(), payment_method='cash',
+        )), 'payments', 'invoices')
+        self.assertInvalidates(score.save, 'scores', f"scores:{score.academic_session_id}:{score.term_id}")
+        self.assertInvalidates(record.save, 'enrolment', f"enrolment:{record.academic_year_id}")
+        self.assertInvalidates(SystemSettings.get_settings().save, 'settings')
+
+    def test_rolled_back_write_keeps_the_entries(self):
+        before = self.cached('invoices')
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Invoice.objects.order_by('id').first().save()
+                transaction.set_rollback(True)
+        self.assertEqual(self.cached('invoices'), before)
+
+
+class FragmentTests(SimpleTestCase):
+    template = Template(
+        '{% load fragments %}{% fragment "test" vary tags="fees" %}{{ value }} {% csrf_token %}{% endfragment %}'
+    )
+
+    def setUp(self):
+        caching.clear_all()
+
+    def render(self, value, vary=1, csrf_token='token-1'):
+        return self.template.render(Context({'value': value, 'vary': vary, 'csrf_token': csrf_token}))
+
+    def test_key_follows_the_reference_version(self):
+        first = self.render('first')
+        self.assertIn('first', first)
+        self.assertIn('first', self.render('second'))
+
+        reference.invalidate()
+        self.assertIn('second', self.render('second'))
+
+    def test_vary_on_and_tags(self):
+        self.render('first')
+        self.assertIn('second', self.render('second', vary=2))
+        caching.invalidate('fees')
+        self.assertIn('third', self.render('third'))
+
+    def test_csrf_token_is_per_request(self):
+        self.render('first')
+        html = self.render('first', csrf_token='token-2')
+        self.assertIn('token-2', html)
+        self.assertNotIn('token-1', html)
+
+
+class StaticFilesTests(SimpleTestCase):
+    def setUp(self):
+        source, root = (Path(self.enterContext(tempfile.TemporaryDirectory())) for _ in range(2))
+        (source / 'css').mkdir()
+        (source / 'css' / 'site.css').write_text('/* Layout */\n' + 'body {\n    margin: 0;\n}\n' * 40)
+        self.enterContext(override_settings(
+            STATICFILES_DIRS=[source],
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+            STATIC_ROOT=root,
+            STORAGES={**settings.STORAGES, 'staticfiles': {'BACKEND': 'core.staticfiles.StaticFilesStorage'}},
+        ))
+        call_command('collectstatic', interactive=False, verbosity=0)
+        staticfiles._hashed_names.cache_clear()
+        self.addCleanup(staticfiles._hashed_names.cache_clear)
+        self.hashed = staticfiles_storage.stored_name('css/site.css')
+
+    def get(self, name, **headers):
+        return staticfiles.serve(RequestFactory().get(f"/static/{name}", headers=headers), name)
+
+    def test_hashed_name_is_immutable_and_precompressed(self):
+        self.assertRegex(self.hashed, r'^css/site\.[0-9a-f]{12}\.css$')
+        response = self.get(self.hashed, accept_encoding='gzip, deflate')
+        self.assertEqual(response['Cache-Control'], staticfiles.IMMUTABLE)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        css = gzip.decompress(b''.join(response.streaming_content)).decode()
+        self.assertEqual(css, staticfiles.minify_css(Path(settings.STATICFILES_DIRS[0], 'css', 'site.css').read_text()))
+
+        response = self.get(self.hashed)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        response.close()
+
+    def test_unhashed_name_is_revalidated(self):
+        response = self.get('css/site.css')
+        self.assertEqual(response['Cache-Control'], staticfiles.REVALIDATE)
+        response.close()
+        self.assertEqual(self.get('css/site.css', if_modified_since=response['Last-Modified']).status_code, 304)
+
+
+class OutboxTests(SchoolTestCase):
+    def setUp(self):
+        super().setUp()
+        outbox.drain()
+        self.invoice = Invoice.objects.order_by('id').first()
+        self.handled = []
+        self.failing = False
+        outbox.handler('finance.Invoice')(self.handle)
+        self.addCleanup(outbox._handlers['finance.Invoice'].remove, self.handle)
+
+    def handle(self, events):
+        if self.failing:
+            raise RuntimeError("handler failed")
+        self.handled.append([event.object_id for event in events])
+
+    def test_emit(self):
+        self.invoice.save()
+        event = DomainEvent.objects.get(processed_at__isnull=True)
+        self.assertEqual((event.model, event.object_id, event.action), ('finance.Invoice', self.invoice.pk, 'saved'))
+        self.assertEqual(event.payload['term_id'], self.invoice.term_id)
+
+        # A rolled-back change takes its event with it
+        with transaction.atomic():
+            self.invoice.delete()
+            transaction.set_rollback(True)
+        self.assertEqual(outbox.pending_count(), 1)
+
+    def test_drain_hands_each_handler_the_batch(self):
+        self.invoice.save()
+        self.invoice.save()
+        self.assertEqual(outbox.drain(), 2)
+        self.assertEqual(self.handled, [[self.invoice.pk, self.invoice.pk]])
+        self.assertEqual(outbox.pending_count(), 0)
+        self.assertEqual(outbox.drain(), 0)
+
+    def test_failed_batch_is_retried(self):
+        self.invoice.save()
+        self.failing = True
+        with self.assertLogs('core.outbox', 'ERROR'), self.assertRaises(RuntimeError):
+            outbox.drain()
+        self.assertEqual(outbox.pending_count(), 1)
+
+        self.failing = False
+        self.assertEqual(outbox.drain(), 1)
+        self.assertEqual(self.handled, [[self.invoice.pk]])
+
+    def test_inline_failure_does_not_fail_the_commit(self):
+        self.failing = True
+        with self.assertLogs('core.outbox', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            self.invoice.save()
+        self.assertEqual(outbox.pending_count(), 1)
@@ -0,0 +1,70 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from finance.models import FeeStructure, FeeType, Sponsorship
+from finance.utils import forecast, price_students
+from students.models import StudentProfile
+
+
+class Command(BaseCommand):
+    help = "Benchmark the invoice pricing engine on an in-memory school (no database writes)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=5000)
+        parser.add_argument('--fee-lines', type=int, default=6)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        fee_structures = [
+            FeeStructure(
+                fee_type=FeeType(pk=i, name=f"Fee {i}"),
+                amount=Decimal(rng.randrange(500000, 15000000)) / 100,
+            )
+            for i in range(1, options['fee_lines'] + 1)
+        ]
+
+        # Roughly: 5% full, 15% partial, 80% paying in full
+        students = []
+        for i in range(1, options['students'] + 1):
+            student = StudentProfile(pk=i, student_id=f"BENCH-{i:05d}")
+            roll = rng.random()
+            if roll < 0.05:
+                Sponsorship(student=student, sponsorship_type='full')
+            elif roll < 0.20:
+                Sponsorship(
+                    student=student,
+                    sponsorship_type='partial',
+                    percentage_covered=rng.choice([10, 25, 33, 50, 75]),
+                )
+            students.append(student)
+
+        timings = []
+        for _ in range(options['repeat']):
+            start = time.perf_counter()
+            quotes = price_students(students, fee_structures)
+            summary = forecast(quotes)
+            timings.append(time.perf_counter() - start)
+
+        # What-if: everyone on a 50% partial scholarship
+        start = time.perf_counter()
+        what_if = forecast(price_students(
+            students, fee_structures, coverage={s.pk: 50 for s in students}
+        ))
+        what_if_time = time.perf_counter() - start
+
+        self.stdout.write(f"Students: {summary['students']}, fee lines: {len(fee_structures)}")
+        self.stdout.write(f"Gross billing:          ₦{summary['gross_total']:,.2f}")
+        self.stdout.write(f"Sponsorship cost:       ₦{summary['sponsorship_cost']:,.2f}")
+        self.stdout.write(f"Projected collections:  ₦{summary['projected_collections']:,.2f}")
+        self.stdout.write(f"What-if (all 50%):      ₦{what_if['projected_collections']:,.2f}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Pricing: best {min(timings) * 1000:.1f} ms, "
+            f"mean {sum(timings) / len(timings) * 1000:.1f} ms over {len(timings)} runs; "
+            f"what-if {what_if_time * 1000:.1f} ms"
+        ))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from finance.search import rebuild, search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the student, sponsorship and invoice search index (and its full-text index)"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        counts = rebuild()
+        for kind, count in counts.items():
+            self.stdout.write(f"{kind.capitalize():<14} {count:>8}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {sum(counts.values())} entries in {time.perf_counter() - start:.1f}s "
+            f"(backend: {search_backend() or 'LIKE'})"
+        ))
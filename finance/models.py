@@ -1,6 +1,5 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
-from django.db import models
-from django.db.models import Sum
 from students.models import StudentProfile
 
 class Sponsorship(models.Model):
@@ -84,28 +83,17 @@ class Invoice(models.Model):
     amount_due = models.DecimalField(max_digits=10, decimal_places=2)
 
     status = models.CharField(max_length=20, choices=STATUS, default='unpaid')
+    # Bumped by every payment write; get_invoice_info's ETag is built from it
+    version = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def recalculate(self):
         """
-        Sync invoice amounts & status from payments.
+        Sync invoice amounts & status from payments and bump the version.
         """
-        total_paid = self.payments.filter(
-            status='completed'
-        ).aggregate(
-            total=Sum('amount_paid')
-        )['total'] or 0
-
-        self.amount_due = self.total_amount - total_paid
-
-        if total_paid <= 0:
-            self.status = 'unpaid'
-        elif total_paid < self.total_amount:
-            self.status = 'partial'
-        else:
-            self.status = 'paid'
-
-        self.save(update_fields=['amount_due', 'status'])
+        from .posting import post
+        post(self.pk)
+        self.refresh_from_db(fields=['amount_due', 'status', 'version'])
     
     
     def __str__(self):
@@ -113,6 +101,8 @@ class Invoice(models.Model):
     
     class Meta:
         unique_together = ('student', 'academic_year', 'term')
+        # Open invoices of a student (payment form lookup)
+        indexes = [models.Index(fields=['status', 'student'])]
 
 class InvoiceItem(models.Model):
     invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='items')
@@ -144,22 +134,37 @@ class Payment(models.Model):
     payment_method = models.CharField(max_length=20, choices=METHOD)
     status = models.CharField(max_length=20, choices=STATUS, default='completed')
     notes = models.TextField(blank=True)
+    # One-time token of the form that created it (see finance.posting)
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True, editable=False)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-payment_date', '-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['idempotency_key'], name='unique_payment_idempotency_key'),
+        ]
     
     def __str__(self):
         return f"Payment {self.id} - {self.student}"
 
     
-    def save(self, *args, **kwargs):
+    def save(self, *args, post=True, **kwargs):
         super().save(*args, **kwargs)
 
-        # Always resync invoice after saving payment
-        self.invoice.recalculate()
+        # Always resync invoice after saving payment (finance.posting passes post=False)
+        if post:
+            from .posting import post as post_balance
+            post_balance(self.invoice_id, 'changed', self.pk)
+
+    def delete(self, *args, post=True, **kwargs):
+        payment_id = self.pk
+        result = super().delete(*args, **kwargs)
+        if post:
+            from .posting import post as post_balance
+            post_balance(self.invoice_id, 'removed', payment_id)
+        return result
 
 
     
@@ -185,4 +190,66 @@ class Payment(models.Model):
             'failed': 'danger',
             'refunded': 'secondary',
         }
-        return colors.get(self.status, 'info')
\ No newline at end of file
+        return colors.get(self.status, 'info')
+
+class DailyFinanceSnapshot(models.Model):
+    """
+    Finance figures for one day, written by finance.snapshots (nightly with
+    ``manage.py snapshot_finance``). Trend charts add these rows up instead
+    of scanning payments and invoices.
+
+    Amounts inside the JSON breakdowns are decimal strings.
+    """
+    date = models.DateField(unique=True)
+
+    # Completed payments dated that day
+    collections = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    payments_count = models.PositiveIntegerField(default=0)
+    collections_by_method = models.JSONField(default=dict, encoder=DjangoJSONEncoder)  # method -> amount
+
+    # Invoices created that day, and the fees sponsorships waived on them
+    invoices_issued = models.PositiveIntegerField(default=0)
+    invoiced_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    sponsorship_cost = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    # Owed at the end of the day; rows of school_class_id, class_name,
+    # term_id, term_name, invoices and amount
+    outstanding = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    outstanding_by_class = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date']
+
+    def __str__(self):
+        return f"Finance snapshot {self.date}"
+
+
+class SearchEntry(models.Model):
+    """
+    One searchable student, sponsorship or invoice (see finance.search).
+
+    ``tokens`` holds the normalized words between single spaces and
+    ``trigrams`` their three-letter pieces, for typo-tolerant matching.
+    """
+    KINDS = [
+        ('student', 'Student'),
+        ('sponsorship', 'Sponsorship'),
+        ('invoice', 'Invoice'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KINDS)
+    object_id = models.PositiveIntegerField()
+    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, related_name='search_entries')
+    label = models.CharField(max_length=255)
+    tokens = models.TextField()
+    trigrams = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('kind', 'object_id')
+        indexes = [models.Index(fields=['kind', 'student'])]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}: {self.label}"
@@ -0,0 +1,202 @@
+"""
+Posting payments to invoice balances.
+
+Every change to an invoice's amount due and status goes through here:
+
+    payment, created = posting.record(Payment(...), key)    # new payment
+    posting.save_changes(payment, previous_invoice_id)      # edited payment
+    posting.remove(payment)                                 # deleted payment
+    posting.update_balances(Invoice.objects.filter(...))    # bulk resync
+
+record, save_changes and remove first lock the invoice row (SELECT ...
+FOR UPDATE), so cashiers posting to the same invoice queue up instead of
+both passing the amount-due check. The balance is then recomputed from the
+completed payments in one UPDATE, which also bumps Invoice.version
+(get_invoice_info's ETag). A posting is four queries: lock, payment
+write, balance UPDATE and the payment's outbox event (core.outbox).
+
+Once the transaction commits, balance_posted is sent with the invoice id,
+the payment id and what happened ('recorded', 'changed', 'removed' or
+'recalculated').
+
+Payment.save() and Payment.delete() post as well, so the Django admin and
+the shell keep balances right. The functions here call them with
+post=False and post once themselves.
+
+Idempotency
+-----------
+Every payment form carries a one-time key ({% idempotency_key %} from
+payment_filters, rendered as a hidden input). A double-click or a retry on
+a slow connection posts the same key again:
+
+    payment = posting.recorded(key)          # already recorded? (cache only)
+    payment, created = posting.record(Payment(...), key)
+
+Payment.idempotency_key is unique, so two concurrent submissions cannot
+both insert; the loser gets the winner's payment back. Keys of recent
+payments are also kept in the default cache tier for RECENT_KEYS_TIMEOUT,
+so retries are answered from there without touching the invoice again.
+"""
+import uuid
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.lookups import GreaterThan, LessThanOrEqual
+from django.dispatch import Signal
+
+from core import caching, outbox
+from .models import Invoice, Payment
+from .utils import completed_payments
+
+KEY_FIELD = 'idempotency_key'
+
+RECENT_KEYS_TIMEOUT = 15 * 60
+
+# Sent after commit with invoice_id, payment_id and kind
+balance_posted = Signal()
+
+
+class Overpayment(Exception):
+    def __init__(self, amount_due):
+        self.amount_due = amount_due
+        super().__init__(f"Payment amount cannot exceed amount due (₦{amount_due:,.2f}).")
+
+
+# ======================
+# BALANCES
+# ======================
+
+def update_balances(invoices):
+    """
+    Amount due, status and version of ``invoices`` (a queryset) from their
+    completed payments, in one UPDATE. Returns the number of invoices.
+
+    Sends no signals and emits no outbox events: callers record the change
+    (a Payment event, or an Invoice event from post()).
+    """
+    paid = completed_payments('pk')
+    count = invoices.update(
+        amount_due=F('total_amount') - paid,
+        status=Case(
+            When(LessThanOrEqual(F('total_amount'), paid), then=Value('paid')),
+            When(GreaterThan(paid, 0), then=Value('partial')),
+            default=Value('unpaid'),
+        ),
+        version=F('version') + 1,
+    )
+    return count
+
+
+def _lock(invoice_id):
+    """Lock the invoice row until the transaction ends; returns its amount due"""
+    return Invoice.objects.select_for_update().values_list('amount_due', flat=True).get(pk=invoice_id)
+
+
+def _announce(invoice_id, kind, payment_id=None):
+    transaction.on_commit(lambda: balance_posted.send(
+        sender=Invoice, invoice_id=invoice_id, payment_id=payment_id, kind=kind,
+    ))
+
+
+def post(invoice_id, kind='recalculated', payment_id=None):
+    """Recompute one invoice's balance under its row lock"""
+    with transaction.atomic():
+        invoice = Invoice.objects.select_for_update().values('id', *outbox.OUTBOX_MODELS['finance.Invoice']).get(pk=invoice_id)
+        update_balances(Invoice.objects.filter(pk=invoice_id))
+        # update() sends no post_save
+        outbox.emit_many('finance.Invoice', [invoice])
+        _announce(invoice_id, kind, payment_id)
+
+
+# ======================
+# PAYMENTS
+# ======================
+
+def record(payment, key=None, allow_overpayment=False):
+    """
+    Insert an unsaved Payment and post it: (payment, created).
+
+    Raises Overpayment when a completed payment is larger than the amount
+    due, unless ``allow_overpayment``. When ``key`` was used before,
+    nothing is written and the earlier payment comes back with
+    created=False.
+    """
+    payment.idempotency_key = key
+    try:
+        with transaction.atomic():
+            amount_due = _lock(payment.invoice_id)
+            if not allow_overpayment and payment.status == 'completed' and payment.amount_paid > amount_due:
+                # A resubmission that waited on the lock finds the balance already paid
+                existing = _by_key(key)
+                if existing:
+                    return existing, False
+                raise Overpayment(amount_due)
+            payment.save(post=False)
+            update_balances(Invoice.objects.filter(pk=payment.invoice_id))
+            _announce(payment.invoice_id, 'recorded', payment.pk)
+    except IntegrityError:
+        existing = _by_key(key)
+        if existing is None:
+            raise
+        return existing, False
+
+    if key:
+        caching.get_or_set('default', _cache_key(key), payment.pk, timeout=RECENT_KEYS_TIMEOUT)
+    return payment, True
+
+
+def save_changes(payment, previous_invoice_id=None):
+    """Save an edited payment and repost its invoice, and the one it moved from"""
+    invoice_ids = sorted({payment.invoice_id, previous_invoice_id} - {None})
+    with transaction.atomic():
+        # Always in id order, so two edits cannot deadlock
+        for invoice_id in invoice_ids:
+            _lock(invoice_id)
+        payment.save(post=False)
+        update_balances(Invoice.objects.filter(pk__in=invoice_ids))
+        for invoice_id in invoice_ids:
+            _announce(invoice_id, 'changed', payment.pk)
+
+
+def remove(payment):
+    """Delete a payment and repost its invoice"""
+    payment_id = payment.pk
+    with transaction.atomic():
+        _lock(payment.invoice_id)
+        payment.delete(post=False)
+        update_balances(Invoice.objects.filter(pk=payment.invoice_id))
+        _announce(payment.invoice_id, 'removed', payment_id)
+
+
+# ======================
+# IDEMPOTENCY
+# ======================
+
+def new_key():
+    return uuid.uuid4().hex
+
+
+def key_from(request):
+    """The submitted key, or None for clients that do not send one"""
+    key = request.POST.get(KEY_FIELD, '').strip()
+    return key[:Payment._meta.get_field(KEY_FIELD).max_length] or None
+
+
+def _cache_key(key):
+    return f"payment-key:{key}"
+
+
+def _by_key(key):
+    if not key:
+        return None
+    return Payment.objects.filter(idempotency_key=key).select_related('invoice').first()
+
+
+def recorded(key):
+    """The payment already recorded under ``key`` in the last few minutes, else None"""
+    if not key:
+        return None
+    payment_id = caching.get('default', _cache_key(key))
+    if payment_id is None:
+        return None
+    return Payment.objects.filter(pk=payment_id).select_related('invoice').first()
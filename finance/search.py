@@ -0,0 +1,456 @@
+"""
+Search index for students, sponsorships and invoices.
+
+Every indexed object has one SearchEntry row with its normalized words and
+their trigrams. Lookups use a full-text index when the database has one (an
+FTS5 table on SQLite, FULLTEXT indexes on MySQL; see ensure_search_backend)
+and LIKE over the entry table otherwise. Candidates are ranked the same way
+on every backend:
+
+    find('fatima bello', kinds=['student'], limit=10)
+
+Each query word must be the start of a word of the entry ('fat bel' finds
+Fatima Bello). When nothing matches, entries sharing enough trigrams with
+the query are returned instead, so small typos still find the student.
+
+List views filter their own queryset instead, with no cap and no fuzzy
+matches, so a search only ever narrows what the other filters selected:
+
+    invoices = search.filter_matching(invoices, 'bello', 'invoice')
+
+There every query word must appear somewhere in the entry's words, like
+the icontains filters the lists used before the index. With a full-text
+index the words' trigrams are matched there first, so LIKE only checks the
+entries it returns; words of one or two letters have no trigrams, and a
+query made only of those is checked with LIKE over every entry of the kind.
+
+finance.signals keeps entries current on save and delete. Code that bulk
+inserts students, sponsorships or invoices calls the index_* functions
+itself; ``manage.py rebuild_search_index`` rebuilds everything.
+"""
+import re
+import unicodedata
+
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from students.models import StudentProfile
+from .models import Invoice, SearchEntry, Sponsorship
+
+
+KINDS = ('student', 'sponsorship', 'invoice')
+
+# Words of a query that are used; the rest are ignored
+MAX_QUERY_WORDS = 8
+
+# Most results find() ranks for a typeahead
+MAX_RESULTS = 100
+
+# Share of the query's trigrams a fuzzy match must contain
+MIN_SIMILARITY = 0.3
+
+FTS_TABLE = 'finance_searchentry_fts'
+FULLTEXT_INDEXES = {
+    'tokens': 'finance_searchentry_tokens_ft',
+    'trigrams': 'finance_searchentry_trigrams_ft',
+}
+# InnoDB does not index words shorter than innodb_ft_min_token_size (3)
+FULLTEXT_MIN_WORD = 3
+# Three-letter words on InnoDB's default stopword list are not indexed either
+FULLTEXT_STOPWORDS = {'are', 'com', 'for', 'how', 'the', 'und', 'was', 'who', 'www'}
+
+CHUNK_SIZE = 1000
+
+_WORD = re.compile(r"[^\W_]+")
+
+# (vendor, database name) -> 'fts5', 'fulltext' or None
+_backends = {}
+
+
+# --- Text -----------------------------------------------------------------
+
+def normalize(text):
+    """Lowercase words without accents: "Adéọlá O'Brien" -> ['adeola', 'o', 'brien']"""
+    text = unicodedata.normalize('NFKD', str(text or ''))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return _WORD.findall(text.lower())
+
+
+def trigrams(words):
+    """
+    Three-letter pieces of each word plus its first and last two letters,
+    so a typo in a short name still leaves pieces in common. Words of up to
+    three letters are kept whole.
+    """
+    grams = set()
+    for word in words:
+        if len(word) <= 3:
+            grams.add(word)
+        else:
+            grams.update((word[:2], word[-2:]))
+            grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+def _student_words(student):
+    words = normalize(f"{student.user.first_name} {student.user.last_name} {student.student_id}")
+    # 'SYN-00042' is also found when typed as 'syn00042'
+    compact = ''.join(normalize(student.student_id))
+    if compact:
+        words.append(compact)
+    return words
+
+
+def _entry(kind, obj, student, label, words):
+    words = list(dict.fromkeys(words))
+    return SearchEntry(
+        kind=kind,
+        object_id=obj.pk,
+        student=student,
+        label=label[:255],
+        tokens=f" {' '.join(words)} ",
+        trigrams=f" {' '.join(sorted(trigrams(words)))} ",
+    )
+
+
+def _student_entries(ids):
+    for student in StudentProfile.objects.filter(id__in=ids).select_related('user'):
+        yield _entry(
+            'student', student, student,
+            f"{student.full_name} ({student.student_id})",
+            _student_words(student),
+        )
+
+
+def _sponsorship_entries(ids):
+    sponsorships = Sponsorship.objects.filter(id__in=ids).select_related('student__user')
+    for sponsorship in sponsorships:
+        student = sponsorship.student
+        sponsor = sponsorship.sponsor_name or sponsorship.display_type
+        yield _entry(
+            'sponsorship', sponsorship, student,
+            f"{sponsor} - {student.full_name} ({student.student_id})",
+            _student_words(student) + normalize(sponsorship.sponsor_name),
+        )
+
+
+def _invoice_entries(ids):
+    invoices = Invoice.objects.filter(id__in=ids).select_related('student__user', 'term', 'academic_year')
+    for invoice in invoices:
+        student = invoice.student
+        yield _entry(
+            'invoice', invoice, student,
+            f"Invoice #{invoice.id} - {student.full_name} ({student.student_id}), "
+            f"{invoice.term.get_name_display()} {invoice.academic_year.year}",
+            _student_words(student) + [str(invoice.id)],
+        )
+
+
+_BUILDERS = {
+    'student': _student_entries,
+    'sponsorship': _sponsorship_entries,
+    'invoice': _invoice_entries,
+}
+
+
+# --- Indexing -------------------------------------------------------------
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def _reindex(kind, ids):
+    count = 0
+    for chunk in _chunks(ids):
+        entries = list(_BUILDERS[kind](chunk))
+        with transaction.atomic():
+            SearchEntry.objects.filter(kind=kind, object_id__in=chunk).delete()
+            SearchEntry.objects.bulk_create(entries)
+        count += len(entries)
+    return count
+
+
+def index_students(student_ids, related=True):
+    """
+    (Re)index students and, with ``related``, their sponsorships and
+    invoices, whose entries carry the student's name.
+    """
+    student_ids = list(student_ids)
+    _reindex('student', student_ids)
+    if related:
+        index_sponsorships(Sponsorship.objects.filter(student_id__in=student_ids).values_list('id', flat=True))
+        index_invoices(Invoice.objects.filter(student_id__in=student_ids).values_list('id', flat=True))
+
+
+def index_sponsorships(sponsorship_ids):
+    return _reindex('sponsorship', sponsorship_ids)
+
+
+def index_invoices(invoice_ids):
+    return _reindex('invoice', invoice_ids)
+
+
+def remove(kind, object_ids):
+    SearchEntry.objects.filter(kind=kind, object_id__in=list(object_ids)).delete()
+
+
+def rebuild():
+    """Index every student, sponsorship and invoice from scratch; returns counts per kind"""
+    ensure_search_backend()
+    SearchEntry.objects.all().delete()
+    return {
+        'student': _reindex('student', StudentProfile.objects.values_list('id', flat=True)),
+        'sponsorship': _reindex('sponsorship', Sponsorship.objects.values_list('id', flat=True)),
+        'invoice': _reindex('invoice', Invoice.objects.values_list('id', flat=True)),
+    }
+
+
+# --- Full-text backends ---------------------------------------------------
+
+_SQLITE_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+        INSERT INTO {fts}(rowid, tokens, trigrams) VALUES (new.id, new.tokens, new.trigrams);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+        INSERT INTO {fts}({fts}, rowid, tokens, trigrams) VALUES ('delete', old.id, old.tokens, old.trigrams);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN
+        INSERT INTO {fts}({fts}, rowid, tokens, trigrams) VALUES ('delete', old.id, old.tokens, old.trigrams);
+        INSERT INTO {fts}(rowid, tokens, trigrams) VALUES (new.id, new.tokens, new.trigrams);
+    END""",
+]
+
+
+def _backend_key():
+    return connection.vendor, connection.settings_dict['NAME']
+
+
+def _mysql_fulltext_indexes(cursor):
+    cursor.execute(
+        "SELECT DISTINCT index_name FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND index_type = 'FULLTEXT'",
+        [SearchEntry._meta.db_table],
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def search_backend():
+    """'fts5', 'fulltext' or None (LIKE only), checked once per process"""
+    key = _backend_key()
+    if key not in _backends:
+        backend = None
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+                if cursor.fetchone():
+                    backend = 'fts5'
+            elif connection.vendor == 'mysql':
+                if set(FULLTEXT_INDEXES.values()) <= _mysql_fulltext_indexes(cursor):
+                    backend = 'fulltext'
+        _backends[key] = backend
+    return _backends[key]
+
+
+def ensure_search_backend():
+    """
+    Create the database's full-text index for SearchEntry if it is missing
+    (the finance app has no migrations to carry it). Returns the backend.
+    """
+    table = SearchEntry._meta.db_table
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                    f"tokens, trigrams, content='{table}', content_rowid='id')"
+                )
+                for statement in _SQLITE_TRIGGERS:
+                    cursor.execute(statement.format(fts=FTS_TABLE, table=table))
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+            elif connection.vendor == 'mysql':
+                existing = _mysql_fulltext_indexes(cursor)
+                for column, name in FULLTEXT_INDEXES.items():
+                    if name not in existing:
+                        cursor.execute(f"ALTER TABLE {table} ADD FULLTEXT INDEX {name} ({column})")
+    except DatabaseError:
+        # SQLite built without FTS5: searches fall back to LIKE
+        pass
+    _backends.pop(_backend_key(), None)
+    return search_backend()
+
+
+def _kind_filter(kinds):
+    return f"AND e.kind IN ({', '.join(['%s'] * len(kinds))})", list(kinds)
+
+
+def _fetch_ids(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _prefix_ids(words, kinds, limit):
+    """Ids of entries where every word starts an entry word, best first"""
+    backend = search_backend()
+    table = SearchEntry._meta.db_table
+    kind_sql, kind_params = _kind_filter(kinds)
+
+    if backend == 'fts5':
+        # Matching a word exactly as well as by prefix ranks it higher
+        expression = 'tokens : (' + ' AND '.join(f'("{word}" OR "{word}"*)' for word in words) + ')'
+        return _fetch_ids(
+            f"SELECT e.id FROM {FTS_TABLE} JOIN {table} e ON e.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s {kind_sql} ORDER BY bm25({FTS_TABLE}) LIMIT %s",
+            [expression, *kind_params, limit],
+        )
+
+    if backend == 'fulltext':
+        # Short words are not in the index; find() checks them afterwards
+        long_words = [word for word in words if len(word) >= FULLTEXT_MIN_WORD]
+        if long_words:
+            expression = ' '.join(f'+({word} {word}*)' for word in long_words)
+            return _fetch_ids(
+                f"SELECT e.id FROM {table} e "
+                f"WHERE MATCH(e.tokens) AGAINST (%s IN BOOLEAN MODE) {kind_sql} "
+                f"ORDER BY MATCH(e.tokens) AGAINST (%s IN BOOLEAN MODE) DESC LIMIT %s",
+                [expression, *kind_params, expression, limit],
+            )
+
+    entries = SearchEntry.objects.filter(kind__in=kinds)
+    for word in words:
+        entries = entries.filter(tokens__contains=f' {word}')
+    return list(entries.values_list('id', flat=True)[:limit])
+
+
+def _similar_ids(grams, kinds, limit):
+    """Ids of entries sharing trigrams with the query, most shared first"""
+    backend = search_backend()
+    table = SearchEntry._meta.db_table
+    kind_sql, kind_params = _kind_filter(kinds)
+
+    if backend == 'fts5':
+        expression = 'trigrams : (' + ' OR '.join(f'"{gram}"' for gram in grams) + ')'
+        return _fetch_ids(
+            f"SELECT e.id FROM {FTS_TABLE} JOIN {table} e ON e.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s {kind_sql} ORDER BY bm25({FTS_TABLE}) LIMIT %s",
+            [expression, *kind_params, limit],
+        )
+
+    if backend == 'fulltext':
+        expression = ' '.join(grams)
+        return _fetch_ids(
+            f"SELECT e.id FROM {table} e "
+            f"WHERE MATCH(e.trigrams) AGAINST (%s) {kind_sql} "
+            f"ORDER BY MATCH(e.trigrams) AGAINST (%s) DESC LIMIT %s",
+            [expression, *kind_params, expression, limit],
+        )
+
+    condition = Q()
+    for gram in grams:
+        condition |= Q(trigrams__contains=f' {gram} ')
+    return list(SearchEntry.objects.filter(condition, kind__in=kinds).values_list('id', flat=True)[:limit])
+
+
+# --- Queries --------------------------------------------------------------
+
+def _rank(entry, words, grams):
+    """
+    (query words starting an entry word, score): exact words score 2,
+    prefixes 1, plus the share of the query's trigrams the entry has.
+    """
+    entry_words = entry.tokens.split()
+    found = score = 0
+    for word in words:
+        if word in entry_words:
+            found += 1
+            score += 2
+        elif any(entry_word.startswith(word) for entry_word in entry_words):
+            found += 1
+            score += 1
+    shared = len(grams & set(entry.trigrams.split())) / len(grams)
+    return found, score + shared, shared
+
+
+def find(query, kinds=KINDS, limit=10):
+    """
+    SearchEntry rows matching ``query``, best first, each with a ``score``.
+
+    Entries where every query word starts an entry word come first; exact
+    words rank above prefixes. With no such entry, trigram matches above
+    MIN_SIMILARITY are returned instead.
+    """
+    words = list(dict.fromkeys(normalize(query)))[:MAX_QUERY_WORDS]
+    kinds = [kind for kind in kinds if kind in KINDS]
+    if not words or not kinds:
+        return []
+
+    grams = trigrams(words)
+    candidates = min(limit * 4, MAX_RESULTS * 2)
+    ids = _prefix_ids(words, kinds, candidates)
+    fuzzy = not ids
+    if fuzzy:
+        ids = _similar_ids(sorted(grams), kinds, candidates)
+
+    results = []
+    for chunk in _chunks(ids):
+        for entry in SearchEntry.objects.filter(id__in=chunk):
+            found, entry.score, shared = _rank(entry, words, grams)
+            # The full-text index may skip short words; check every word here
+            if (shared < MIN_SIMILARITY) if fuzzy else (found < len(words)):
+                continue
+            results.append(entry)
+
+    results.sort(key=lambda entry: (-entry.score, KINDS.index(entry.kind), entry.label))
+    return results[:limit]
+
+
+def matching_ids(query, kind, limit=10):
+    """Ids of the best ``kind`` objects for ``query``, ranked as find() does"""
+    return [entry.object_id for entry in find(query, [kind], limit)]
+
+
+def _containing_ids(words):
+    """
+    Raw subquery of entry ids that have the trigrams of every word, or
+    None without a full-text index or a word of three letters or more.
+    An entry word containing a query word has all of its trigrams, so this
+    only narrows the entries LIKE checks.
+    """
+    grams = sorted({word[i:i + 3] for word in words for i in range(len(word) - 2)})
+    backend = search_backend()
+    if not grams or backend is None:
+        return None
+
+    if backend == 'fts5':
+        expression = 'trigrams : (' + ' AND '.join(f'"{gram}"' for gram in grams) + ')'
+        return RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [expression])
+
+    grams = [gram for gram in grams if gram not in FULLTEXT_STOPWORDS]
+    if not grams:
+        return None
+    expression = ' '.join(f'+{gram}' for gram in grams)
+    return RawSQL(
+        f"SELECT id FROM {SearchEntry._meta.db_table} WHERE MATCH(trigrams) AGAINST (%s IN BOOLEAN MODE)",
+        [expression],
+    )
+
+
+def filter_matching(queryset, query, kind, field='id'):
+    """
+    ``queryset`` narrowed to the rows whose ``field`` is the id of a ``kind``
+    object with every query word somewhere in its words. One subquery, so
+    the database applies it together with the view's other filters.
+    """
+    words = list(dict.fromkeys(normalize(query)))[:MAX_QUERY_WORDS]
+    if not words:
+        return queryset
+    entries = SearchEntry.objects.filter(kind=kind)
+    candidates = _containing_ids(words)
+    if candidates is not None:
+        entries = entries.filter(id__in=candidates)
+    for word in words:
+        entries = entries.filter(tokens__contains=word)
+    return queryset.filter(**{f'{field}__in': entries.values('object_id')})
@@ -0,0 +1,89 @@
+# finance/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from accounts.models import User
+from core import outbox
+from students.models import StudentProfile
+from . import search, snapshots
+from .utils import cached_invoice_summary, invoice_etag
+from .models import Invoice, Sponsorship
+
+
+@receiver(post_save, sender=User)
+def reindex_student_user(sender, instance, update_fields=None, **kwargs):
+    """Student names live on the user; refresh every entry that shows them"""
+    # Logins save last_login only
+    if instance.role != 'student' or (update_fields and not {'first_name', 'last_name'} & set(update_fields)):
+        return
+    student_ids = list(StudentProfile.objects.filter(user=instance).values_list('id', flat=True))
+    if student_ids:
+        search.index_students(student_ids)
+
+
+@receiver(post_save, sender=StudentProfile)
+def reindex_student(sender, instance, created, **kwargs):
+    # A new student has no sponsorship or invoices yet
+    search.index_students([instance.pk], related=not created)
+
+
+@receiver(post_save, sender=Sponsorship)
+def reindex_sponsorship(sender, instance, **kwargs):
+    search.index_sponsorships([instance.pk])
+
+
+@receiver(post_save, sender=Invoice)
+def reindex_invoice(sender, instance, update_fields=None, **kwargs):
+    # Payments only touch amounts, status and version, which are not searchable
+    if update_fields and set(update_fields) <= {'amount_due', 'status', 'version'}:
+        return
+    search.index_invoices([instance.pk])
+
+
+@receiver(post_delete, sender=Sponsorship)
+@receiver(post_delete, sender=Invoice)
+def remove_entry(sender, instance, **kwargs):
+    # Student entries go with the student (foreign key cascade)
+    search.remove(sender._meta.model_name, [instance.pk])
+
+
+@outbox.handler('finance.Payment')
+def warm_invoice_summaries(events):
+    """
+    Payments moved these balances: rebuild each invoice's summary once, so
+    the next payment form lookup is a cache hit
+    """
+    for invoice_id in sorted({event.payload['invoice_id'] for event in events}):
+        etag = invoice_etag(invoice_id)
+        if etag is not None:
+            cached_invoice_summary(invoice_id, etag)
+
+
+@outbox.handler('finance.Payment', 'finance.Invoice')
+def refresh_past_snapshots(events):
+    """
+    Payments rewrite the collections of the days they were and are dated
+    on, invoices the issued figures of the days they were and are created
+    on; either rewrites what their class and term owed on every written day
+    since
+    """
+    collection_days, issue_days, invoices, invoice_ids = set(), set(), set(), set()
+    for event in events:
+        payload = event.payload
+        if event.model == 'finance.Payment':
+            collection_days |= {
+                parse_date(payload[field]) for field in ('payment_date', 'previous_payment_date') if payload.get(field)
+            }
+            invoice_ids |= {payload[field] for field in ('invoice_id', 'previous_invoice_id') if payload.get(field)}
+        else:
+            issue_days |= {
+                timezone.localdate(parse_datetime(payload[field]))
+                for field in ('created_at', 'previous_created_at') if payload.get(field)
+            }
+            invoices.add((payload['student_id'], payload['academic_year_id'], payload['term_id']))
+    invoices |= set(
+        Invoice.objects.filter(id__in=invoice_ids).values_list('student_id', 'academic_year_id', 'term_id')
+    )
+    snapshots.refresh(invoices, collection_days, issue_days)
@@ -0,0 +1,310 @@
+"""
+Daily finance snapshots for the dashboard's trend charts.
+
+    snapshots.take(day)                        # write or rewrite one day's row
+    snapshots.take_range(start, end)           # backfill
+    snapshots.monthly_collections(first, 7)    # seven calendar months
+
+Each DailyFinanceSnapshot row holds a day's collections by payment method,
+the invoices issued and the fees sponsorships waived on them, and what was
+still owed at the end of the day per class and term. A row costs four
+grouped queries, and charts then read one row per day instead of
+aggregating the payments table.
+
+``manage.py snapshot_finance`` rewrites yesterday and today; run it nightly
+just after midnight, and with --from once to backfill history. Today's row
+is partial until the next run, so the dashboard adds today's payments live.
+
+A payment dated in the past (or moved from one day to another) changes
+days that are already written: the collections of its old and new day,
+and what its class and term owed at the end of every day from then on. An
+invoice created with an earlier date, or deleted, changes the issued
+figures of its day and the outstanding amounts from then on as well. The
+outbox handler in finance.signals rewrites those rows with refresh(); the
+nightly run only ever rewrites yesterday and today.
+"""
+from bisect import bisect_right
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+
+from academics import reference
+from students.models import StudentClass
+from .models import DailyFinanceSnapshot, FeeStructure, Invoice, InvoiceItem, Payment
+from .utils import completed_payments
+
+ZERO = Decimal('0.00')
+
+CENT = Decimal('0.01')
+
+
+def add_months(day, months):
+    """First day of the calendar month ``months`` after the month of ``day``"""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _money(expression):
+    return Coalesce(expression, Value(ZERO), output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+def _invoice_class(student_ref, academic_year_ref):
+    """The class a student was in during the invoice's academic year"""
+    return Subquery(
+        StudentClass.objects.filter(
+            student=OuterRef(student_ref), academic_year=OuterRef(academic_year_ref),
+        ).order_by('-is_current', '-id').values('school_class')[:1]
+    )
+
+
+# ======================
+# FIGURES
+# ======================
+
+def collections(day):
+    """Completed payments dated ``day``, in total and per payment method"""
+    rows = (
+        Payment.objects.filter(payment_date=day, status='completed')
+        .values('payment_method')
+        .annotate(amount=Sum('amount_paid'), count=Count('id'))
+        .order_by('payment_method')
+    )
+    by_method = {row['payment_method']: row['amount'].quantize(CENT) for row in rows}
+    return {
+        'collections': sum(by_method.values(), ZERO),
+        'payments_count': sum(row['count'] for row in rows),
+        'collections_by_method': by_method,
+    }
+
+
+def issued(day):
+    """Invoices created on ``day``, their total and the fees sponsorships waived"""
+    invoices = Invoice.objects.filter(created_at__date=day).aggregate(
+        count=Count('id'), amount=_money(Sum('total_amount')),
+    )
+    # Items are stored net of the sponsorship; the fee structure has the gross
+    gross = FeeStructure.objects.filter(
+        fee_type=OuterRef('fee_type'),
+        school_class=OuterRef('school_class_id'),
+        academic_year=OuterRef('invoice__academic_year'),
+        term=OuterRef('invoice__term'),
+    ).values('amount')[:1]
+    waived = (
+        InvoiceItem.objects.filter(invoice__created_at__date=day)
+        .annotate(school_class_id=_invoice_class('invoice__student', 'invoice__academic_year'))
+        .annotate(gross=Coalesce(Subquery(gross), F('amount')))
+        .aggregate(total=_money(Sum(F('gross') - F('amount'))))
+    )
+    return {
+        'invoices_issued': invoices['count'],
+        'invoiced_amount': invoices['amount'],
+        'sponsorship_cost': waived['total'],
+    }
+
+
+def outstanding(day):
+    """What was owed at the end of ``day``, in total and per (class, term)"""
+    rows = (
+        Invoice.objects.filter(created_at__date__lte=day)
+        .annotate(
+            school_class_id=_invoice_class('student', 'academic_year'),
+            owed=F('total_amount') - completed_payments('pk', until=day),
+        )
+        .filter(owed__gt=0)
+        .values('school_class_id', 'term_id')
+        .annotate(invoices=Count('id'), amount=Sum('owed'))
+        .order_by('school_class_id', 'term_id')
+    )
+    data = reference.snapshot()
+    breakdown = [
+        _breakdown_row(data, row['school_class_id'], row['term_id'], row['invoices'], row['amount'])
+        for row in rows
+    ]
+    return {
+        'outstanding': sum((row['amount'] for row in breakdown), ZERO),
+        'outstanding_by_class': breakdown,
+    }
+
+
+def _breakdown_row(data, school_class_id, term_id, invoices, amount):
+    school_class, term = data.school_class(school_class_id), data.term(term_id)
+    return {
+        'school_class_id': school_class_id,
+        'class_name': school_class.name if school_class else 'Unassigned',
+        'term_id': term_id,
+        'term_name': str(term) if term else '',
+        'invoices': invoices,
+        'amount': amount.quantize(CENT),
+    }
+
+
+def _breakdown_order(row):
+    # Class then term, as outstanding() orders them
+    return row['school_class_id'] is not None, row['school_class_id'] or 0, row['term_id']
+
+
+# ======================
+# SNAPSHOTS
+# ======================
+
+def take(day=None):
+    """Write (or rewrite) the snapshot of ``day``, today by default"""
+    day = day or timezone.localdate()
+    snapshot, _ = DailyFinanceSnapshot.objects.update_or_create(
+        date=day, defaults={**collections(day), **issued(day), **outstanding(day)},
+    )
+    return snapshot
+
+
+def take_range(start, end):
+    """Snapshots of every day from ``start`` to ``end`` inclusive; returns how many"""
+    day, count = start, 0
+    while day <= end:
+        take(day)
+        day += timedelta(days=1)
+        count += 1
+    return count
+
+
+def first_day():
+    """The earliest day with a payment or an invoice, or None"""
+    days = [
+        Payment.objects.order_by('payment_date').values_list('payment_date', flat=True).first(),
+        Invoice.objects.order_by('created_at').values_list('created_at__date', flat=True).first(),
+    ]
+    days = [day for day in days if day is not None]
+    return min(days) if days else None
+
+
+def _groups(invoices):
+    """(class, term) of each (student id, academic year id, term id), as _invoice_class() picks the class"""
+    invoices = set(invoices)
+    classes = {}
+    records = StudentClass.objects.filter(
+        student_id__in={student_id for student_id, _, _ in invoices},
+        academic_year_id__in={year_id for _, year_id, _ in invoices},
+    ).order_by('is_current', 'id').values_list('student_id', 'academic_year_id', 'school_class_id')
+    # Ascending, so the record _invoice_class() takes first is set last
+    for student_id, year_id, school_class_id in records:
+        classes[(student_id, year_id)] = school_class_id
+    return {(classes.get((student_id, year_id)), term_id) for student_id, year_id, term_id in invoices}
+
+
+def _owed(groups, days):
+    """
+    {(class id, term id): {day: (invoices, amount)}} owed at the end of each
+    of ``days`` on the invoices of ``groups``: two queries, whatever the
+    number of days
+    """
+    invoices = [
+        invoice for invoice in Invoice.objects.filter(term_id__in={term_id for _, term_id in groups})
+        .annotate(school_class_id=_invoice_class('student', 'academic_year'))
+        .values('id', 'school_class_id', 'term_id', 'total_amount', 'created_at')
+        if (invoice['school_class_id'], invoice['term_id']) in groups
+    ]
+    payments = {}
+    for invoice_id, payment_date, amount in (
+        Payment.objects.filter(invoice_id__in=[invoice['id'] for invoice in invoices], status='completed')
+        .order_by('payment_date').values_list('invoice_id', 'payment_date', 'amount_paid')
+    ):
+        dates, amounts = payments.setdefault(invoice_id, ([], []))
+        dates.append(payment_date)
+        amounts.append(amount)
+
+    owed = {group: {day: (0, ZERO) for day in days} for group in groups}
+    for invoice in invoices:
+        created = timezone.localdate(invoice['created_at'])
+        dates, amounts = payments.get(invoice['id'], ([], []))
+        paid = [ZERO, *accumulate(amounts)]
+        by_day = owed[(invoice['school_class_id'], invoice['term_id'])]
+        for day in days:
+            if created > day:
+                continue
+            amount = invoice['total_amount'] - paid[bisect_right(dates, day)]
+            if amount > 0:
+                count, total = by_day[day]
+                by_day[day] = (count + 1, total + amount)
+    return owed
+
+
+def refresh(invoices=(), collection_days=(), issue_days=()):
+    """
+    Rewrite the already written rows that changes to payments and invoices
+    affect: the collections of ``collection_days``, the issued figures of
+    ``issue_days``, and, on every written day from the earliest of them up
+    to today, what the classes and terms of ``invoices`` ((student id,
+    academic year id, term id) triples) owed.
+
+    Only those classes and terms are recomputed, with a fixed number of
+    queries however many days that spans; the other rows of each day's
+    breakdown are kept. Returns how many rows were rewritten.
+    """
+    collection_days, issue_days = set(collection_days), set(issue_days)
+    days = collection_days | issue_days
+    if not days:
+        return 0
+    rows = list(DailyFinanceSnapshot.objects.filter(date__gte=min(days), date__lte=timezone.localdate()))
+    if not rows:
+        return 0
+
+    fields = ['outstanding', 'outstanding_by_class']
+    if collection_days:
+        fields += ['collections', 'payments_count', 'collections_by_method']
+    if issue_days:
+        fields += ['invoices_issued', 'invoiced_amount', 'sponsorship_cost']
+
+    groups = _groups(invoices)
+    owed = _owed(groups, [row.date for row in rows])
+    data = reference.snapshot()
+    for row in rows:
+        breakdown = [
+            entry for entry in row.outstanding_by_class
+            if (entry['school_class_id'], entry['term_id']) not in groups
+        ]
+        for (school_class_id, term_id), by_day in owed.items():
+            count, amount = by_day[row.date]
+            if count:
+                breakdown.append(_breakdown_row(data, school_class_id, term_id, count, amount))
+        breakdown.sort(key=_breakdown_order)
+        row.outstanding_by_class = breakdown
+        row.outstanding = sum((Decimal(entry['amount']) for entry in breakdown), ZERO)
+
+        figures = {}
+        if row.date in collection_days:
+            figures.update(collections(row.date))
+        if row.date in issue_days:
+            figures.update(issued(row.date))
+        for field, value in figures.items():
+            setattr(row, field, value)
+
+    DailyFinanceSnapshot.objects.bulk_update(rows, fields)
+    return len(rows)
+
+
+# ======================
+# TRENDS
+# ======================
+
+def monthly_collections(first_month, months, until=None):
+    """
+    Collections per calendar month for ``months`` months from the month of
+    ``first_month``, as (month start, amount) pairs, from snapshot rows
+    dated before ``until`` (exclusive; every row when None)
+    """
+    start, end = add_months(first_month, 0), add_months(first_month, months)
+    rows = DailyFinanceSnapshot.objects.filter(date__gte=start, date__lt=end)
+    if until is not None:
+        rows = rows.filter(date__lt=until)
+    totals = dict(
+        rows.annotate(month=TruncMonth('date')).order_by('month')
+        .values('month').annotate(total=Sum('collections')).values_list('month', 'total')
+    )
+    return [(add_months(start, i), totals.get(add_months(start, i), ZERO)) for i in range(months)]
+
+
+amonthly_collections = sync_to_async(monthly_collections)
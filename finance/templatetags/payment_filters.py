@@ -1,5 +1,8 @@
 # finance/templatetags/payment_filters.py
 from django import template
+from django.utils.html import format_html
+
+from finance import posting
 
 register = template.Library()
 
@@ -41,3 +44,9 @@ def percentage(value, total):
         return (value / total) * 100
     return 0
 
+
+
+@register.simple_tag
+def idempotency_key():
+    """Hidden one-time key for a payment form; never put it inside a cached fragment"""
+    return format_html('<input type="hidden" name="{}" value="{}">', posting.KEY_FIELD, posting.new_key())
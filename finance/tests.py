@@ -1,3 +1,396 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase, skipUnlessDBFeature
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from academics.models import AcademicYear
+from core import caching, outbox
+from core.models import DomainEvent
+from core.testing import SchoolTestCase
+from school_admin.utils import generate_school
+from students.models import StudentClass, StudentProfile
+from . import posting, search, snapshots
+from .models import DailyFinanceSnapshot, FeeStructure, Invoice, Payment, SearchEntry, Sponsorship
+from .utils import (
+    cached_invoice_summary, discount_amount, invoice_etag, price_students, projected_revenue, sponsorship_coverage,
+)
+
+
+def fee(amount):
+    return SimpleNamespace(amount=Decimal(amount))
+
+
+def student(pk, sponsorship=None):
+    return SimpleNamespace(pk=pk, sponsorship=sponsorship)
+
+
+class PricingTests(SimpleTestCase):
+    fees = [fee('10000.00'), fee('3333.33'), fee('0.05')]
+
+    def test_sponsorship_coverage(self):
+        self.assertEqual(sponsorship_coverage(None), Decimal('0'))
+        self.assertEqual(sponsorship_coverage(SimpleNamespace(sponsorship_type='full')), Decimal('100'))
+        partial = SimpleNamespace(sponsorship_type='partial', percentage_covered=Decimal('40'))
+        self.assertEqual(sponsorship_coverage(partial), Decimal('40'))
+        # More than everything is still everything
+        partial.percentage_covered = Decimal('150')
+        self.assertEqual(sponsorship_coverage(partial), Decimal('100'))
+
+    def test_discount_rounds_half_up_to_the_kobo(self):
+        self.assertEqual(discount_amount(Decimal('0.05'), Decimal('50')), Decimal('0.03'))
+        self.assertEqual(discount_amount(Decimal('3333.33'), Decimal('33.33')), Decimal('2222.33'))
+        self.assertEqual(discount_amount(Decimal('100.00'), Decimal('0')), Decimal('100.00'))
+
+    def test_total_is_the_sum_of_the_rounded_lines(self):
+        quote, = price_students([student(1)], self.fees, coverage={1: '50'})
+        amounts = [amount for _, amount in quote['lines']]
+        self.assertEqual(amounts, [Decimal('5000.00'), Decimal('1666.67'), Decimal('0.03')])
+        self.assertEqual(quote['total'], Decimal('6666.70'))
+        self.assertEqual(quote['gross_total'], Decimal('13333.38'))
+        self.assertEqual(quote['coverage'], Decimal('50'))
+
+    def test_coverage_sources(self):
+        full = SimpleNamespace(sponsorship_type='full')
+        quotes = price_students(
+            [student(1, full), student(2, full), student(3)],
+            self.fees,
+            coverage={2: '25'},
+        )
+        self.assertEqual([quote['coverage'] for quote in quotes], [Decimal('100'), Decimal('25'), Decimal('0')])
+        self.assertEqual(quotes[0]['total'], Decimal('0.00'))
+        self.assertEqual(quotes[2]['total'], quotes[2]['gross_total'])
+
+        quote, = price_students([student(1, full)], self.fees, use_sponsorship=False)
+        self.assertEqual(quote['coverage'], Decimal('0'))
+
+    def test_equal_coverage_shares_one_priced_set(self):
+        quotes = price_students([student(1), student(2), student(3)], self.fees, coverage={3: '10'})
+        self.assertIs(quotes[0]['lines'], quotes[1]['lines'])
+        self.assertIsNot(quotes[0]['lines'], quotes[2]['lines'])
+
+
+class TermInvoiceTests(SchoolTestCase):
+    school = dict(SchoolTestCase.school, payment_rate=0)
+
+    def generate(self, **options):
+        year, term = self.generated['academic_year'], self.generated['term']
+        school_class_id = StudentClass.objects.filter(academic_year=year).values_list('school_class_id', flat=True)[0]
+        self.client.force_login(self.generated['admin'])
+        return self.client.post(reverse('generate_term_invoices'), {
+            'school_class_id': school_class_id, 'term_id': term.id, 'academic_year_id': year.id, **options,
+        })
+
+    def test_existing_invoices_are_skipped_or_regenerated(self):
+        Sponsorship.objects.all().delete()
+        fee_structure = FeeStructure.objects.order_by('id').first()
+        fee_structure.amount += 1000
+        fee_structure.save()
+        totals = dict(Invoice.objects.values_list('id', 'total_amount'))
+
+        self.generate(skip_existing='on')
+        self.assertEqual(dict(Invoice.objects.values_list('id', 'total_amount')), totals)
+
+        self.generate()
+        for invoice in Invoice.objects.prefetch_related('items'):
+            self.assertEqual(invoice.total_amount, totals[invoice.id] + 1000)
+            self.assertEqual(sum(item.amount for item in invoice.items.all()), invoice.total_amount)
+            self.assertEqual(invoice.amount_due, invoice.total_amount)
+
+
+class ProjectedRevenueTests(SchoolTestCase):
+    def test_headcount_and_coverage(self):
+        year = self.generated['academic_year']
+        records = list(StudentClass.objects.filter(academic_year=year).order_by('student_id'))
+        # An enrolment of another year does not count towards this year's fees
+        other = AcademicYear.objects.create(year='1999-2000')
+        StudentClass.objects.filter(pk=records[1].pk).update(academic_year=other)
+        Sponsorship.objects.filter(student_id__in=[record.student_id for record in records]).delete()
+        Sponsorship.objects.create(
+            student_id=records[0].student_id, sponsorship_type='partial', percentage_covered=150,
+        )
+
+        row, = projected_revenue(FeeStructure.objects.filter(academic_year=year))
+        self.assertEqual(row['headcount'], 1)
+        self.assertEqual(row['gross_total'], row['fee_total'])
+        # More than everything is still everything
+        self.assertEqual(row['expected_total'], Decimal('0.00'))
+
+
+class FilterMatchingTests(SchoolTestCase):
+    school = dict(classes=1, students_per_class=8, subjects=1, score_types=1, terms=1)
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(search._backends.clear)
+        name = StudentProfile.objects.order_by('id').values_list('user__last_name', flat=True)[0].lower()
+        # Inside a word, a whole word, two letters, and with a student id
+        self.queries = [name[1:4], name, name[-2:], f"{name[1:]} syn"]
+
+    def matching(self, query):
+        students = search.filter_matching(StudentProfile.objects.all(), query, 'student')
+        return set(students.values_list('id', flat=True))
+
+    def expected(self, query):
+        words = search.normalize(query)
+        return {
+            entry.object_id for entry in SearchEntry.objects.filter(kind='student')
+            if all(word in entry.tokens for word in words)
+        }
+
+    def test_like(self):
+        self.assertIsNone(search.search_backend())
+        for query in self.queries:
+            self.assertTrue(self.matching(query))
+            self.assertEqual(self.matching(query), self.expected(query))
+
+    def drop_fts_table(self):
+        with connection.cursor() as cursor:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {search.FTS_TABLE}_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {search.FTS_TABLE}")
+
+    def test_full_text(self):
+        if connection.vendor == 'sqlite':
+            # Rolling back the virtual table's creation breaks the connection
+            self.addCleanup(self.drop_fts_table)
+        if search.ensure_search_backend() is None:
+            self.skipTest("No full-text index on this database")
+        for query in self.queries:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.matching(query), self.expected(query))
+            # Two-letter words have no trigrams to match
+            self.assertEqual('MATCH' in queries[0]['sql'], len(query) > 2)
+
+
+class OpenInvoiceLookupTests(SchoolTestCase):
+    school = dict(SchoolTestCase.school, terms=2, sponsorship_rate=0, payment_rate=0)
+
+    def lookup(self, query):
+        self.client.force_login(self.generated['admin'])
+        response = self.client.get(reverse('open_invoice_lookup'), {'q': query})
+        return [row['id'] for row in response.json()['results']]
+
+    def test_open_invoices_of_the_student(self):
+        student = StudentProfile.objects.select_related('user').order_by('id').first()
+        invoices = list(Invoice.objects.filter(student=student).order_by('id'))
+        Invoice.objects.filter(pk=invoices[0].pk).update(status='paid')
+
+        found = self.lookup(f"{student.user.first_name} {student.student_id}")
+        self.assertIn(invoices[1].pk, found)
+        self.assertNotIn(invoices[0].pk, found)
+        # An invoice number comes first
+        self.assertEqual(self.lookup(str(invoices[1].pk))[0], invoices[1].pk)
+
+
+class InvoiceInfoTests(SchoolTestCase):
+    school = dict(SchoolTestCase.school, sponsorship_rate=0, payment_rate=0)
+
+    def setUp(self):
+        super().setUp()
+        self.invoice = Invoice.objects.order_by('id').first()
+        self.url = reverse('get_invoice_info', args=[self.invoice.pk])
+        self.client.force_login(self.generated['admin'])
+
+    def test_unchanged_invoice_is_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['invoice']['amount_paid'], 0)
+        etag = response['ETag']
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # A payment bumps the version, so the browser's copy is stale
+        posting.record(Payment(
+            invoice=self.invoice, student_id=self.invoice.student_id, amount_paid=Decimal('100.00'),
+            payment_date=timezone.localdate(), payment_method='cash',
+        ))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['invoice']['amount_paid'], 100)
+
+    def test_summary_is_cached_per_etag(self):
+        etag = invoice_etag(self.invoice.pk)
+        summary = cached_invoice_summary(self.invoice.pk, etag)
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_invoice_summary(self.invoice.pk, etag), summary)
+
+        Sponsorship.objects.create(student_id=self.invoice.student_id, sponsorship_type='full')
+        self.assertNotEqual(invoice_etag(self.invoice.pk), etag)
+        self.assertIsNone(invoice_etag(0))
+
+
+class PostingTests(SchoolTestCase):
+    school = dict(SchoolTestCase.school, payment_rate=0)
+
+    def setUp(self):
+        super().setUp()
+        # Fully sponsored students owe nothing
+        self.invoice = Invoice.objects.filter(amount_due__gt=100).order_by('id').first()
+
+    def payment(self, amount):
+        return Payment(
+            invoice=self.invoice, student_id=self.invoice.student_id, amount_paid=Decimal(amount),
+            payment_date=timezone.localdate(), payment_method='cash',
+        )
+
+    def test_repeated_key_records_once(self):
+        first, created = posting.record(self.payment('100.00'), 'key-1')
+        self.assertTrue(created)
+        again, created = posting.record(self.payment('100.00'), 'key-1')
+        self.assertFalse(created)
+        self.assertEqual(again.pk, first.pk)
+
+        self.assertEqual(Payment.objects.filter(invoice=self.invoice).count(), 1)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.amount_due, self.invoice.total_amount - Decimal('100.00'))
+        self.assertEqual(self.invoice.status, 'partial')
+        self.assertEqual(posting.recorded('key-1').pk, first.pk)
+
+    def test_repeated_key_after_paying_in_full(self):
+        # The retry finds the invoice paid and gets the first payment back
+        first, _ = posting.record(self.payment(self.invoice.amount_due), 'key-2')
+        again, created = posting.record(self.payment(self.invoice.amount_due), 'key-2')
+        self.assertFalse(created)
+        self.assertEqual(again.pk, first.pk)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.status, 'paid')
+
+    def test_overpayment_with_a_new_key(self):
+        with self.assertRaises(posting.Overpayment):
+            posting.record(self.payment(self.invoice.amount_due + 1), 'key-3')
+        self.assertFalse(Payment.objects.filter(invoice=self.invoice).exists())
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentPostingTests(TransactionTestCase):
+    """Two cashiers paying the same invoice in full at the same moment"""
+
+    def setUp(self):
+        generate_school(activate=True, **dict(SchoolTestCase.school, payment_rate=0))
+        caching.clear_all()
+        self.invoice = Invoice.objects.filter(amount_due__gt=100).order_by('id').first()
+
+    def pay(self, key, start, outcomes):
+        start.wait()
+        try:
+            posting.record(Payment(
+                invoice_id=self.invoice.pk, student_id=self.invoice.student_id, amount_paid=self.invoice.amount_due,
+                payment_date=timezone.localdate(), payment_method='cash',
+            ), key)
+            outcomes.append('recorded')
+        except posting.Overpayment:
+            outcomes.append('overpayment')
+        finally:
+            connection.close()
+
+    def test_second_posting_sees_the_first(self):
+        start, outcomes = threading.Barrier(2), []
+        cashiers = [threading.Thread(target=self.pay, args=(key, start, outcomes)) for key in ('key-a', 'key-b')]
+        for cashier in cashiers:
+            cashier.start()
+        for cashier in cashiers:
+            cashier.join()
+
+        # The invoice row lock makes the second check the balance after the first
+        self.assertEqual(sorted(outcomes), ['overpayment', 'recorded'])
+        self.invoice.refresh_from_db()
+        self.assertEqual((self.invoice.amount_due, self.invoice.status), (0, 'paid'))
+        self.assertEqual(Payment.objects.filter(invoice=self.invoice).count(), 1)
+
+
+class SnapshotTests(SchoolTestCase):
+    school = dict(SchoolTestCase.school, classes=2, payment_rate=0)
+
+    def setUp(self):
+        super().setUp()
+        self.today = timezone.localdate()
+        Invoice.objects.update(created_at=timezone.now() - timedelta(days=10))
+        self.invoice = Invoice.objects.filter(amount_due__gt=100).order_by('id').first()
+        self.payment, _ = posting.record(Payment(
+            invoice=self.invoice, student_id=self.invoice.student_id, amount_paid=Decimal('100.00'),
+            payment_date=self.today - timedelta(days=5), payment_method='transfer',
+        ))
+        outbox.drain()
+        snapshots.take_range(self.today - timedelta(days=7), self.today)
+
+    def row(self, days_ago):
+        return DailyFinanceSnapshot.objects.get(date=self.today - timedelta(days=days_ago))
+
+    def assertFresh(self):
+        for days_ago in range(8):
+            row = self.row(days_ago)
+            fresh = {**snapshots.collections(row.date), **snapshots.issued(row.date), **snapshots.outstanding(row.date)}
+            self.assertEqual(row.collections, fresh['collections'])
+            self.assertEqual(row.invoices_issued, fresh['invoices_issued'])
+            self.assertEqual(row.invoiced_amount, fresh['invoiced_amount'])
+            self.assertEqual(row.outstanding, fresh['outstanding'])
+            self.assertEqual(
+                [(entry['school_class_id'], entry['term_id'], entry['invoices'], Decimal(entry['amount']))
+                 for entry in row.outstanding_by_class],
+                [(entry['school_class_id'], entry['term_id'], entry['invoices'], entry['amount'])
+                 for entry in fresh['outstanding_by_class']],
+            )
+
+    def test_figures(self):
+        before, paid = self.row(6), self.row(5)
+        self.assertEqual(paid.collections, Decimal('100.00'))
+        self.assertEqual(paid.payments_count, 1)
+        self.assertEqual(paid.collections_by_method, {'transfer': '100.00'})
+        self.assertEqual(before.collections, Decimal('0.00'))
+        self.assertEqual(before.outstanding - paid.outstanding, Decimal('100.00'))
+        self.assertEqual(
+            sum(Decimal(row['amount']) for row in paid.outstanding_by_class), paid.outstanding,
+        )
+
+    def test_moving_a_payment_refreshes_both_days_and_later_outstanding(self):
+        payment = Payment.objects.get(pk=self.payment.pk)
+        payment.payment_date = self.today - timedelta(days=3)
+        posting.save_changes(payment)
+
+        event = DomainEvent.objects.filter(model='finance.Payment').latest('id')
+        self.assertEqual(event.payload['previous_payment_date'], str(self.today - timedelta(days=5)))
+        outbox.drain()
+
+        self.assertEqual(self.row(5).collections, Decimal('0.00'))
+        self.assertEqual(self.row(3).collections, Decimal('100.00'))
+        # Owed in full until the new date
+        self.assertEqual(self.row(4).outstanding, self.row(6).outstanding)
+        self.assertFresh()
+
+    def test_invoice_dated_earlier_refreshes_later_days(self):
+        invoice = Invoice.objects.exclude(pk=self.invoice.pk).order_by('id').first()
+        invoice.created_at = timezone.now() - timedelta(days=3)
+        invoice.save()
+        outbox.drain()
+        self.assertEqual(self.row(3).invoices_issued, 1)
+        self.assertFresh()
+
+        invoice.created_at = timezone.now() - timedelta(days=6)
+        invoice.save()
+        outbox.drain()
+        self.assertEqual(self.row(3).invoices_issued, 0)
+        self.assertEqual(self.row(6).invoices_issued, 1)
+        self.assertFresh()
+
+    def test_deleted_invoice_is_no_longer_owed(self):
+        before = self.row(0).outstanding
+        self.invoice.delete()
+        outbox.drain()
+        self.assertLess(self.row(0).outstanding, before)
+        self.assertFresh()
+
+    def test_refresh_queries_do_not_grow_with_the_days(self):
+        invoices = {(self.invoice.student_id, self.invoice.academic_year_id, self.invoice.term_id)}
+        counts = []
+        for days_ago in (1, 7):
+            with CaptureQueriesContext(connection) as queries:
+                snapshots.refresh(invoices, {self.today - timedelta(days=days_ago)})
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
@@ -24,6 +24,8 @@ urlpatterns = [
     path('payments/', views.payment_management, name='payment_management'),
     path('payments/receipt/<int:payment_id>/', views.payment_receipt, name='payment_receipt'),
     path('payments/get-invoice-info/<int:invoice_id>/', views.get_invoice_info, name='get_invoice_info'),
+    path('payments/open-invoices/', views.open_invoice_lookup, name='open_invoice_lookup'),
+    path('search/', views.search_autocomplete, name='search_autocomplete'),
 
     path('term-invoices/<int:class_id>/<int:term_id>/<int:academic_year_id>/', views.term_invoices, name='term_invoices'),
 
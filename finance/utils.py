@@ -1,16 +1,362 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Least
+
+from core import caching, outbox
+from students.models import StudentClass
+from .models import FeeStructure, Invoice, InvoiceItem, Payment
+from .search import index_invoices
+
+
+CENT = Decimal('0.01')
+HUNDRED = Decimal('100')
+
+INVOICE_INFO_TIMEOUT = 60 * 60
+
+
+def sponsorship_coverage(sponsorship):
+    """
+    Percentage of fees a sponsorship covers, as a Decimal from 0 to 100.
+    """
+    if not sponsorship:
+        return Decimal('0')
+
+    if sponsorship.sponsorship_type == "full":
+        return HUNDRED
+
+    if sponsorship.sponsorship_type == "partial" and sponsorship.percentage_covered:
+        return min(Decimal(sponsorship.percentage_covered), HUNDRED)
+
+    return Decimal('0')
+
+
+def discount_amount(amount, coverage):
+    """
+    Amount left to pay once ``coverage`` percent is waived, rounded to the kobo
+    """
+    if not coverage:
+        return amount
+    return (amount * (HUNDRED - coverage) / HUNDRED).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
 def apply_sponsorship(amount, sponsorship):
     """
     Takes original amount and sponsorship object
     Returns discounted amount
     """
-    if not sponsorship:
-        return amount
+    return discount_amount(Decimal(amount), sponsorship_coverage(sponsorship))
 
-    if sponsorship.sponsorship_type == "full":
+
+def get_sponsorship(student):
+    """Student's sponsorship, or None (works with select_related)"""
+    try:
+        return student.sponsorship
+    except ObjectDoesNotExist:
+        return None
+
+
+def price_students(students, fee_structures, use_sponsorship=True, coverage=None):
+    """
+    Price ``fee_structures`` for every student in one pass.
+
+    Students with the same coverage share one priced set of lines, so the
+    work is one discount per (distinct coverage, fee line) rather than per
+    student. ``coverage`` optionally maps student id -> percent covered and
+    overrides the stored sponsorship, for what-if simulations.
+
+    Returns one quote per student: ``student``, ``coverage``, ``lines``
+    (list of ``(fee_structure, amount)``), ``gross_total`` and ``total``.
+    Invoice totals are always the sum of the discounted lines.
+    """
+    fee_structures = list(fee_structures)
+    gross_total = sum((fee.amount for fee in fee_structures), Decimal('0.00'))
+
+    priced = {}
+    quotes = []
+    for student in students:
+        if coverage is not None and student.pk in coverage:
+            percent = Decimal(coverage[student.pk])
+        elif use_sponsorship:
+            percent = sponsorship_coverage(get_sponsorship(student))
+        else:
+            percent = Decimal('0')
+
+        if percent not in priced:
+            lines = [(fee, discount_amount(fee.amount, percent)) for fee in fee_structures]
+            priced[percent] = (lines, sum((amount for _, amount in lines), Decimal('0.00')))
+        lines, total = priced[percent]
+
+        quotes.append({
+            'student': student,
+            'coverage': percent,
+            'lines': lines,
+            'gross_total': gross_total,
+            'total': total,
+        })
+    return quotes
+
+
+def forecast(quotes):
+    """
+    Gross billing, sponsorship cost and projected collections for priced quotes
+    """
+    gross_total = sum((quote['gross_total'] for quote in quotes), Decimal('0.00'))
+    total = sum((quote['total'] for quote in quotes), Decimal('0.00'))
+    return {
+        'students': len(quotes),
+        'gross_total': gross_total,
+        'sponsorship_cost': gross_total - total,
+        'projected_collections': total,
+    }
+
+
+def create_invoices(quotes, academic_year, term, status='unpaid'):
+    """
+    Write invoices and their items for priced quotes.
+
+    Uses two bulk inserts plus one lookup for the new ids (MySQL does not
+    return primary keys from bulk_create), then adds the invoices to the
+    search index. Returns the number created.
+    """
+    if not quotes:
+        return 0
+
+    with transaction.atomic():
+        Invoice.objects.bulk_create([
+            Invoice(
+                student=quote['student'],
+                academic_year=academic_year,
+                term=term,
+                total_amount=quote['total'],
+                amount_due=quote['total'],
+                status=status,
+            )
+            for quote in quotes
+        ])
+
+        created = list(
+            Invoice.objects.filter(
+                academic_year=academic_year,
+                term=term,
+                student__in=[quote['student'] for quote in quotes],
+            ).values('id', *outbox.OUTBOX_MODELS['finance.Invoice'])
+        )
+        invoice_ids = {invoice['student_id']: invoice['id'] for invoice in created}
+
+        InvoiceItem.objects.bulk_create([
+            InvoiceItem(
+                invoice_id=invoice_ids[quote['student'].pk],
+                fee_type_id=fee.fee_type_id,
+                amount=amount,
+            )
+            for quote in quotes
+            for fee, amount in quote['lines']
+        ])
+
+        index_invoices(invoice_ids.values())
+        # bulk_create sends no model signals
+        outbox.emit_many('finance.Invoice', created)
+
+    return len(quotes)
+
+
+def reprice_invoices(quotes, academic_year, term):
+    """
+    Replace the totals and items of the students' existing invoices with
+    priced quotes. Payments are kept: balances and statuses are recomputed
+    by posting.update_balances(). Returns the number repriced.
+    """
+    from .posting import update_balances
+
+    if not quotes:
         return 0
 
-    if sponsorship.sponsorship_type == "partial":
-        discount = (sponsorship.percentage_covered / 100) * amount
-        return amount - discount
+    with transaction.atomic():
+        invoices = {
+            invoice.student_id: invoice
+            for invoice in Invoice.objects.select_for_update().filter(
+                academic_year=academic_year,
+                term=term,
+                student__in=[quote['student'] for quote in quotes],
+            )
+        }
+        for quote in quotes:
+            invoices[quote['student'].pk].total_amount = quote['total']
+        Invoice.objects.bulk_update(invoices.values(), ['total_amount'])
+
+        InvoiceItem.objects.filter(invoice__in=invoices.values()).delete()
+        InvoiceItem.objects.bulk_create([
+            InvoiceItem(
+                invoice_id=invoices[quote['student'].pk].pk,
+                fee_type_id=fee.fee_type_id,
+                amount=amount,
+            )
+            for quote in quotes
+            for fee, amount in quote['lines']
+        ])
+
+        repriced = Invoice.objects.filter(pk__in=[invoice.pk for invoice in invoices.values()])
+        update_balances(repriced)
+        # bulk_update and update() send no model signals
+        outbox.emit_many('finance.Invoice', list(repriced.values('id', *outbox.OUTBOX_MODELS['finance.Invoice'])))
+
+    return len(quotes)
+
+
+def projected_revenue(fee_structures=None):
+    """
+    Expected revenue per (class, academic year, term) fee group.
+
+    Fee totals, current headcount and sponsorship coverage come back from a
+    single grouped query over FeeStructure; each row is a dict with
+    ``headcount``, ``fee_total``, ``gross_total`` and ``expected_total``
+    (gross minus full/partial scholarship cover).
+    """
+    if fee_structures is None:
+        fee_structures = FeeStructure.objects.all()
+
+    # Current, active students of the fee group's class in its academic year
+    enrolled = StudentClass.objects.filter(
+        school_class=OuterRef('school_class'),
+        academic_year=OuterRef('academic_year'),
+        is_current=True,
+        student__is_active=True,
+    ).order_by().values('school_class')
+
+    # Percentage of fees covered per student: 100 for full, N (at most 100)
+    # for partial, as in sponsorship_coverage()
+    covered = Case(
+        When(student__sponsorship__sponsorship_type='full', then=Value(100)),
+        When(
+            student__sponsorship__sponsorship_type='partial',
+            then=Least(Coalesce('student__sponsorship__percentage_covered', Value(0)), Value(100)),
+        ),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+    rows = (
+        fee_structures.order_by()
+        .values(
+            'school_class', 'school_class__name',
+            'academic_year', 'academic_year__year',
+            'term', 'term__name',
+        )
+        .annotate(
+            fee_total=Sum('amount'),
+            headcount=Coalesce(
+                Subquery(enrolled.annotate(n=Count('student', distinct=True)).values('n')),
+                Value(0),
+            ),
+            covered_percent=Coalesce(
+                Subquery(enrolled.annotate(p=Sum(covered)).values('p')),
+                Value(0),
+            ),
+        )
+        .order_by('school_class__name', 'academic_year__year', 'term__name')
+    )
+
+    results = []
+    for row in rows:
+        fee_total = row['fee_total'] or Decimal('0')
+        gross_total = fee_total * row['headcount']
+        # Each fully covered student removes 100 "percent-heads" of fees
+        expected_total = fee_total * (row['headcount'] * 100 - row['covered_percent']) / 100
+        results.append({
+            **row,
+            'fee_total': fee_total,
+            'gross_total': gross_total,
+            'expected_total': expected_total.quantize(Decimal('0.01')),
+        })
+    return results
+
+
+def invoice_etag(invoice_id):
+    """
+    ETag for an invoice summary: the invoice version (bumped by payment
+    writes) and the sponsorship's last change. None if there is no invoice.
+    """
+    row = Invoice.objects.filter(id=invoice_id).values_list(
+        'version', 'student__sponsorship__updated_at',
+    ).first()
+    if row is None:
+        return None
+    version, sponsorship_updated = row
+    stamp = int(sponsorship_updated.timestamp()) if sponsorship_updated else 0
+    return f"invoice-{invoice_id}-{version}-{stamp}"
+
+
+def completed_payments(invoice_ref, until=None):
+    """
+    Sum of completed payments for the invoice at ``invoice_ref`` (0 if
+    none), optionally only those dated on or before ``until``
+    """
+    paid = Payment.objects.filter(invoice=OuterRef(invoice_ref), status='completed')
+    if until is not None:
+        paid = paid.filter(payment_date__lte=until)
+    paid = paid.order_by().values('invoice').annotate(total=Sum('amount_paid')).values('total')
+    return Coalesce(Subquery(paid), Value(Decimal('0')), output_field=DecimalField())
+
+
+def invoice_summary(invoice_id):
+    """
+    Balances, fee lines and sponsorship of an invoice, as JSON-ready data.
+
+    One query: the invoice's items, each joined to the invoice, student and
+    sponsorship and annotated with the completed-payment total. Invoices
+    without items need a second query for the invoice itself.
+    """
+    items = list(
+        InvoiceItem.objects.filter(invoice_id=invoice_id)
+        .select_related(
+            'fee_type', 'invoice__student__user', 'invoice__student__sponsorship',
+            'invoice__term', 'invoice__academic_year',
+        )
+        .annotate(paid=completed_payments('invoice'))
+        .order_by('fee_type__name')
+    )
+    if items:
+        invoice, total_paid = items[0].invoice, items[0].paid
+    else:
+        invoice = Invoice.objects.select_related(
+            'student__user', 'student__sponsorship', 'term', 'academic_year',
+        ).annotate(paid=completed_payments('pk')).filter(id=invoice_id).first()
+        if invoice is None:
+            return None
+        total_paid = invoice.paid
+
+    sponsorship = get_sponsorship(invoice.student)
+    return {
+        'id': invoice.id,
+        'version': invoice.version,
+        'student_name': invoice.student.user.get_full_name(),
+        'student_id': invoice.student.student_id,
+        'academic_year': invoice.academic_year.year,
+        'term': str(invoice.term),
+        'status': invoice.status,
+        'total_amount': float(invoice.total_amount),
+        'amount_paid': float(total_paid),
+        'amount_due': float(invoice.amount_due),
+        'items': [
+            {'fee_type': item.fee_type.name, 'amount': float(item.amount)}
+            for item in items
+        ],
+        # Invoice amounts are already net of this cover (see price_students)
+        'sponsorship': {
+            'type': sponsorship.sponsorship_type,
+            'display': sponsorship.display_type,
+            'sponsor_name': sponsorship.sponsor_name,
+            'coverage': float(sponsorship_coverage(sponsorship)),
+        } if sponsorship else None,
+    }
+
 
-    return amount
+def cached_invoice_summary(invoice_id, etag):
+    """invoice_summary() from the aggregates tier, keyed by invoice_etag()"""
+    return caching.get_or_set(
+        'aggregates', f"invoice_info:{etag}", lambda: invoice_summary(invoice_id),
+        timeout=INVOICE_INFO_TIMEOUT,
+    )
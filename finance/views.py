@@ -2,96 +2,110 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Sum, Count, Q, Avg, Prefetch
+from django.db.models import Sum, Count, Q, Avg
 from django.core.paginator import Paginator
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
 from django.contrib.humanize.templatetags.humanize import intcomma
 from django.db import models, transaction
-from datetime import datetime, timedelta
+from datetime import datetime
 from decimal import Decimal
+import asyncio
 import json
 from django.http import JsonResponse
 
 from .models import Sponsorship, FeeType, FeeStructure, Invoice, InvoiceItem, Payment
-from .forms import FeeStructureForm, FeeTypeForm, PaymentsForm, RecordPaymentForm
-from .utils import apply_sponsorship
+from .forms import FeeStructureForm, FeeTypeForm, PaymentsForm
+from . import posting, snapshots
+from .utils import (
+    price_students, create_invoices, reprice_invoices, projected_revenue, invoice_etag, cached_invoice_summary,
+)
 
 from finance.models import Sponsorship  # Assuming you have a Sponsorship model
 
 from students.models import StudentProfile, StudentClass
+from academics import reference
 from academics.models import SchoolClass, AcademicYear, Term
+from core.async_views import alist, arender
+from core.pagination import KeysetPaginator
+from .search import KINDS as SEARCH_KINDS, filter_matching, find, matching_ids
 from accounts.models import User
 
 @login_required
-def finance_dashboard(request):
-    """Finance dashboard with key metrics and overview"""
-    
-    # Current academic year and term
-    current_year = AcademicYear.objects.filter(is_active=True).first()
-    terms = Term.objects.all()
-    
-    # Summary statistics
-    total_students = StudentProfile.objects.count()
-    total_invoices = Invoice.objects.count()
-    
-    # Revenue statistics
-    total_revenue = Payment.objects.aggregate(total=Sum('amount_paid'))['total'] or 0
-    current_month_revenue = Payment.objects.filter(
-        payment_date__month=timezone.now().month,
-        payment_date__year=timezone.now().year
-    ).aggregate(total=Sum('amount_paid'))['total'] or 0
-    
-    # Invoice status summary
-    invoice_status = Invoice.objects.values('status').annotate(
-        count=Count('id'),
-        total_amount=Sum('total_amount'),
-        total_due=Sum('amount_due')
-    )
-    
-    # Sponsorship summary
-    sponsorship_summary = Sponsorship.objects.values('sponsorship_type').annotate(
-        count=Count('id')
+async def finance_dashboard(request):
+    """
+    Finance dashboard with key metrics and overview.
+
+    The independent aggregates are awaited together. The collections chart
+    covers the last seven calendar months against the same months a year
+    earlier, summed from daily snapshots (finance.snapshots) plus today's
+    payments, which the nightly snapshot has not counted yet.
+    """
+    today = timezone.localdate()
+    chart_start = snapshots.add_months(today, -6)
+
+    (
+        reference_data, total_students, revenue, collected_today, months,
+        invoice_status, sponsorship_summary, recent_payments, outstanding_invoices,
+    ) = await asyncio.gather(
+        reference.asnapshot(),
+        StudentProfile.objects.acount(),
+        Payment.objects.aaggregate(total=Sum('amount_paid')),
+        Payment.objects.filter(payment_date=today, status='completed').aaggregate(total=Sum('amount_paid')),
+        # This year's months and last year's, in one pass over the snapshots
+        snapshots.amonthly_collections(snapshots.add_months(chart_start, -12), 19, until=today),
+        # Invoice status summary
+        alist(Invoice.objects.values('status').annotate(
+            count=Count('id'),
+            total_amount=Sum('total_amount'),
+            total_due=Sum('amount_due')
+        ).order_by('status')),
+        # Sponsorship summary
+        alist(Sponsorship.objects.values('sponsorship_type').annotate(
+            count=Count('id')
+        ).order_by('sponsorship_type')),
+        # Recent payments
+        alist(Payment.objects.select_related(
+            'invoice', 'invoice__student',
+        ).order_by('-payment_date')[:10]),
+        # Outstanding invoices
+        alist(Invoice.objects.filter(
+            status__in=['unpaid', 'partial']
+        ).order_by('-amount_due')[:10]),
     )
-    
-    # Recent payments
-    recent_payments = Payment.objects.select_related(
-        'invoice', 'invoice__student',
-    ).order_by('-payment_date')[:10]
-    
-    # Outstanding invoices
-    outstanding_invoices = Invoice.objects.filter(
-        status__in=['unpaid', 'partial']
-    ).order_by('-amount_due')[:10]
-    
+
+    status_counts = {row['status']: row['count'] for row in invoice_status}
+
     # Chart data
-    monthly_revenue = []
-    for i in range(6, -1, -1):
-        month = timezone.now() - timedelta(days=30*i)
-        month_revenue = Payment.objects.filter(
-            payment_date__month=month.month,
-            payment_date__year=month.year
-        ).aggregate(total=Sum('amount_paid'))['total'] or 0
-        monthly_revenue.append({
-            'month': month.strftime('%b'),
-            'revenue': float(month_revenue)
-        })
-    
+    this_year, last_year = months[12:], months[:7]
+    this_year[-1] = (this_year[-1][0], this_year[-1][1] + (collected_today['total'] or 0))
+    monthly_revenue = [
+        {
+            'month': month.strftime('%b %Y'),
+            'revenue': float(amount),
+            'last_year': float(previous),
+        }
+        for (month, amount), (_, previous) in zip(this_year, last_year)
+    ]
+
     context = {
-        'current_year': current_year,
-        'terms': terms,
+        'current_year': reference_data.current_year,
+        'current_term': reference_data.current_term,
+        'terms': reference_data.terms,
         'total_students': total_students,
-        'total_invoices': total_invoices,
-        'total_revenue': total_revenue,
-        'current_month_revenue': current_month_revenue,
+        'total_invoices': sum(status_counts.values()),
+        'total_revenue': revenue['total'] or 0,
+        'current_month_revenue': this_year[-1][1],
         'invoice_status': invoice_status,
         'sponsorship_summary': sponsorship_summary,
         'recent_payments': recent_payments,
         'outstanding_invoices': outstanding_invoices,
         'monthly_revenue': json.dumps(monthly_revenue),
-        'pending_invoices': Invoice.objects.filter(status='unpaid').count(),
+        'pending_invoices': status_counts.get('unpaid', 0),
+        'paid_invoices': status_counts.get('paid', 0),
     }
-    
-    return render(request, 'finance/finance_dashboard.html', context)
+
+    return await arender(request, 'finance/finance_dashboard.html', context)
 
 @login_required
 def student_invoices(request):
@@ -117,11 +131,7 @@ def student_invoices(request):
         ).distinct()
     
     if search_query:
-        invoices = invoices.filter(
-            Q(student__user__first_name__icontains=search_query) |
-            Q(student__user__last_name__icontains=search_query) |
-            Q(student__admission_number__icontains=search_query)
-        )
+        invoices = filter_matching(invoices, search_query, 'invoice')
     
     invoices = invoices.order_by('-created_at')
     
@@ -129,7 +139,7 @@ def student_invoices(request):
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
-    classes = SchoolClass.objects.all()
+    classes = reference.classes()
     
     context = {
         'invoices': page_obj,
@@ -143,58 +153,6 @@ def student_invoices(request):
     return render(request, 'finance/student_invoices.html', context)
 
 
-@login_required
-def invoice_detail(request, invoice_id):
-    """View invoice details"""
-    invoice = get_object_or_404(
-        Invoice.objects.select_related(
-            'student', 'student__user', 'academic_year', 'term'
-        ).prefetch_related('items', 'payments'),
-        id=invoice_id
-    )
-    
-    context = {
-        'invoice': invoice,
-        'pending_invoices': Invoice.objects.filter(status='unpaid').count(),
-    }
-    
-    return render(request, 'finance/invoice_detail.html', context)
-
-@login_required
-def record_payment(request, invoice_id):
-    """Record a payment for an invoice"""
-    if request.method == 'POST':
-        invoice = get_object_or_404(Invoice, id=invoice_id)
-        amount_paid = Decimal(request.POST.get('amount_paid'))
-        payment_method = request.POST.get('payment_method')
-        reference = request.POST.get('reference', '')
-        
-        if amount_paid > invoice.amount_due:
-            messages.error(request, 'Payment amount cannot exceed amount due')
-            return redirect('invoice_detail', invoice_id=invoice_id)
-        
-        # Create payment
-        payment = Payment.objects.create(
-            invoice=invoice,
-            amount_paid=amount_paid,
-            payment_method=payment_method,
-            reference=reference,
-            received_by=request.user
-        )
-        
-        # Update invoice
-        invoice.amount_due -= amount_paid
-        if invoice.amount_due == 0:
-            invoice.status = 'paid'
-        elif invoice.amount_due < invoice.total_amount:
-            invoice.status = 'partial'
-        invoice.save()
-        
-        messages.success(request, f'Payment of ${amount_paid} recorded successfully')
-        return redirect('invoice_detail', invoice_id=invoice_id)
-    
-    return redirect('student_invoices')
-
 @login_required
 def generate_invoice(request, student_id):
     """Generate invoice for a student"""
@@ -217,37 +175,24 @@ def generate_invoice(request, student_id):
             messages.error(request, 'No fee structure found for this class')
             return redirect('student_invoices')
         
-        # Calculate total amount
-        total_amount = sum(item.amount for item in fee_items)
-        
-        # Apply sponsorship discount if any
-        sponsorship = Sponsorship.objects.filter(student=student).first()
-        amount_due = total_amount
-        
-        if sponsorship and sponsorship.sponsorship_type in ['full', 'partial']:
-            if sponsorship.sponsorship_type == 'full':
-                amount_due = Decimal('0.00')
-            elif sponsorship.sponsorship_type == 'partial' and sponsorship.percentage_covered:
-                discount = total_amount * (Decimal(sponsorship.percentage_covered) / Decimal('100'))
-                amount_due = total_amount - discount
+        # Price the fee lines (sponsorship discount applied per line)
+        quote = price_students([student], fee_items)[0]
         
         # Create invoice
         invoice = Invoice.objects.create(
             student=student,
             academic_year=academic_year,
             term=term,
-            total_amount=total_amount,
-            amount_due=amount_due,
-            status='unpaid' if amount_due > 0 else 'paid'
+            total_amount=quote['total'],
+            amount_due=quote['total'],
+            status='unpaid' if quote['total'] > 0 else 'paid'
         )
         
         # Create invoice items
-        for fee_item in fee_items:
-            InvoiceItem.objects.create(
-                invoice=invoice,
-                fee_type=fee_item.fee_type,
-                amount=fee_item.amount
-            )
+        InvoiceItem.objects.bulk_create([
+            InvoiceItem(invoice=invoice, fee_type_id=fee.fee_type_id, amount=amount)
+            for fee, amount in quote['lines']
+        ])
         
         messages.success(request, f'Invoice generated for {student.user.get_full_name()}')
         return redirect('invoice_detail', invoice_id=invoice.id)
@@ -409,7 +354,7 @@ def get_sponsorship_context(search_query='', type_filter='all', class_filter='',
     """Helper function to get context data for the sponsorship page"""
     
     # Get all classes for filter dropdown
-    classes = SchoolClass.objects.all().order_by('name')
+    classes = reference.classes()
     
     # Get all sponsorships with student info
     sponsorships = Sponsorship.objects.select_related(
@@ -430,12 +375,7 @@ def get_sponsorship_context(search_query='', type_filter='all', class_filter='',
     
     # Filter sponsorships by search query
     if search_query:
-        sponsorships = sponsorships.filter(
-            Q(student__user__first_name__icontains=search_query) |
-            Q(student__user__last_name__icontains=search_query) |
-            Q(student__student_id__icontains=search_query) |
-            Q(sponsor_name__icontains=search_query)
-        )
+        sponsorships = filter_matching(sponsorships, search_query, 'sponsorship')
     
     # Prepare sponsorships data for template
     sponsorship_list = []
@@ -471,11 +411,7 @@ def get_sponsorship_context(search_query='', type_filter='all', class_filter='',
     
     # Filter students by search
     if search_query:
-        students_without = students_without.filter(
-            Q(user__first_name__icontains=search_query) |
-            Q(user__last_name__icontains=search_query) |
-            Q(student_id__icontains=search_query)
-        )
+        students_without = filter_matching(students_without, search_query, 'student')
     
     # Prepare students data for template
     student_list = []
@@ -663,11 +599,8 @@ def payment_management(request):
         payments = payments.filter(payment_method=method_filter)
     
     if search_query:
-        payments = payments.filter(
-            Q(student__user__first_name__icontains=search_query) |
-            Q(student__user__last_name__icontains=search_query) |
-            Q(student__student_id__icontains=search_query)
-        )
+        # Payments are found through their invoice: student name, id or invoice number
+        payments = filter_matching(payments, search_query, 'invoice', field='invoice_id')
     
     # Date filters
     if date_from:
@@ -691,11 +624,6 @@ def payment_management(request):
         avg_amount=Avg('amount_paid')
     )
     
-    # Get invoices for dropdown
-    invoices = Invoice.objects.filter(
-        status__in=['unpaid', 'partial']
-    ).select_related('student', 'student__user').order_by('-created_at')
-    
     # Get payment statistics by method
     by_method = payments.values('payment_method').annotate(
         total=Sum('amount_paid'),
@@ -711,20 +639,14 @@ def payment_management(request):
     else:
         payments_form = PaymentsForm(initial={'payment_date': today, 'status': 'completed'})
     
-    # Pagination
-    paginator = Paginator(payments, 15)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    fees = FeeStructure.objects.all()
-    total_fee = sum(fee.amount for fee in fees)
+    # Keyset pagination: 15 per page, latest payment date first
+    page_obj = KeysetPaginator(payments, 15, ordering=('-payment_date', '-id')).page(request)
+    total_fee = FeeStructure.objects.aggregate(total=Sum('amount'))['total'] or 0
 
     context = {
-        "fees": fees,
-        "total_fee": total_fee,
         "total_fee": total_fee,
         'payments_form': payments_form,
         'payments': page_obj,
-        'invoices': invoices,
         'selected_payment': selected_payment,
         'total_amount': totals['total_amount'] or 0,
         'total_count': totals['count'] or 0,
@@ -748,13 +670,21 @@ def create_payment(request):
     """Handle payment creation"""
     if request.method == 'POST':
         try:
+            key = posting.key_from(request)
+            payment = posting.recorded(key)
+            if payment:
+                messages.info(request, f'Payment of ₦{payment.amount_paid:,.2f} was already recorded.')
+                return redirect('payment_management')
+
             form = PaymentsForm(request.POST)
             if form.is_valid():
-                payment = form.save(commit=False)
-                # Auto-update invoice status will be handled in Payment.save() method
-                payment.save()
+                # Staff may record more than is due here (e.g. advance payments)
+                payment, created = posting.record(form.save(commit=False), key, allow_overpayment=True)
                 
-                messages.success(request, f'Payment of ₦{payment.amount_paid:,.2f} recorded successfully!')
+                if created:
+                    messages.success(request, f'Payment of ₦{payment.amount_paid:,.2f} recorded successfully!')
+                else:
+                    messages.info(request, f'Payment of ₦{payment.amount_paid:,.2f} was already recorded.')
                 
                 # Check if "Save & New" was clicked
                 if 'save_and_new' in request.POST:
@@ -775,10 +705,11 @@ def update_payment(request):
         try:
             payment_id = request.POST.get('payment_id')
             payment = get_object_or_404(Payment, id=payment_id)
+            previous_invoice_id = payment.invoice_id
             
             form = PaymentsForm(request.POST, instance=payment)
             if form.is_valid():
-                form.save()
+                posting.save_changes(form.save(commit=False), previous_invoice_id)
                 messages.success(request, 'Payment updated successfully!')
             else:
                 for field, errors in form.errors.items():
@@ -799,29 +730,7 @@ def delete_payment(request):
             student_name = f"{payment.student.user.get_full_name()}"
             amount = payment.amount_paid
             
-            # Store invoice reference before deletion
-            invoice = payment.invoice
-            
-            # Delete payment
-            payment.delete()
-            
-            # Update invoice status after deletion
-            invoice.refresh_from_db()
-            total_paid = invoice.payments.filter(status='completed').aggregate(
-                total=Sum('amount_paid')
-            )['total'] or 0
-            
-            invoice.amount_paid = total_paid
-            invoice.amount_due = invoice.total_amount - total_paid
-            
-            if total_paid >= invoice.total_amount:
-                invoice.status = 'paid'
-            elif total_paid > 0:
-                invoice.status = 'partial'
-            else:
-                invoice.status = 'unpaid'
-            
-            invoice.save()
+            posting.remove(payment)
             
             messages.success(request, f'Payment of ₦{amount:,.2f} for {student_name} deleted successfully!')
             
@@ -831,68 +740,98 @@ def delete_payment(request):
     return redirect('payment_management')
 
 
-def record_payment(request, invoice_id):
-    invoice = get_object_or_404(Invoice, id=invoice_id)
-    
-    if request.method == 'POST':
-        form = RecordPaymentForm(request.POST, invoice=invoice)
-        
-        if form.is_valid():
-            payment = form.save(commit=False)
-            payment.invoice = invoice
-            payment.student = invoice.student
-            payment.payment_date = timezone.now().date()
-            payment.save()
-            
-            messages.success(request, f'Payment of ${payment.amount_paid:.2f} recorded successfully!')
-            return redirect('invoice_detail', invoice_id=invoice.id)
-    else:
-        form = RecordPaymentForm(invoice=invoice)
-    
-    # Use your existing view or create a specific one
-    context = {
-        'invoice': invoice,
-        'form': form,
-    }
-    return render(request, 'finance/record_payment.html', context)
 @login_required
+def get_invoice_info(request, invoice_id):
+    """
+    AJAX endpoint to get invoice info.
 
+    The ETag follows the invoice version (bumped by every payment write), so
+    a repeated selection is answered with 304, and other users get the
+    summary from the cache until the next payment.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'success': False, 'error': 'Invalid request method'})
 
-def get_invoice_info(request, invoice_id):
-    """AJAX endpoint to get invoice info"""
-    if request.method == 'GET':
-        try:
-            invoice = get_object_or_404(Invoice, id=invoice_id)
-            
-            # Calculate sponsorship discount if any
-            discount = 0
-            try:
-                sponsorship = Sponsorship.objects.get(student=invoice.student)
-                if sponsorship.sponsorship_type == 'full':
-                    discount = float(invoice.total_amount)
-                elif sponsorship.sponsorship_type == 'partial' and sponsorship.percentage_covered:
-                    discount = (float(invoice.total_amount) * sponsorship.percentage_covered) / 100
-            except Sponsorship.DoesNotExist:
-                pass
-            
-            data = {
-                'student_name': invoice.student.user.get_full_name(),
-                'student_id': invoice.student.student_id,
-                'total_amount': float(invoice.total_amount),
-                'amount_paid': float(invoice.amount_paid),
+    etag = invoice_etag(invoice_id)
+    if etag is None:
+        return JsonResponse({'success': False, 'error': 'Invoice not found'}, status=404)
+
+    response = get_conditional_response(request, etag=quote_etag(etag))
+    if response is None:
+        response = JsonResponse({'success': True, 'invoice': cached_invoice_summary(invoice_id, etag)})
+    response['ETag'] = quote_etag(etag)
+    # Browsers keep the copy but revalidate it on every selection
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+@login_required
+def open_invoice_lookup(request):
+    """
+    Open (unpaid or partial) invoices for the payment form's typeahead (AJAX):
+    invoices of the students best matching ``q``, and invoice ``q`` itself
+    when it is a number. Returns at most ``limit`` invoices.
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 25)
+    except ValueError:
+        limit = 10
+
+    results = []
+    if len(query) >= 2 or query.isdigit():
+        # Ranked students; their open invoices come from the (status, student) index
+        student_ids = matching_ids(query, 'student', limit)
+        condition = Q(student_id__in=student_ids)
+        if query.isdigit():
+            condition |= Q(id=int(query))
+        invoices = Invoice.objects.filter(
+            condition, status__in=['unpaid', 'partial'],
+        ).select_related('student__user', 'term', 'academic_year').order_by('-created_at')
+
+        rank = {student_id: index for index, student_id in enumerate(student_ids)}
+        invoices = sorted(
+            invoices,
+            key=lambda invoice: (str(invoice.id) != query, rank.get(invoice.student_id, len(rank))),
+        )
+        results = [
+            {
+                'id': invoice.id,
+                'student': invoice.student_id,
+                'label': f"Invoice #{invoice.id} - {invoice.student.full_name} "
+                         f"({invoice.student.student_id}), {invoice.term.get_name_display()} "
+                         f"{invoice.academic_year.year}",
                 'amount_due': float(invoice.amount_due),
-                'discount': discount,
-                'payable_amount': float(invoice.total_amount - discount),
                 'status': invoice.status,
-                'academic_year': str(invoice.academic_year),
-                'term': str(invoice.term),
             }
-            
-            return JsonResponse({'success': True, 'invoice': data})
-        except Exception as e:
-            return JsonResponse({'success': False, 'error': str(e)})
-    
-    return JsonResponse({'success': False, 'error': 'Invalid request method'})
+            for invoice in invoices[:limit]
+        ]
+    return JsonResponse({'success': True, 'query': query, 'results': results})
+
+@login_required
+def search_autocomplete(request):
+    """
+    Ranked students, sponsorships and invoices for search boxes (AJAX).
+    ``kind`` limits the results to a comma-separated list of kinds.
+    """
+    query = request.GET.get('q', '').strip()
+    kinds = [kind for kind in request.GET.get('kind', '').split(',') if kind in SEARCH_KINDS] or SEARCH_KINDS
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 25)
+    except ValueError:
+        limit = 10
+
+    results = []
+    if len(query) >= 2:
+        results = [
+            {
+                'kind': entry.kind,
+                'id': entry.object_id,
+                'student': entry.student_id,
+                'label': entry.label,
+            }
+            for entry in find(query, kinds, limit)
+        ]
+    return JsonResponse({'success': True, 'query': query, 'results': results})
 
 @login_required
 def payment_receipt(request, payment_id):
@@ -939,19 +878,19 @@ def fee_management(request):
     term_filter = request.GET.get('term', 'all')
     
     # Get current academic year
-    current_year = AcademicYear.objects.filter(is_active=True).first()
+    current_year = reference.current_year()
 
     # Get all fee types
     fee_types = FeeType.objects.all().order_by('name')
     
     # Get all classes
-    classes = SchoolClass.objects.all().order_by('name')
+    classes = reference.classes()
     
     # Get all academic years
-    academic_years = AcademicYear.objects.all().order_by('-year')
+    academic_years = reference.years()
     
     # Get all terms
-    terms = Term.objects.all()
+    terms = reference.terms()
     
     # Get all fee structures with filters
     fee_structures = FeeStructure.objects.select_related(
@@ -974,31 +913,11 @@ def fee_management(request):
         key = (fee.school_class.name, fee.academic_year.year)
         grouped_fees.setdefault(key, []).append(fee)
     
-    # Get all students with their current class and sponsorship info
-    students_in_class = StudentProfile.objects.select_related(
-        'user', 'sponsorship'
-    ).prefetch_related(
-        Prefetch(
-            'class_records',
-            queryset=StudentClass.objects.filter(is_current=True).select_related('school_class'),
-            to_attr='current_classes'
-        )
-    ).filter(is_active=True).order_by('user__last_name')
-    
-    # Calculate estimated total for each class
+    # Headcount and sponsorship-adjusted revenue per fee group, computed in SQL
     estimated_totals = {}
-    for key, fees in grouped_fees.items():
-        class_name = key[0]
-        # Count students in this class by checking their current_classes
-        student_count = 0
-        for student in students_in_class:
-            for class_record in student.current_classes:
-                if class_record.school_class.name == class_name:
-                    student_count += 1
-                    break
-        
-        total_fees = sum(fee.amount for fee in fees)
-        estimated_totals[key] = student_count * total_fees
+    for row in projected_revenue(fee_structures):
+        key = (row['school_class__name'], row['academic_year__year'])
+        estimated_totals[key] = estimated_totals.get(key, Decimal('0')) + row['expected_total']
     
     # Forms
     fee_type_form = FeeTypeForm()
@@ -1016,7 +935,7 @@ def fee_management(request):
         'academic_year_filter': academic_year_filter,
         'term_filter': term_filter,
         'current_year': current_year,
-        'students_in_class': students_in_class,
+        'estimated_totals': estimated_totals,
         'estimated_total': sum(estimated_totals.values()) if estimated_totals else 0,
     }
     
@@ -1066,74 +985,30 @@ def generate_invoices(request):
             messages.error(request, f'No active students found in {school_class.name}')
             return redirect('fee_management')
 
-        created_count = 0
-        skipped_count = 0
         errors = []
 
+        # Students that already have an invoice for this term
+        existing = set(
+            Invoice.objects.filter(
+                student__in=[record.student_id for record in student_class_records],
+                academic_year=academic_year,
+                term=term
+            ).values_list('student_id', flat=True)
+        )
+
+        students = []
         for student_class in student_class_records:
             student = student_class.student
+            if student.id in existing:
+                if not skip_existing:
+                    errors.append(f"{student.user.get_full_name()}: invoice already exists")
+                continue
+            students.append(student)
+        skipped_count = len(existing) if skip_existing else 0
 
-            try:
-                # Skip if invoice already exists
-                if skip_existing and Invoice.objects.filter(
-                    student=student,
-                    academic_year=academic_year,
-                    term=term
-                ).exists():
-                    skipped_count += 1
-                    continue
-
-                total_amount = Decimal('0.00')
-                invoice_items = []
-
-                # Calculate fees per fee structure
-                for fee_structure in fee_structures:
-                    fee_amount = fee_structure.amount
-
-                    if apply_sponsorship and hasattr(student, 'sponsorship'):
-                        sponsorship = student.sponsorship
-                        if sponsorship.sponsorship_type == 'full':
-                            fee_amount = Decimal('0.00')
-                        elif sponsorship.sponsorship_type == 'partial' and sponsorship.percentage_covered:
-                            discount = Decimal(sponsorship.percentage_covered) / Decimal('100')
-                            fee_amount = fee_amount * (Decimal('1') - discount)
-
-                    total_amount += fee_amount
-                    invoice_items.append({
-                        'fee_type': fee_structure.fee_type,
-                        'amount': fee_amount
-                    })
-
-                # Create invoice
-                invoice = Invoice.objects.create(
-                    student=student,
-                    academic_year=academic_year,
-                    term=term,
-                    total_amount=total_amount,
-                    amount_due=total_amount,
-                    status='unpaid'
-                )
-
-                # Create invoice items
-                for item_data in invoice_items:
-                    InvoiceItem.objects.create(
-                        invoice=invoice,
-                        fee_type=item_data['fee_type'],
-                        amount=item_data['amount']
-                    )
-
-                # Add notes about sponsorship
-                if apply_sponsorship and hasattr(student, 'sponsorship'):
-                    sponsorship = student.sponsorship
-                    invoice.notes = f"Sponsorship: {sponsorship.get_sponsorship_type_display()}"
-                    if sponsorship.sponsorship_type == 'partial' and sponsorship.percentage_covered:
-                        invoice.notes += f" ({sponsorship.percentage_covered}% covered)"
-                    invoice.save()
-
-                created_count += 1
-
-            except Exception as e:
-                errors.append(f"{student.user.get_full_name()}: {str(e)}")
+        # Price every student in one pass and write the invoices in bulk
+        quotes = price_students(students, fee_structures, use_sponsorship=apply_sponsorship)
+        created_count = create_invoices(quotes, academic_year, term)
 
         # Show success messages
         if created_count > 0:
@@ -1296,11 +1171,12 @@ def term_invoices(request, class_id, term_id, academic_year_id):
     academic_year = get_object_or_404(AcademicYear, id=academic_year_id)
     
     # Get students in this class
-    students = StudentProfile.objects.filter(
-        class_records__school_class=school_class,
-        class_records__is_current=True,
-        is_active=True
-    ).select_related('user').distinct()
+    # Current members of the class, as a subquery instead of a DISTINCT join
+    enrolled = StudentClass.objects.filter(
+        school_class=school_class,
+        is_current=True,
+    ).values('student')
+    students = StudentProfile.objects.filter(id__in=enrolled, is_active=True)
 
 
     
@@ -1313,53 +1189,48 @@ def term_invoices(request, class_id, term_id, academic_year_id):
     
     # Get invoices for this term and class
     invoices = Invoice.objects.filter(
-        student__class_records__school_class=school_class,
-        student__class_records__is_current=True,
+        student__in=enrolled,
         term=term,
         academic_year=academic_year
-    ).select_related('student__user').prefetch_related('payments').distinct()
+    ).select_related('student__user')
 
 
     
     # Apply search filter
     search_query = request.GET.get('search', '')
     if search_query:
-        invoices = invoices.filter(
-            Q(student__user__first_name__icontains=search_query) |
-            Q(student__user__last_name__icontains=search_query) |
-            Q(student__student_id__icontains=search_query)
-        )
+        invoices = filter_matching(invoices, search_query, 'invoice')
     
     # Apply status filter
     status_filter = request.GET.get('status', '')
     if status_filter and status_filter != 'all':
         invoices = invoices.filter(status=status_filter)
     
-    # Calculate statistics
-    total_invoices = invoices.count()
-    total_amount = invoices.aggregate(total=Sum('total_amount'))['total'] or Decimal('0')
-    total_paid = sum(
-        invoice.total_amount - invoice.amount_due 
-        for invoice in invoices
+    # Calculate statistics and counts by status in one query
+    stats = invoices.aggregate(
+        total_invoices=Count('id'),
+        total_amount=Sum('total_amount'),
+        total_due=Sum('amount_due'),
+        unpaid_count=Count('id', filter=Q(status='unpaid')),
+        partial_count=Count('id', filter=Q(status='partial')),
+        paid_count=Count('id', filter=Q(status='paid')),
     )
-    total_due = total_amount - total_paid
-    
-    # Get counts by status
-    status_counts = invoices.values('status').annotate(count=Count('id'))
-    unpaid_count = next((item['count'] for item in status_counts if item['status'] == 'unpaid'), 0)
-    partial_count = next((item['count'] for item in status_counts if item['status'] == 'partial'), 0)
-    paid_count = next((item['count'] for item in status_counts if item['status'] == 'paid'), 0)
+    total_invoices = stats['total_invoices']
+    total_amount = stats['total_amount'] or Decimal('0')
+    total_due = stats['total_due'] or Decimal('0')
+    total_paid = total_amount - total_due
+    unpaid_count = stats['unpaid_count']
+    partial_count = stats['partial_count']
+    paid_count = stats['paid_count']
     
-    # Pagination
-    paginator = Paginator(invoices, 25)  # Show 25 invoices per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Keyset pagination: 25 invoices per page, newest first
+    page_obj = KeysetPaginator(invoices, 25).page(request)
     
     context = {
         'school_class': school_class,
         'term': term,
         'academic_year': academic_year,
-        'students': students,
+        'student_count': students.count(),
         'fee_structures': fee_structures,
         'page_obj': page_obj,
         'total_invoices': total_invoices,
@@ -1401,70 +1272,41 @@ def generate_term_invoices(request):
         
         # Get all active students in the class
         students = StudentProfile.objects.filter(
-            current_class=school_class,
+            class_records__school_class=school_class,
+            class_records__is_current=True,
             is_active=True
-        )
+        ).select_related('sponsorship').distinct()
         
         skip_existing = request.POST.get('skip_existing') == 'on'
         apply_sponsorship = request.POST.get('apply_sponsorship') == 'on'
         send_notifications = request.POST.get('send_notifications') == 'on'
         
-        created_invoices = 0
-        skipped_invoices = 0
-        
-        for student in students:
-            # Check if invoice already exists
-            existing_invoice = Invoice.objects.filter(
-                student=student,
+        # Check which invoices already exist (unique per student/term/year)
+        existing = set(
+            Invoice.objects.filter(
+                student__in=students,
                 term=term,
                 academic_year=academic_year
-            ).exists()
-            
-            if skip_existing and existing_invoice:
-                skipped_invoices += 1
-                continue
-            
-            # Calculate total amount from fee structure
-            total_amount = sum(fee.amount for fee in fee_structures)
-            
-            # Apply sponsorship discount if applicable
-            if apply_sponsorship:
-                try:
-                    sponsorship = student.sponsorship
-                    if sponsorship.sponsorship_type == 'full':
-                        total_amount = Decimal('0')
-                    elif sponsorship.sponsorship_type == 'partial' and sponsorship.percentage_covered:
-                        discount = total_amount * (Decimal(sponsorship.percentage_covered) / Decimal('100'))
-                        total_amount = total_amount - discount
-                except Sponsorship.DoesNotExist:
-                    pass  # No sponsorship, use full amount
-            
-            # Create invoice
-            invoice = Invoice.objects.create(
-                student=student,
-                term=term,
-                academic_year=academic_year,
-                total_amount=total_amount,
-                amount_due=total_amount,
-                status='unpaid'
-            )
-            
-            # Create invoice items
-            for fee_structure in fee_structures:
-                invoice.items.create(
-                    fee_type=fee_structure.fee_type,
-                    amount=fee_structure.amount
-                )
-            
-            created_invoices += 1
-            
-            # TODO: Send notification if requested
-            # if send_notifications:
-            #     send_invoice_notification(invoice)
+            ).values_list('student_id', flat=True)
+        )
+        pending = [student for student in students if student.id not in existing]
+        # Unless skipped, existing invoices are regenerated at today's fees
+        regenerate = [] if skip_existing else [student for student in students if student.id in existing]
+        skipped_invoices = len(existing) - len(regenerate)
+        
+        # Price invoices; items and totals both carry the sponsorship discount
+        quotes = price_students(pending + regenerate, fee_structures, use_sponsorship=apply_sponsorship)
+        created_invoices = create_invoices(quotes[:len(pending)], academic_year, term)
+        regenerated_invoices = reprice_invoices(quotes[len(pending):], academic_year, term)
+        
+        # TODO: Send notification if requested
+        # if send_notifications:
+        #     send_invoice_notification(invoice)
         
         messages.success(
             request, 
-            f'Successfully generated {created_invoices} invoices. {skipped_invoices} invoices were skipped.'
+            f'Successfully generated {created_invoices} invoices. '
+            f'{regenerated_invoices} invoices were regenerated and {skipped_invoices} were skipped.'
         )
         
         return redirect('term_invoices', school_class_id, term_id, academic_year_id)
@@ -1479,6 +1321,13 @@ def record_payment(request, invoice_id):
     invoice = get_object_or_404(Invoice, id=invoice_id)
     
     if request.method == 'POST':
+        # A resubmitted form gets the first submission's answer
+        key = posting.key_from(request)
+        payment = posting.recorded(key)
+        if payment:
+            messages.info(request, f'Payment of ₦{payment.amount_paid:,.2f} was already recorded.')
+            return redirect('invoice_detail', invoice_id=invoice_id)
+
         amount_paid = Decimal(request.POST.get('amount_paid'))
         payment_method = request.POST.get('payment_method')
         payment_date = request.POST.get('payment_date')
@@ -1487,24 +1336,25 @@ def record_payment(request, invoice_id):
         # Validate amount
         if amount_paid <= 0:
             messages.error(request, 'Payment amount must be greater than 0.')
-        elif amount_paid > invoice.amount_due:
-            messages.error(request, f'Payment amount cannot exceed amount due (₦{invoice.amount_due:,.2f}).')
         else:
-            # Create payment
-            payment = Payment.objects.create(
-                invoice=invoice,
-                student=invoice.student,
-                payment_date=payment_date,
-                amount_paid=amount_paid,
-                payment_method=payment_method,
-                notes=notes,
-                status='completed'
-            )
-            
-            messages.success(request, f'Payment of ₦{amount_paid:,.2f} recorded successfully.')
-            
-            # Recalculate invoice status
-            invoice.recalculate()
+            # Checked against the amount due under the invoice's row lock
+            try:
+                payment, created = posting.record(Payment(
+                    invoice=invoice,
+                    student=invoice.student,
+                    payment_date=payment_date,
+                    amount_paid=amount_paid,
+                    payment_method=payment_method,
+                    notes=notes,
+                    status='completed'
+                ), key)
+            except posting.Overpayment as e:
+                messages.error(request, str(e))
+            else:
+                if created:
+                    messages.success(request, f'Payment of ₦{amount_paid:,.2f} recorded successfully.')
+                else:
+                    messages.info(request, f'Payment of ₦{payment.amount_paid:,.2f} was already recorded.')
     
     return redirect('invoice_detail', invoice_id=invoice_id)
 
@@ -1539,17 +1389,8 @@ def invoice_detail(request, invoice_id):
     # Get payment history
     payments = invoice.payments.all().order_by('-payment_date')
     
-    # Calculate total paid
-    total_paid = sum(payment.amount_paid for payment in payments)
-    
-    # Update invoice status if needed
-    if total_paid >= invoice.total_amount:
-        invoice.status = 'paid'
-    elif total_paid > 0:
-        invoice.status = 'partial'
-    else:
-        invoice.status = 'unpaid'
-    invoice.save()
+    # Calculate total paid (status and amount due are kept by finance.posting)
+    total_paid = sum(payment.amount_paid for payment in payments if payment.status == 'completed')
     
     context = {
         'invoice': invoice,
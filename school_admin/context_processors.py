@@ -1,12 +1,16 @@
 # school_admin/context_processors.py
+from core import caching
 from .models import SystemSettings
 
 def system_settings(request):
     """
     Make system settings available in ALL templates.
+
+    The row is read from the settings cache tier; saving SystemSettings
+    bumps its 'settings' tag.
     """
     try:
-        settings = SystemSettings.get_settings()
+        settings = caching.get_or_set('settings', 'system_settings', SystemSettings.get_settings, tags=('settings',))
         return {
             'system_settings': settings,
 
@@ -1,5 +1,7 @@
+import re
+
 from django import forms
-from .models import AdminProfile, SystemSettings
+from .models import AdminProfile, GradingBand, SystemSettings
 
 class AdminProfileForm(forms.ModelForm):
     class Meta:
@@ -63,3 +65,37 @@ class SystemSettingsForm(forms.ModelForm):
                 'placeholder': 'e.g. STU'
             }),
         }
+
+
+class GradingBandForm(forms.ModelForm):
+    class Meta:
+        model = GradingBand
+        fields = ['scale', 'min_score', 'value']
+        widgets = {
+            'scale': forms.Select(attrs={'class': 'form-select form-select-sm'}),
+            'min_score': forms.NumberInput(attrs={
+                'class': 'form-control form-control-sm',
+                'step': '0.01',
+                'min': '0',
+                'max': '100',
+            }),
+            'value': forms.TextInput(attrs={'class': 'form-control form-control-sm'}),
+        }
+
+    def clean_min_score(self):
+        min_score = self.cleaned_data['min_score']
+        if not 0 <= min_score <= 100:
+            raise forms.ValidationError("Scores run from 0 to 100")
+        return min_score
+
+    def clean(self):
+        cleaned_data = super().clean()
+        value = cleaned_data.get('value', '')
+        if cleaned_data.get('scale') == 'color' and not re.fullmatch(r'#[0-9A-Fa-f]{6}', value):
+            self.add_error('value', "Colours are written as #RRGGBB")
+        return cleaned_data
+
+
+GradingBandFormSet = forms.inlineformset_factory(
+    SystemSettings, GradingBand, form=GradingBandForm, extra=1, can_delete=True,
+)
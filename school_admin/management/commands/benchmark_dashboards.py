@@ -0,0 +1,261 @@
+import asyncio
+import io
+import json
+import statistics
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from accounts.models import User
+from students.models import StudentProfile
+
+
+class Command(BaseCommand):
+    help = (
+        "Latency and throughput of the dashboards under concurrent load, through "
+        "Django's WSGI and ASGI handlers in-process or against a running server (--url)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Requests per dashboard and handler")
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help="Requests in flight: threads for WSGI, tasks for ASGI")
+        parser.add_argument('--handlers', nargs='+', choices=['wsgi', 'asgi'], default=['wsgi', 'asgi'])
+        parser.add_argument('--url', help="Base URL of a running server, e.g. http://127.0.0.1:8000; "
+                                          "replaces the in-process handlers")
+        parser.add_argument('--output', default='dashboard-benchmark.json')
+        parser.add_argument('--baseline', help="Earlier results file to compare against")
+        parser.add_argument('--label', default='', help="Name for this run, e.g. 'gunicorn gthread'")
+
+    def handle(self, *args, **options):
+        admin = User.objects.filter(role='admin').first() or User.objects.filter(is_superuser=True).first()
+        # The student pages currently always show student id 2
+        student = StudentProfile.objects.filter(id=2).select_related('user').first()
+        if not (admin and student):
+            raise CommandError("Need an admin and student id 2. Run generate_school first.")
+
+        self.host = next(
+            (host for host in settings.ALLOWED_HOSTS if host and host[0] not in '.*'), 'testserver'
+        )
+        cases = {
+            'finance_dashboard': (admin, reverse('finance_dashboard')),
+            'admin_dashboard': (admin, reverse('admin_dashboard')),
+            'student_dashboard': (student.user, reverse('student_dashboard')),
+        }
+
+        # Sessions are created once and sent as cookies by every request
+        cookies = {}
+        for user, _ in cases.values():
+            if user.pk not in cookies:
+                client = Client()
+                client.force_login(user)
+                cookies[user.pk] = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+
+        runners = {'server': self.run_server} if options['url'] else {
+            'wsgi': self.run_wsgi, 'asgi': self.run_asgi,
+        }
+        if not options['url']:
+            runners = {name: runners[name] for name in options['handlers']}
+
+        results = {}
+        for name, (user, path) in cases.items():
+            results[name] = {}
+            for handler, runner in runners.items():
+                # Warm up (imports, template loading, caches) before timing
+                runner(path, cookies[user.pk], options['concurrency'], options['url'], count=options['concurrency'])
+                timings, errors, elapsed = runner(
+                    path, cookies[user.pk], options['concurrency'], options['url'], count=options['requests'],
+                )
+                results[name][handler] = self.summarize(timings, errors, elapsed)
+                self.report(name, handler, results[name][handler])
+
+        run = {
+            'label': options['label'],
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'url': options['url'],
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'results': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(run, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if options['baseline']:
+            self.compare(options['baseline'], results)
+
+    # --- Load generators ---------------------------------------------------
+
+    def run_wsgi(self, path, cookie, concurrency, url, count):
+        """Like a threaded WSGI server (gunicorn --threads): one request per thread at a time"""
+        application = WSGIHandler()
+
+        def get():
+            environ = {
+                'REQUEST_METHOD': 'GET',
+                'SCRIPT_NAME': '',
+                'PATH_INFO': path,
+                'QUERY_STRING': '',
+                'SERVER_NAME': self.host,
+                'SERVER_PORT': '80',
+                'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': self.host,
+                'HTTP_COOKIE': cookie,
+                'wsgi.version': (1, 0),
+                'wsgi.url_scheme': 'http',
+                'wsgi.input': io.BytesIO(),
+                'wsgi.errors': sys.stderr,
+                'wsgi.multithread': True,
+                'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+            }
+            status = []
+            start = time.perf_counter()
+            response = application(environ, lambda code, headers, exc_info=None: status.append(code))
+            try:
+                b''.join(response)
+            finally:
+                # Fires request_finished, which closes this thread's connection
+                response.close()
+            return time.perf_counter() - start, int(status[0].split()[0])
+
+        return self.run_threads(get, concurrency, count)
+
+    def run_server(self, path, cookie, concurrency, url, count):
+        """Against a running deployment (WSGI or ASGI), over HTTP"""
+        def get():
+            request = urllib.request.Request(url.rstrip('/') + path, headers={'Cookie': cookie})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            return time.perf_counter() - start, status
+
+        return self.run_threads(get, concurrency, count)
+
+    def run_threads(self, get, concurrency, count):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            responses = list(pool.map(lambda _: get(), range(count)))
+        elapsed = time.perf_counter() - start
+        return [timing for timing, _ in responses], sum(status != 200 for _, status in responses), elapsed
+
+    def run_asgi(self, path, cookie, concurrency, url, count):
+        """Like one uvicorn worker: ``concurrency`` requests in flight on one event loop"""
+        application = ASGIHandler()
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': b'',
+            'root_path': '',
+            'headers': [(b'host', self.host.encode()), (b'cookie', cookie.encode())],
+            'client': ('127.0.0.1', 0),
+            'server': (self.host, 80),
+        }
+
+        async def get():
+            body_sent = False
+            status = []
+
+            async def receive():
+                nonlocal body_sent
+                if not body_sent:
+                    body_sent = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # The client never disconnects; Django cancels this wait
+                await asyncio.Event().wait()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            start = time.perf_counter()
+            await application(dict(scope), receive, send)
+            return time.perf_counter() - start, status[0]
+
+        async def run():
+            slots = asyncio.Semaphore(concurrency)
+
+            async def limited():
+                async with slots:
+                    return await get()
+
+            start = time.perf_counter()
+            responses = await asyncio.gather(*(limited() for _ in range(count)))
+            return responses, time.perf_counter() - start
+
+        responses, elapsed = asyncio.run(run())
+        return [timing for timing, _ in responses], sum(status != 200 for _, status in responses), elapsed
+
+    # --- Reporting -----------------------------------------------------------
+
+    def summarize(self, timings, errors, elapsed):
+        ordered = sorted(timings)
+
+        def percentile(share):
+            return round(ordered[min(int(len(ordered) * share), len(ordered) - 1)] * 1000, 2)
+
+        return {
+            'requests': len(timings),
+            'errors': errors,
+            'throughput_rps': round(len(timings) / elapsed, 1),
+            'latency_ms': {
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'p99': percentile(0.99),
+                'mean': round(statistics.mean(timings) * 1000, 2),
+            },
+        }
+
+    def report(self, name, handler, result):
+        line = (
+            f"{name:<20} {handler:<6} {result['throughput_rps']:>8.1f} req/s  "
+            f"p50 {result['latency_ms']['p50']:>8.1f} ms  p95 {result['latency_ms']['p95']:>8.1f} ms  "
+            f"p99 {result['latency_ms']['p99']:>8.1f} ms"
+        )
+        if result['errors']:
+            self.stdout.write(self.style.WARNING(f"{line}  {result['errors']} non-200"))
+        else:
+            self.stdout.write(line)
+
+    def compare(self, path, results):
+        try:
+            with open(path) as f:
+                baseline = json.load(f)['results']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Could not read baseline {path}: {e}")
+
+        self.stdout.write(f"\nCompared with {path}:")
+        for name, handlers in results.items():
+            for handler, result in handlers.items():
+                # A server run is compared with whatever the baseline ran
+                before = baseline.get(name, {}).get(handler) or next(iter(baseline.get(name, {}).values()), None)
+                if not before or not before['throughput_rps'] or not before['latency_ms']['p95']:
+                    continue
+                throughput = result['throughput_rps'] / before['throughput_rps'] - 1
+                p95 = result['latency_ms']['p95'] / before['latency_ms']['p95'] - 1
+                line = f"{name:<20} {handler:<6} throughput {throughput:+7.1%}  p95 {p95:+7.1%}"
+                if throughput < -0.1 or p95 > 0.2:
+                    self.stdout.write(self.style.WARNING(line))
+                else:
+                    self.stdout.write(line)
@@ -0,0 +1,102 @@
+import json
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.template.backends.django import Template
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from accounts.models import User
+
+PAGES = ('manage_students', 'manage_terms', 'fee_management', 'sponsorship_management')
+
+
+class Command(BaseCommand):
+    help = (
+        "Render time of the admin pages with and without the {% fragment %} cache "
+        "(the 'fragments' tier swapped for a dummy cache)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--output', default='fragment-benchmark.json')
+        parser.add_argument('--only', nargs='*', choices=PAGES, help="Benchmark only these pages")
+
+    def handle(self, *args, **options):
+        admin = User.objects.filter(role='admin').first() or User.objects.filter(is_superuser=True).first()
+        if not admin:
+            raise CommandError("Need an admin user. Run generate_school first.")
+
+        host = next((host for host in settings.ALLOWED_HOSTS if host and host[0] not in '.*'), 'testserver')
+        self.client = Client(HTTP_HOST=host)
+        self.client.force_login(admin)
+
+        uncached = {**settings.CACHES, 'fragments': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        results = {}
+        for name in options['only'] or PAGES:
+            url = reverse(name)
+            with override_settings(CACHES=uncached):
+                before = self.benchmark(url, options['repeat'])
+            # The first request fills the fragments
+            self.benchmark(url, 1)
+            after = self.benchmark(url, options['repeat'])
+            results[name] = {'url': url, 'uncached': before, 'cached': after}
+            self.report(name, before, after)
+
+        with open(options['output'], 'w') as f:
+            json.dump({
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'database': connection.vendor,
+                'fragments_backend': settings.CACHES['fragments']['BACKEND'],
+                'repeat': options['repeat'],
+                'results': results,
+            }, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    @contextmanager
+    def timed_render(self, timings):
+        """Time spent in the view's top-level template render"""
+        render = Template.render
+
+        def timed(template, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return render(template, *args, **kwargs)
+            finally:
+                timings.append(time.perf_counter() - start)
+
+        with mock.patch.object(Template, 'render', timed):
+            yield
+
+    def benchmark(self, url, repeat):
+        walls, renders = [], []
+        for _ in range(repeat):
+            render_times = []
+            with self.timed_render(render_times), CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = self.client.get(url)
+                walls.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise CommandError(f"{url} answered {response.status_code}")
+            renders.append(sum(render_times))
+        return {
+            'wall_ms': round(statistics.median(walls) * 1000, 2),
+            'render_ms': round(statistics.median(renders) * 1000, 2),
+            'queries': len(queries),
+            'bytes': len(response.content),
+        }
+
+    def report(self, name, before, after):
+        saved = 1 - after['render_ms'] / before['render_ms'] if before['render_ms'] else 0
+        self.stdout.write(
+            f"{name:<24} render {before['render_ms']:>8.1f} -> {after['render_ms']:>8.1f} ms ({saved:>6.1%} saved)  "
+            f"wall {before['wall_ms']:>8.1f} -> {after['wall_ms']:>8.1f} ms  "
+            f"queries {before['queries']:>4} -> {after['queries']:>4}"
+        )
@@ -0,0 +1,218 @@
+import json
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from academics.models import AcademicYear, ScoreType, Term
+from accounts.models import User
+from finance import views as finance_views
+from finance.models import Invoice
+from staff.models import TeacherSubject
+from students.models import StudentClass, StudentProfile, StudentScore
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the hot views against the current database (see generate_school) and "
+        "record wall time, query count and peak memory to JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--output', default='benchmark-results.json')
+        parser.add_argument('--baseline', help="Earlier results file to compare against")
+        parser.add_argument('--label', default='', help="Name for this run, e.g. a commit hash")
+        parser.add_argument('--only', nargs='*', help="Benchmark only these views")
+
+    def handle(self, *args, **options):
+        academic_year = AcademicYear.objects.filter(is_active=True).first()
+        if not academic_year:
+            raise CommandError("No active academic year. Run generate_school --activate first.")
+        term = Term.objects.filter(academic_year=academic_year, is_current=True).first()
+        assignment = TeacherSubject.objects.filter(academic_year=academic_year).select_related('teacher__user').first()
+        admin = User.objects.filter(role='admin').first() or User.objects.filter(is_superuser=True).first()
+        # The student pages currently always show student id 2
+        student = StudentProfile.objects.filter(id=2).select_related('user').first()
+        if not (term and assignment and admin and student):
+            raise CommandError("Need a current term, a teacher assignment, an admin and student id 2.")
+
+        self.host = next(
+            (host for host in settings.ALLOWED_HOSTS if host and host[0] not in '.*'), 'testserver'
+        )
+        self.clients = {}
+        student_class = StudentClass.objects.filter(student=student, is_current=True).first()
+        cases = {
+            'finance_dashboard': (admin, 'GET', reverse('finance_dashboard'), None),
+            'term_invoices': (admin, 'GET', reverse('term_invoices', args=[
+                student_class.school_class_id if student_class else assignment.class_assigned_id,
+                term.id, academic_year.id,
+            ]), None),
+            'student_academic_scores': (student.user, 'GET', reverse('student_academic_scores'), None),
+            'download_report_card_pdf': (student.user, 'GET', reverse(
+                'download_report_card_pdf', args=[academic_year.id, term.id]
+            ), None),
+            'save_student_scores': (
+                assignment.teacher.user, 'POST', reverse('save_student_scores'),
+                self.score_form(assignment, academic_year, term),
+            ),
+            'generate_invoices': (
+                admin, 'POST', None,
+                {
+                    'school_class_id': assignment.class_assigned_id,
+                    'academic_year_id': academic_year.id,
+                    'term_id': term.id,
+                    'skip_existing': 'on',
+                    'apply_sponsorship': 'on',
+                },
+            ),
+        }
+        if options['only']:
+            unknown = set(options['only']) - set(cases)
+            if unknown:
+                raise CommandError(f"Unknown views: {', '.join(sorted(unknown))}")
+            cases = {name: case for name, case in cases.items() if name in options['only']}
+
+        # Log in up front: sessions saved inside a rolled-back run would be lost
+        for user, _, _, _ in cases.values():
+            if user.pk not in self.clients:
+                self.clients[user.pk] = Client(HTTP_HOST=self.host)
+                self.clients[user.pk].force_login(user)
+
+        results = {}
+        for name, case in cases.items():
+            results[name] = self.benchmark(name, *case, repeat=options['repeat'])
+            self.report(name, results[name])
+
+        run = {
+            'label': options['label'],
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'repeat': options['repeat'],
+            'dataset': {
+                'students': StudentProfile.objects.count(),
+                'scores': StudentScore.objects.count(),
+                'invoices': Invoice.objects.count(),
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(run, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if options['baseline']:
+            self.compare(options['baseline'], results)
+
+    def score_form(self, assignment, academic_year, term):
+        """A full score sheet for the teacher's first class/subject"""
+        student_ids = list(StudentClass.objects.filter(
+            school_class=assignment.class_assigned, academic_year=academic_year, is_current=True,
+        ).values_list('student_id', flat=True))
+        type_ids = list(ScoreType.objects.values_list('id', flat=True))
+        form = {
+            'class_id': assignment.class_assigned_id,
+            'subject_id': assignment.subject_id,
+            'term': term.id,
+            'student_ids': [str(student_id) for student_id in student_ids],
+        }
+        for student_id in student_ids:
+            for type_id in type_ids:
+                form[f"score_{student_id}_{type_id}"] = str((student_id * 7 + type_id) % 20)
+        return form
+
+    def request(self, user, method, url, data):
+        if url is None:
+            # generate_invoices has no route; call the view directly
+            request = RequestFactory().post('/finance/generate-invoices/', data, HTTP_HOST=self.host)
+            request.user = user
+            request.session = SessionStore()
+            request._messages = FallbackStorage(request)
+            return finance_views.generate_invoices(request)
+
+        client = self.clients[user.pk]
+        if method == 'POST':
+            return client.post(url, data)
+        return client.get(url)
+
+    def run_once(self, user, method, url, data, name):
+        """One request; writes are rolled back so every run sees the same data"""
+        with transaction.atomic():
+            if name == 'generate_invoices':
+                Invoice.objects.filter(
+                    student__class_records__school_class_id=data['school_class_id'],
+                    academic_year_id=data['academic_year_id'],
+                    term_id=data['term_id'],
+                ).delete()
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = self.request(user, method, url, data)
+                if getattr(response, 'streaming', False):
+                    b''.join(response.streaming_content)
+                elapsed = time.perf_counter() - start
+            transaction.set_rollback(True)
+        return response.status_code, elapsed, len(queries)
+
+    def benchmark(self, name, user, method, url, data, repeat):
+        # First (cold) run fills caches; it is reported but not timed
+        status, _, cold_queries = self.run_once(user, method, url, data, name)
+
+        timings = []
+        for _ in range(repeat):
+            status, elapsed, queries = self.run_once(user, method, url, data, name)
+            timings.append(elapsed)
+
+        tracemalloc.start()
+        self.run_once(user, method, url, data, name)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {
+            'method': method,
+            'url': url,
+            'status': status,
+            'wall_ms': {
+                'best': round(min(timings) * 1000, 2),
+                'median': round(statistics.median(timings) * 1000, 2),
+                'mean': round(statistics.mean(timings) * 1000, 2),
+            },
+            'queries': queries,
+            'cold_queries': cold_queries,
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    def report(self, name, result):
+        self.stdout.write(
+            f"{name:<26} {result['status']}  "
+            f"median {result['wall_ms']['median']:>9.1f} ms  "
+            f"{result['queries']:>4} queries (cold {result['cold_queries']})  "
+            f"peak {result['peak_memory_kb']:>9.1f} KiB"
+        )
+
+    def compare(self, path, results):
+        try:
+            with open(path) as f:
+                baseline = json.load(f)['results']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Could not read baseline {path}: {e}")
+
+        self.stdout.write(f"\nCompared with {path}:")
+        for name, result in results.items():
+            before = baseline.get(name)
+            if not before:
+                continue
+            wall = result['wall_ms']['median'] / before['wall_ms']['median'] - 1 if before['wall_ms']['median'] else 0
+            queries = result['queries'] - before['queries']
+            line = f"{name:<26} wall {wall:+7.1%}  queries {queries:+d}"
+            if queries > 0 or wall > 0.2:
+                self.stdout.write(self.style.WARNING(line))
+            else:
+                self.stdout.write(line)
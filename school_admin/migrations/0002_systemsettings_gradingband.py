@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-19 20:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('school_admin', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SystemSettings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('school_name', models.CharField(default='Our School', max_length=200)),
+                ('school_logo', models.ImageField(blank=True, null=True, upload_to='school/logo/')),
+                ('school_email', models.EmailField(blank=True, max_length=100, null=True)),
+                ('school_phone', models.CharField(blank=True, max_length=20, null=True)),
+                ('school_address', models.TextField(blank=True, null=True)),
+                ('default_student_password', models.CharField(default='Password123', max_length=100)),
+                ('student_id_option', models.CharField(choices=[('auto', 'Automatic Generation'), ('manual', 'Manual Input')], default='auto', max_length=10)),
+                ('student_id_prefix', models.CharField(default='STU', max_length=10)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GradingBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scale', models.CharField(choices=[('grade', 'Grade'), ('remark', 'Remark'), ('comment', "Teacher's comment"), ('performance', 'Performance label'), ('color', 'Score colour')], max_length=20)),
+                ('min_score', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('value', models.CharField(max_length=100)),
+                ('settings', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grading_bands', to='school_admin.systemsettings')),
+            ],
+            options={
+                'ordering': ['scale', '-min_score'],
+                'unique_together': {('settings', 'scale', 'min_score')},
+            },
+        ),
+    ]
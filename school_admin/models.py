@@ -85,3 +85,30 @@ class SystemSettings(models.Model):
     def get_settings(cls):
         settings, _ = cls.objects.get_or_create(id=1)
         return settings
+
+
+class GradingBand(models.Model):
+    """
+    One band of a grading scale: scores from ``min_score`` up to the next
+    band's get ``value``. Scales without any rows use the defaults in
+    students.grading.
+    """
+    SCALES = [
+        ('grade', 'Grade'),
+        ('remark', 'Remark'),
+        ('comment', "Teacher's comment"),
+        ('performance', 'Performance label'),
+        ('color', 'Score colour'),
+    ]
+
+    settings = models.ForeignKey(SystemSettings, on_delete=models.CASCADE, related_name='grading_bands')
+    scale = models.CharField(max_length=20, choices=SCALES)
+    min_score = models.DecimalField(max_digits=5, decimal_places=2)
+    value = models.CharField(max_length=100)  # colours as '#RRGGBB'
+
+    class Meta:
+        ordering = ['scale', '-min_score']
+        unique_together = ('settings', 'scale', 'min_score')
+
+    def __str__(self):
+        return f"{self.get_scale_display()} from {self.min_score}: {self.value}"
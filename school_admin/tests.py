@@ -1,3 +1,24 @@
 from django.test import TestCase
 
-# Create your tests here.
+from academics import reference
+from academics.models import AcademicYear
+from .utils import generate_school
+
+SCHOOL = dict(classes=1, students_per_class=1, subjects=1, score_types=1, terms=2)
+
+
+class GenerateSchoolTests(TestCase):
+    def setUp(self):
+        self.year = AcademicYear.objects.create(year='2000-2001', is_active=True)
+
+    def test_existing_years_are_left_alone(self):
+        school = generate_school(**SCHOOL)
+        self.assertFalse(AcademicYear.objects.get(pk=school['academic_year'].pk).is_active)
+        self.assertTrue(AcademicYear.objects.get(pk=self.year.pk).is_active)
+        self.assertFalse(school['academic_year'].terms.filter(is_current=True).exists())
+
+    def test_activate(self):
+        school = generate_school(activate=True, **SCHOOL)
+        self.assertFalse(AcademicYear.objects.get(pk=self.year.pk).is_active)
+        self.assertEqual(reference.current_year(), school['academic_year'])
+        self.assertEqual(reference.current_term(), school['term'])
@@ -14,6 +14,7 @@ urlpatterns = [
     path('score-types/', manage_score_types, name='manage_score_types'),
     path('teacher-subjects/', manage_teacher_subjects, name='manage_teacher_subjects'),
     path('terms/', manage_terms, name='manage_terms'),
+    path('analytics/', academic_analytics, name='academic_analytics'),
     path('admin/academic-years/', manage_academic_years, name='manage_academic_years'),
     path("profile/", admin_profile, name="admin_profile"),
     path('teacher/<int:teacher_id>/bank-details/', manage_bank_details, name='manage_bank_details'),
@@ -0,0 +1,290 @@
+# school_admin/utils.py
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from accounts.models import User
+from academics import reference
+from academics.models import AcademicYear, ClassSubject, SchoolClass, ScoreType, Subject, Term
+from core import caching
+from finance import posting
+from finance.models import FeeStructure, FeeType, Invoice, Payment, Sponsorship
+from finance.search import index_students
+from finance.utils import create_invoices, price_students
+from staff.models import TeacherProfile, TeacherSubject
+from students.models import StudentClass, StudentProfile, StudentScore
+
+
+FIRST_NAMES = [
+    'Abdullahi', 'Aisha', 'Amina', 'Bello', 'Chiamaka', 'Chinedu', 'Emeka', 'Fatima',
+    'Halima', 'Ibrahim', 'Kemi', 'Maryam', 'Musa', 'Ngozi', 'Olumide', 'Sadiq',
+    'Tunde', 'Umar', 'Yusuf', 'Zainab',
+]
+LAST_NAMES = [
+    'Abubakar', 'Adeyemi', 'Bakare', 'Danjuma', 'Eze', 'Garba', 'Ibrahim', 'Lawal',
+    'Mohammed', 'Nwosu', 'Okafor', 'Olawale', 'Sani', 'Suleiman', 'Usman', 'Yakubu',
+]
+SUBJECT_NAMES = [
+    'Mathematics', 'English Language', 'Basic Science', 'Social Studies', 'Civic Education',
+    'Islamic Studies', 'Arabic', 'Computer Studies', 'Agricultural Science', 'Home Economics',
+    'French', 'Hausa', 'Yoruba', 'Igbo', 'Creative Arts', 'Physical Education',
+]
+CLASS_NAMES = ['JSS1', 'JSS2', 'JSS3', 'SS1', 'SS2', 'SS3']
+# (name, maximum mark) - continuous assessments plus the exam
+SCORE_TYPES = [('1st CA', 20), ('2nd CA', 20), ('Exam', 60), ('Project', 10), ('Assignment', 10)]
+FEE_TYPES = [
+    ('Tuition', 4500000, 9000000),
+    ('Development Levy', 500000, 1500000),
+    ('Exam Fee', 300000, 800000),
+    ('Books', 800000, 2000000),
+    ('Sports', 100000, 400000),
+    ('ICT', 200000, 600000),
+]
+
+
+def _name(items, index):
+    """Cycle through a name list, numbering the names once it runs out"""
+    name = items[index % len(items)]
+    if index >= len(items):
+        name = f"{name} {index // len(items) + 1}"
+    return name
+
+
+def _bulk_users(usernames, password, role, rng):
+    """Bulk-create users and return them keyed by username (ids re-read for MySQL)"""
+    User.objects.bulk_create([
+        User(
+            username=username,
+            password=password,
+            role=role,
+            first_name=rng.choice(FIRST_NAMES),
+            last_name=rng.choice(LAST_NAMES),
+            gender=rng.choice(['M', 'F']),
+        )
+        for username in usernames
+    ], batch_size=1000)
+    return {user.username: user for user in User.objects.filter(username__in=usernames)}
+
+
+def generate_school(classes=6, students_per_class=30, subjects=8, score_types=3, terms=3,
+                    sponsorship_rate=0.2, payment_rate=0.6, prefix='SYN', seed=1,
+                    password='password', activate=False):
+    """
+    Create a synthetic school with bulk inserts: an academic year with its
+    terms, classes, subjects, teachers, students, scores for every term,
+    sponsorships, fee structures, invoices and payments.
+
+    Every username and student id starts with ``prefix`` so a generated
+    school can live next to real data. Existing academic years are left
+    alone unless ``activate`` is set: then the synthetic year becomes the
+    active one (and its last term the current one) in place of the year in
+    use, as benchmarks and tests need. Returns a summary of what was created
+    together with the academic year and the admin, teacher and student users
+    a benchmark can log in as.
+    """
+    rng = random.Random(seed)
+    slug = prefix.lower()
+    password = make_password(password)
+    today = date.today()
+
+    if User.objects.filter(username__startswith=f"{slug}-").exists():
+        raise ValueError(f"A synthetic school with prefix '{prefix}' already exists")
+
+    with transaction.atomic():
+        # Calendar
+        if activate:
+            AcademicYear.objects.filter(is_active=True).update(is_active=False)
+        academic_year = AcademicYear.objects.create(
+            year=f"{today.year}-{today.year + 1}",
+            is_active=activate,
+            start_date=today - timedelta(days=120),
+            end_date=today + timedelta(days=240),
+        )
+        term_list = [
+            Term.objects.create(academic_year=academic_year, name=code, is_current=activate and index == terms - 1)
+            for index, (code, _) in enumerate(Term.TERM_CHOICES[:terms])
+        ]
+        current_term = term_list[-1]
+
+        # Classes, subjects and score types
+        SchoolClass.objects.bulk_create([
+            SchoolClass(name=f"{prefix} {_name(CLASS_NAMES, i)}") for i in range(classes)
+        ])
+        class_list = list(SchoolClass.objects.filter(name__startswith=f"{prefix} ").order_by('id'))
+
+        Subject.objects.bulk_create([
+            Subject(name=f"{_name(SUBJECT_NAMES, i)} ({prefix})") for i in range(subjects)
+        ])
+        subject_list = list(Subject.objects.filter(name__endswith=f"({prefix})").order_by('id'))
+
+        ClassSubject.objects.bulk_create([
+            ClassSubject(school_class=school_class, subject=subject)
+            for school_class in class_list
+            for subject in subject_list
+        ])
+
+        type_max = {}
+        for index in range(score_types):
+            name, maximum = SCORE_TYPES[index % len(SCORE_TYPES)]
+            if index >= len(SCORE_TYPES):
+                name = f"{name} {index // len(SCORE_TYPES) + 1}"
+            score_type, _ = ScoreType.objects.get_or_create(
+                name=name, defaults={'max_score': maximum, 'weight': maximum},
+            )
+            type_max[score_type.id] = maximum
+
+        # Staff: one admin and one teacher per subject, teaching it in every class
+        admin = _bulk_users([f"{slug}-admin"], password, 'admin', rng)[f"{slug}-admin"]
+        teacher_users = _bulk_users(
+            [f"{slug}-teacher-{i:03d}" for i in range(subjects)], password, 'staff', rng
+        )
+        TeacherProfile.objects.bulk_create([
+            TeacherProfile(user=user, qualification='bachelors', nin=f"{prefix}-NIN-{username}")
+            for username, user in teacher_users.items()
+        ])
+        teachers = list(TeacherProfile.objects.filter(user__in=teacher_users.values()).order_by('user__username'))
+        TeacherSubject.objects.bulk_create([
+            TeacherSubject(teacher=teacher, subject=subject, academic_year=academic_year, class_assigned=school_class)
+            for teacher, subject in zip(teachers, subject_list)
+            for school_class in class_list
+        ])
+
+        # Students, enrolments and sponsorships
+        usernames = [f"{slug}-student-{i:05d}" for i in range(classes * students_per_class)]
+        student_users = _bulk_users(usernames, password, 'student', rng)
+        StudentProfile.objects.bulk_create([
+            StudentProfile(
+                user=student_users[username],
+                student_id=f"{prefix}-{i:05d}",
+                parent_name=f"{rng.choice(FIRST_NAMES)} {student_users[username].last_name}",
+                parent_contact=f"080{rng.randrange(10 ** 8):08d}",
+            )
+            for i, username in enumerate(usernames)
+        ], batch_size=1000)
+        students = list(StudentProfile.objects.filter(student_id__startswith=f"{prefix}-").order_by('student_id'))
+
+        enrolment = {}
+        for index, student in enumerate(students):
+            enrolment[student.id] = class_list[index // students_per_class]
+        StudentClass.objects.bulk_create([
+            StudentClass(student=student, school_class=enrolment[student.id], academic_year=academic_year)
+            for student in students
+        ], batch_size=1000)
+
+        sponsorships = []
+        for student in students:
+            roll = rng.random()
+            if roll < sponsorship_rate / 4:
+                sponsorships.append(Sponsorship(
+                    student=student, sponsorship_type='full', sponsor_name='State Government',
+                ))
+            elif roll < sponsorship_rate:
+                sponsorships.append(Sponsorship(
+                    student=student, sponsorship_type='partial', sponsor_name='Alumni Trust',
+                    percentage_covered=rng.choice([10, 25, 50, 75]),
+                ))
+        Sponsorship.objects.bulk_create(sponsorships, batch_size=1000)
+        # Bulk inserts send no signals; invoices are indexed by create_invoices
+        index_students([student.id for student in students])
+
+        # Scores for every term, around each student's own ability
+        ability = {student.id: min(max(rng.gauss(0.62, 0.15), 0.05), 1.0) for student in students}
+        scores = [
+            StudentScore(
+                student_id=student.id,
+                subject=subject,
+                academic_session=academic_year,
+                term=term,
+                score_type_id=type_id,
+                score=Decimal(str(round(maximum * min(max(rng.gauss(ability[student.id], 0.1), 0), 1), 1))),
+            )
+            for term in term_list
+            for student in students
+            for subject in subject_list
+            for type_id, maximum in type_max.items()
+        ]
+        StudentScore.objects.bulk_create(scores, batch_size=5000)
+
+        # Fees and invoices per class and term
+        FeeType.objects.bulk_create([
+            FeeType(name=f"{name} ({prefix})") for name, _, _ in FEE_TYPES
+        ])
+        fee_types = list(FeeType.objects.filter(name__endswith=f"({prefix})").order_by('id'))
+        ranges = {f"{name} ({prefix})": (low, high) for name, low, high in FEE_TYPES}
+        FeeStructure.objects.bulk_create([
+            FeeStructure(
+                fee_type=fee_type,
+                school_class=school_class,
+                academic_year=academic_year,
+                term=term,
+                amount=Decimal(rng.randrange(*ranges[fee_type.name]) // 500 * 500) / 100,
+            )
+            for school_class in class_list
+            for term in term_list
+            for fee_type in fee_types
+        ])
+
+        fee_structures = {}
+        for fee in FeeStructure.objects.filter(academic_year=academic_year).select_related('fee_type'):
+            fee_structures.setdefault((fee.school_class_id, fee.term_id), []).append(fee)
+
+        invoice_count = 0
+        for school_class in class_list:
+            class_students = list(
+                StudentProfile.objects.filter(
+                    class_records__school_class=school_class,
+                    class_records__academic_year=academic_year,
+                ).select_related('sponsorship')
+            )
+            for term in term_list:
+                quotes = price_students(class_students, fee_structures[(school_class.id, term.id)])
+                invoice_count += create_invoices(quotes, academic_year, term)
+
+        # Payments: earlier terms mostly settled, the current term partly paid
+        invoices = list(Invoice.objects.filter(academic_year=academic_year, amount_due__gt=0))
+        payments = []
+        for invoice in invoices:
+            rate = payment_rate if invoice.term_id == current_term.id else min(payment_rate + 0.3, 1)
+            if rng.random() >= rate:
+                continue
+            paid = invoice.total_amount if rng.random() < 0.7 else (
+                invoice.total_amount * Decimal(rng.choice([25, 40, 50, 75])) / 100
+            ).quantize(Decimal('0.01'))
+            payments.append(Payment(
+                invoice=invoice,
+                student_id=invoice.student_id,
+                payment_date=today - timedelta(days=rng.randrange(0, 120)),
+                amount_paid=paid,
+                payment_method=rng.choice(['cash', 'transfer', 'pos', 'online']),
+                status='completed',
+            ))
+        # bulk_create skips Payment.save(), so post the year's invoices in one UPDATE
+        Payment.objects.bulk_create(payments, batch_size=1000)
+        posting.update_balances(Invoice.objects.filter(academic_year=academic_year))
+
+        # Bulk writes send no model signals
+        caching.invalidate('fees', 'enrolment', 'scores', 'invoices', 'payments')
+        reference.invalidate()
+
+    return {
+        'academic_year': academic_year,
+        'term': current_term,
+        'admin': admin,
+        'teacher': teacher_users[f"{slug}-teacher-000"] if teacher_users else None,
+        'student': students[0].user if students else None,
+        'counts': {
+            'classes': len(class_list),
+            'subjects': len(subject_list),
+            'score_types': len(type_max),
+            'terms': len(term_list),
+            'teachers': len(teachers),
+            'students': len(students),
+            'sponsorships': len(sponsorships),
+            'scores': len(scores),
+            'invoices': invoice_count,
+            'payments': len(payments),
+        },
+    }
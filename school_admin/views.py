@@ -1,38 +1,47 @@
+import asyncio
 from datetime import datetime
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse
 from django.contrib import messages
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Prefetch, Q
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_GET
 
 from accounts.forms import StudentUserForm, TeacherUserForm, UserEditForm, AdminUserForm
 from students.forms import StudentProfileForm, StudentClassForm
 
+from students import analytics, grading
 from students.models import StudentProfile, StudentClass
 from students.utils import generate_student_id, normalize_name
 
 from staff.forms import TeacherProfileForm, TeacherSubjectForm, TeacherBankDetailsForm
 from staff.models import User, TeacherProfile, TeacherSubject, TeacherBankDetails
 
-from academics.forms import SchoolClassForm, AcademicYearForm, TermForm
+from academics import reference
+from academics.forms import SchoolClassForm, AcademicYearForm, TermForm, ScoreTypeForm
 from academics.models import AcademicYear, SchoolClass, Subject, ScoreType, Term
 
+from core.async_views import arender
+from core.pagination import KeysetPaginator
+
 from .models import AdminProfile, SystemSettings
-from .forms import AdminProfileForm, SystemSettingsForm
+from .forms import AdminProfileForm, GradingBandFormSet, SystemSettingsForm
+
+async def admin_dashboard(request):
+    # Get real data from database; the counts are independent
+    total_students, total_teachers = await asyncio.gather(
+        StudentProfile.objects.acount(),
+        TeacherProfile.objects.acount(),
+    )
 
-def admin_dashboard(request):
-    # Get real data from database
-    total_students = StudentProfile.objects.filter().count()
-    total_teachers = TeacherProfile.objects.filter().count()
-    
     context = {
         'total_students': total_students,
         'total_teachers': total_teachers,
     }
-    
-    return render(request, "school_admin/admin_dashboard.html", context)
+
+    return await arender(request, "school_admin/admin_dashboard.html", context)
 
 def manage_admins(request):
     # Get all admins with related data
@@ -165,7 +174,10 @@ def admin_profile(request):
 # views.py
 def manage_students(request):
     # Get all students with related data, ordered from newest to oldest
-    students_list = StudentProfile.objects.select_related('user').prefetch_related('class_records').all().order_by('-id')  # '-' means descending
+    # Ordered prefetch so class_records.first in the template reuses it
+    students_list = StudentProfile.objects.select_related('user').prefetch_related(
+        Prefetch('class_records', queryset=StudentClass.objects.select_related('school_class', 'academic_year').order_by('id'))
+    ).order_by('-id')
     
     # Get items per page from request or use default
     per_page = request.GET.get('per_page', 12)
@@ -176,16 +188,8 @@ def manage_students(request):
     except ValueError:
         per_page = 12
 
-    # Pagination setup
-    page = request.GET.get('page', 1)
-    paginator = Paginator(students_list, 12)  # Show 12 students per page
-    
-    try:
-        students = paginator.page(page)
-    except PageNotAnInteger:
-        students = paginator.page(1)
-    except EmptyPage:
-        students = paginator.page(paginator.num_pages)
+    # Keyset pagination: newest first, no OFFSET
+    students = KeysetPaginator(students_list, per_page).page(request)
     
     if request.method == "POST":
         # print("POST request received", request.POST)
@@ -397,15 +401,13 @@ def manage_teachers(request):
     except ValueError:
         per_page = 10
     
-    page = request.GET.get('page', 1)
-    paginator = Paginator(teachers_list, per_page)
-    
-    try:
-        teachers = paginator.page(page)
-    except PageNotAnInteger:
-        teachers = paginator.page(1)
-    except EmptyPage:
-        teachers = paginator.page(paginator.num_pages)
+    teachers = KeysetPaginator(teachers_list, per_page).page(request)
+    teacher_counts = teachers_list.aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(status='active')),
+        on_leave=Count('id', filter=Q(status='on_leave')),
+        inactive=Count('id', filter=Q(status='inactive')),
+    )
     
     if request.method == "POST":
         action = request.POST.get('action')
@@ -498,10 +500,10 @@ def manage_teachers(request):
         'profile_form': profile_form,
         'bank_form': bank_form,
         'teachers': teachers,
-        'total_teachers': teachers_list.count(),
-        'active_teachers': teachers_list.filter(status='active').count(),
-        'on_leave_teachers': teachers_list.filter(status='on_leave').count(),
-        'inactive_teachers': teachers_list.filter(status='inactive').count(),
+        'total_teachers': teacher_counts['total'],
+        'active_teachers': teacher_counts['active'],
+        'on_leave_teachers': teacher_counts['on_leave'],
+        'inactive_teachers': teacher_counts['inactive'],
         'status_filter': status_filter,
         'qualification_filter': qualification_filter,
         'per_page': per_page,
@@ -540,15 +542,7 @@ def manage_teacher_subjects(request):
     except ValueError:
         per_page = 10
     
-    page = request.GET.get('page', 1)
-    paginator = Paginator(assignments_list, per_page)
-    
-    try:
-        assignments = paginator.page(page)
-    except PageNotAnInteger:
-        assignments = paginator.page(1)
-    except EmptyPage:
-        assignments = paginator.page(paginator.num_pages)
+    assignments = KeysetPaginator(assignments_list, per_page).page(request)
     
     if request.method == "POST":
         action = request.POST.get('action')
@@ -634,11 +628,11 @@ def manage_teacher_subjects(request):
     context = {
         'form': form,
         'assignments': assignments,
-        'teachers': TeacherProfile.objects.all(),
-        'subjects': Subject.objects.all(),
-        'academic_years': AcademicYear.objects.all(),
-        'classes': SchoolClass.objects.all(),
-        'total_assignments': assignments_list.count(),
+        'teachers': TeacherProfile.objects.select_related('user'),
+        'subjects': reference.subjects(),
+        'academic_years': reference.years(),
+        'classes': reference.classes(),
+        'total_assignments': assignments.count,
         'teacher_filter': teacher_filter,
         'subject_filter': subject_filter,
         'year_filter': year_filter,
@@ -777,19 +771,25 @@ def manage_score_types(request):
         action = request.POST.get('action')
         
         if action == 'add':
-            name = request.POST.get('name')
-            if name:
-                ScoreType.objects.create(name=name)
-                messages.success(request, f'Score Type "{name}" added successfully!')
+            form = ScoreTypeForm(request.POST)
+            if form.is_valid():
+                score_type = form.save()
+                messages.success(request, f'Score Type "{score_type.name}" added successfully!')
+            else:
+                for errors in form.errors.values():
+                    messages.error(request, errors[0])
         
         elif action == 'edit':
             score_type_id = request.POST.get('edit_id')
-            name = request.POST.get('name')
-            if score_type_id and name:
+            if score_type_id:
                 score_type = get_object_or_404(ScoreType, id=score_type_id)
-                score_type.name = name
-                score_type.save()
-                messages.success(request, f'Score Type updated successfully!')
+                form = ScoreTypeForm(request.POST, instance=score_type)
+                if form.is_valid():
+                    form.save()
+                    messages.success(request, f'Score Type updated successfully!')
+                else:
+                    for errors in form.errors.values():
+                        messages.error(request, errors[0])
         
         elif action == 'delete':
             score_type_id = request.POST.get('delete_id')
@@ -1033,14 +1033,49 @@ def system_settings(request):
             request.FILES,          # ✅ REQUIRED FOR IMAGE UPLOAD
             instance=settings_instance
         )
-        if form.is_valid():
-            form.save()
-            messages.success(request, "System settings saved successfully!")
-            return redirect('system_settings')
+        band_formset = GradingBandFormSet(request.POST, instance=settings_instance, prefix='bands')
+        if form.is_valid() and band_formset.is_valid():
+            try:
+                with transaction.atomic():
+                    form.save()
+                    # The built-in bands become editable rows with the first valid save
+                    grading.seed_bands(settings_instance)
+                    band_formset.save()
+            except IntegrityError:
+                # A band added on the first save at the same score as a built-in one
+                band_formset.non_form_errors().append(
+                    "A band with this scale and minimum score already exists; edit it instead."
+                )
+            else:
+                grading.expire()
+                messages.success(request, "System settings saved successfully!")
+                return redirect('system_settings')
     else:
         form = SystemSettingsForm(instance=settings_instance)
+        band_formset = GradingBandFormSet(instance=settings_instance, prefix='bands')
 
     return render(request, 'school_admin/system_settings.html', {
         'form': form,
+        'band_formset': band_formset,
+        # Shown (read-only) until the first save stores them
+        'default_bands': None if settings_instance.grading_bands.exists() else grading.default_bands(),
         'settings': settings_instance
     })
+
+
+@login_required
+def academic_analytics(request):
+    """Term results by class and subject, against the previous term (students.analytics)"""
+    data = reference.snapshot()
+    term = data.term(request.GET.get('term')) or data.current_term
+    report = None
+    if term is not None and term.academic_year_id:
+        report = analytics.term_analytics(term.academic_year, term)
+
+    return render(request, 'school_admin/academic_analytics.html', {
+        'terms': data.terms,
+        'term': term,
+        'previous_term': data.term(report['previous_term_id']) if report else None,
+        'report': report,
+        'grades': analytics.grade_names(),
+    })
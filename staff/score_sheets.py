@@ -0,0 +1,227 @@
+"""
+Score sheets as spreadsheets, per class, subject and term: a pre-filled
+template to download and the upload that reads it back.
+
+    rows = score_sheets.template_rows(class_id, subject_id, academic_year_id, term_id)
+    score_sheets.write_csv(rows, response)
+
+    cells = score_sheets.parse_sheet(
+        score_sheets.read_rows(upload),
+        score_sheets.student_map(class_id, academic_year_id),
+        reference.score_types(),
+    )
+
+A sheet has a header row with a 'Student ID' column and one column per
+score type, named as the score type; other columns (the name) are ignored.
+Rows are matched to the class by student_id through one preloaded map, and
+blank cells are left alone, so a sheet may carry only some of the scores.
+
+Uploads are read one row at a time: CSV through csv.reader over the file's
+lines, .xlsx through openpyxl's read-only mode (when openpyxl is installed;
+otherwise only CSV is offered). The cells then go through
+staff.utils.clean_score_cells and save_score_cells like the dashboard grid.
+"""
+import codecs
+import csv
+import zipfile
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Max, Q
+
+from academics import reference
+from students.models import StudentClass
+
+try:
+    import openpyxl
+    from openpyxl.utils.exceptions import InvalidFileException
+except ImportError:
+    openpyxl = None
+
+EXCEL = openpyxl is not None
+
+STUDENT_ID = 'Student ID'
+
+CENT = Decimal('0.01')
+
+# An upload stops being read after this many problems
+MAX_ERRORS = 20
+
+
+class SheetErrors(ValueError):
+    """Problems found in an uploaded sheet, one message per cell or row"""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} problem(s) in the score sheet")
+        self.errors = errors
+
+
+def _key(name):
+    return ' '.join(str(name).split()).casefold()
+
+
+def _text(value):
+    if value is None:
+        return ''
+    # Spreadsheets store whole numbers (student ids too) as floats
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+# ======================
+# TEMPLATE
+# ======================
+
+def header(score_types):
+    return [STUDENT_ID, 'Name', *(score_type.name for score_type in score_types)]
+
+
+def template_rows(class_id, subject_id, academic_year_id, term_id):
+    """
+    The header and one row per student currently in the class with their
+    recorded scores, in one query: the scores are pivoted into a column per
+    score type with filtered aggregates.
+    """
+    score_types = reference.score_types()
+    sheet = Q(
+        student__studentscore__subject_id=subject_id,
+        student__studentscore__academic_session_id=academic_year_id,
+        student__studentscore__term_id=term_id,
+    )
+    columns = {
+        f"score_{score_type.id}": Max(
+            'student__studentscore__score',
+            filter=sheet & Q(student__studentscore__score_type_id=score_type.id),
+        )
+        for score_type in score_types
+    }
+    records = (
+        StudentClass.objects.filter(
+            school_class_id=class_id, academic_year_id=academic_year_id, is_current=True,
+        )
+        .values('student__student_id', 'student__user__first_name', 'student__user__last_name')
+        .annotate(**columns)
+        .order_by('student__user__last_name', 'student__user__first_name')
+    )
+
+    rows = [header(score_types)]
+    for record in records:
+        rows.append([
+            record['student__student_id'],
+            f"{record['student__user__first_name']} {record['student__user__last_name']}",
+            # SQLite hands aggregated decimals back unquantized
+            *(None if record[column] is None else record[column].quantize(CENT) for column in columns),
+        ])
+    return rows
+
+
+def write_csv(rows, out):
+    writer = csv.writer(out)
+    for row in rows:
+        writer.writerow(['' if value is None else value for value in row])
+
+
+def write_xlsx(rows, out):
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Scores')
+    for row in rows:
+        sheet.append([float(value) if isinstance(value, Decimal) else value for value in row])
+    workbook.save(out)
+
+
+# ======================
+# UPLOAD
+# ======================
+
+def read_rows(upload):
+    """Yield the rows of an uploaded .csv or .xlsx sheet one at a time"""
+    name = upload.name.lower()
+    if name.endswith('.csv'):
+        try:
+            yield from csv.reader(codecs.iterdecode(upload, 'utf-8-sig'))
+        except UnicodeDecodeError:
+            raise ValueError("The CSV file is not UTF-8 text")
+    elif name.endswith('.xlsx'):
+        if not EXCEL:
+            raise ValueError("Excel sheets cannot be read on this server; save the sheet as CSV")
+        try:
+            workbook = openpyxl.load_workbook(upload, read_only=True, data_only=True)
+        except (InvalidFileException, zipfile.BadZipFile, KeyError, OSError):
+            raise ValueError("The file is not a readable Excel workbook")
+        try:
+            yield from workbook.active.iter_rows(values_only=True)
+        finally:
+            workbook.close()
+    else:
+        raise ValueError("Upload the score sheet as a .csv or .xlsx file")
+
+
+def student_map(class_id, academic_year_id):
+    """{student_id code: StudentProfile id} for the students currently in the class"""
+    return dict(
+        StudentClass.objects.filter(
+            school_class_id=class_id, academic_year_id=academic_year_id, is_current=True,
+        ).values_list('student__student_id', 'student_id')
+    )
+
+
+def parse_sheet(rows, students, score_types):
+    """
+    Raw ``{"student", "score_type", "score"}`` cells from sheet rows, each
+    score checked against its score type's maximum mark and each student on
+    one row only. ``students`` is student_map(). Raises SheetErrors naming
+    the sheet rows at fault.
+    """
+    rows = iter(rows)
+    columns = {_key(name): index for index, name in enumerate(next(rows, None) or ()) if _text(name)}
+    if _key(STUDENT_ID) not in columns:
+        raise ValueError(f"The first row must be the header, with a '{STUDENT_ID}' column")
+    id_column = columns[_key(STUDENT_ID)]
+    type_columns = [
+        (columns[_key(score_type.name)], score_type)
+        for score_type in score_types
+        if _key(score_type.name) in columns
+    ]
+    if not type_columns:
+        names = ', '.join(score_type.name for score_type in score_types)
+        raise ValueError(f"No column is named after a score type ({names})")
+
+    width = max(columns.values()) + 1
+    cells, errors, seen = [], [], {}
+    for line, row in enumerate(rows, start=2):
+        values = [_text(value) for value in row]
+        values += [''] * (width - len(values))
+        if not any(values):
+            continue
+
+        code = values[id_column]
+        student = students.get(code)
+        if student is None:
+            errors.append(f"Row {line}: no student '{code}' in this class")
+        elif student in seen:
+            errors.append(f"Row {line}: student '{code}' is already on row {seen[student]}")
+        else:
+            seen[student] = line
+            for index, score_type in type_columns:
+                value = values[index]
+                if not value:
+                    continue
+                try:
+                    score = Decimal(value)
+                except InvalidOperation:
+                    score = None
+                if score is None or not score.is_finite():
+                    errors.append(f"Row {line}, {score_type.name}: '{value}' is not a number")
+                elif not 0 <= score <= score_type.max_score:
+                    errors.append(
+                        f"Row {line}, {score_type.name}: {value} is not between 0 and {score_type.max_score}"
+                    )
+                else:
+                    cells.append({'student': student, 'score_type': score_type.id, 'score': value})
+
+        if len(errors) >= MAX_ERRORS:
+            break
+
+    if errors:
+        raise SheetErrors(errors)
+    return cells
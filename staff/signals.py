@@ -0,0 +1,20 @@
+# staff/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core import outbox
+from .models import TeacherSubject
+from .utils import invalidate_teacher_workload
+
+
+@receiver([post_save, post_delete], sender=TeacherSubject)
+def refresh_teacher_workload(sender, instance, **kwargs):
+    """Assignments changed: cached workloads for that year are stale"""
+    invalidate_teacher_workload(instance.academic_year_id)
+
+
+@outbox.handler('students.StudentClass')
+def refresh_workload_headcounts(events):
+    """Enrolments changed: one bump per academic year in the batch"""
+    for academic_year_id in {event.payload['academic_year_id'] for event in events}:
+        invalidate_teacher_workload(academic_year_id)
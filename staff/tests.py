@@ -1,3 +1,218 @@
-from django.test import TestCase
+import json
+from decimal import Decimal
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.test import SimpleTestCase
+from django.urls import reverse
+
+from academics import reference
+from academics.models import AcademicYear, Term
+from core.testing import SchoolTestCase
+from students.models import StudentScore
+from . import score_sheets
+from .models import TeacherSubject
+from .utils import sync_score_batch
+
+
+class TeacherClassesTests(SchoolTestCase):
+    school = dict(classes=2, students_per_class=3, subjects=1, score_types=1, terms=1)
+
+    def test_current_year_workload(self):
+        self.client.force_login(self.generated['teacher'])
+        response = self.client.get(reverse('teacher_classes'))
+        self.assertContains(response, '2 classes,')
+        self.assertContains(response, '6 students')
+
+
+class ScoreSheetTestCase(SchoolTestCase):
+    school = dict(classes=1, students_per_class=3, subjects=2, score_types=2, terms=1)
+
+    def setUp(self):
+        super().setUp()
+        self.assignment = TeacherSubject.objects.select_related('teacher__user').order_by('id').first()
+        self.teacher = self.assignment.teacher
+        self.year = reference.current_year()
+        self.term = reference.current_term()
+        self.score_type = reference.score_types()[0]
+        self.student_id = StudentScore.objects.filter(
+            subject_id=self.assignment.subject_id,
+        ).values_list('student_id', flat=True).first()
+
+    def score(self):
+        return StudentScore.objects.get(
+            student_id=self.student_id, subject_id=self.assignment.subject_id,
+            score_type=self.score_type, term=self.term,
+        ).score
+
+    def other_years_term(self):
+        return Term.objects.create(academic_year=AcademicYear.objects.create(year='1999-2000'), name='1st')
+
+
+class ScoreGridTests(ScoreSheetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.teacher.user)
+        self.url = self.grid_url(self.term)
+
+    def grid_url(self, term):
+        return reverse('score_grid', args=[self.assignment.class_assigned_id, self.assignment.subject_id, term.id])
+
+    def patch(self, version, score, url=None):
+        return self.client.patch(url or self.url, json.dumps({
+            'version': version,
+            'cells': [{'student': self.student_id, 'score_type': self.score_type.id, 'score': score}],
+        }), content_type='application/json')
+
+    def test_save_bumps_the_version(self):
+        version = self.client.get(self.url).json()['grid']['version']
+        response = self.patch(version, '7')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['version'], version + 1)
+        self.assertEqual(self.score(), 7)
+
+    def test_stale_version_is_rejected(self):
+        version = self.client.get(self.url).json()['grid']['version']
+        self.patch(version, '7')
+
+        response = self.patch(version, '9')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['version'], version + 1)
+        self.assertEqual(self.score(), 7)
+
+    def test_other_years_term_is_not_found(self):
+        before = self.score()
+        term = self.other_years_term()
+        self.assertEqual(self.patch(0, '7', self.grid_url(term)).status_code, 404)
+
+        response = self.client.post(reverse('save_student_scores'), {
+            'class_id': self.assignment.class_assigned_id,
+            'subject_id': self.assignment.subject_id,
+            'term': term.id,
+            'student_ids': [self.student_id],
+            f'score_{self.student_id}_{self.score_type.id}': '7',
+        })
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.score(), before)
+        self.assertFalse(StudentScore.objects.filter(term=term).exists())
+
+
+class OfflineSyncTests(ScoreSheetTestCase):
+    def edits(self, score):
+        return [{
+            'class_id': self.assignment.class_assigned_id,
+            'subject_id': self.assignment.subject_id,
+            'term_id': self.term.id,
+            'student': self.student_id,
+            'score_type': self.score_type.id,
+            'score': score,
+        }]
+
+    def test_batch_is_applied_once(self):
+        result, duplicate = sync_score_batch(self.teacher, self.year, 'batch-1', self.edits('6'))
+        self.assertFalse(duplicate)
+        self.assertEqual(result['saved'], 1)
+        self.assertEqual(self.score(), 6)
+
+        # A retry replays the stored result, even with edits changed since
+        replay, duplicate = sync_score_batch(self.teacher, self.year, 'batch-1', self.edits('8'))
+        self.assertTrue(duplicate)
+        self.assertEqual(replay, result)
+        self.assertEqual(self.score(), 6)
+
+    def test_batch_ids_are_per_teacher(self):
+        sync_score_batch(self.teacher, self.year, 'batch-1', self.edits('6'))
+        other = TeacherSubject.objects.exclude(teacher=self.teacher).select_related('teacher').first().teacher
+        result, duplicate = sync_score_batch(other, self.year, 'batch-1', [])
+        self.assertFalse(duplicate)
+        self.assertEqual(result['saved'], 0)
+
+    def test_unassigned_sheet_is_rejected(self):
+        edits = self.edits('6') + self.edits('6')
+        edits[1]['subject_id'] = TeacherSubject.objects.exclude(
+            subject_id=self.assignment.subject_id,
+        ).values_list('subject_id', flat=True).first()
+        before = self.score()
+        with self.assertRaises(ValueError):
+            sync_score_batch(self.teacher, self.year, 'batch-2', edits)
+        # Nothing of the batch is written, so a corrected retry can reuse its id
+        self.assertEqual(self.score(), before)
+        self.assertFalse(self.teacher.score_sync_batches.exists())
+
+    def test_other_years_term_is_rejected(self):
+        edits = self.edits('6')
+        edits[0]['term_id'] = self.other_years_term().id
+        with self.assertRaisesMessage(ValueError, 'Unknown term'):
+            sync_score_batch(self.teacher, self.year, 'batch-3', edits)
+
+
+class ScoreSheetDownloadTests(ScoreSheetTestCase):
+    def download(self, term):
+        url = reverse('download_score_sheet', args=[self.assignment.class_assigned_id, self.assignment.subject_id])
+        return self.client.get(url, {'term': term.id})
+
+    def test_only_this_years_terms(self):
+        self.client.force_login(self.teacher.user)
+        response = self.download(self.term)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Student ID', response.content.decode())
+        self.assertEqual(self.download(self.other_years_term()).status_code, 404)
+
+
+class ParseSheetTests(SimpleTestCase):
+    students = {'SYN-001': 1, 'SYN-002': 2}
+    score_types = [
+        SimpleNamespace(id=10, name='1st CA', max_score=Decimal('20')),
+        SimpleNamespace(id=11, name='Exam', max_score=Decimal('60')),
+    ]
+
+    def parse(self, *rows):
+        return score_sheets.parse_sheet(
+            [['Student ID', 'Name', '1st CA', 'Exam'], *rows], self.students, self.score_types,
+        )
+
+    def errors(self, *rows):
+        with self.assertRaises(score_sheets.SheetErrors) as caught:
+            self.parse(*rows)
+        return caught.exception.errors
+
+    def test_cells(self):
+        cells = self.parse(['SYN-001', 'Ada', '15', ''], [], ['SYN-002', 'Bola', 12.0, 45])
+        self.assertEqual(cells, [
+            {'student': 1, 'score_type': 10, 'score': '15'},
+            {'student': 2, 'score_type': 10, 'score': '12'},
+            {'student': 2, 'score_type': 11, 'score': '45'},
+        ])
+
+    def test_header_is_matched_loosely(self):
+        cells = score_sheets.parse_sheet(
+            [[' student  id ', '1ST CA'], ['SYN-001', '3']], self.students, self.score_types,
+        )
+        self.assertEqual(cells, [{'student': 1, 'score_type': 10, 'score': '3'}])
+
+    def test_row_errors(self):
+        self.assertEqual(self.errors(
+            ['SYN-001', 'Ada', 'abc', '61'],
+            ['SYN-009', 'Nobody', '1', '1'],
+            ['SYN-002', 'Bola', 'NaN', ''],
+        ), [
+            "Row 2, 1st CA: 'abc' is not a number",
+            "Row 2, Exam: 61 is not between 0 and 60",
+            "Row 3: no student 'SYN-009' in this class",
+            "Row 4, 1st CA: 'NaN' is not a number",
+        ])
+
+    def test_student_on_two_rows(self):
+        self.assertEqual(
+            self.errors(['SYN-001', 'Ada', '1', ''], ['SYN-002', 'Bola', '2', ''], ['SYN-001', 'Ada', '3', '']),
+            ["Row 4: student 'SYN-001' is already on row 2"],
+        )
+
+    def test_errors_stop_at_the_limit(self):
+        rows = [['SYN-009', '', '', '']] * (score_sheets.MAX_ERRORS + 5)
+        self.assertEqual(len(self.errors(*rows)), score_sheets.MAX_ERRORS)
+
+    def test_bad_header(self):
+        with self.assertRaisesMessage(ValueError, "'Student ID' column"):
+            score_sheets.parse_sheet([['Name', 'Exam']], self.students, self.score_types)
+        with self.assertRaisesMessage(ValueError, 'No column is named after a score type'):
+            score_sheets.parse_sheet([['Student ID', 'Name']], self.students, self.score_types)
@@ -6,6 +6,10 @@ urlpatterns = [
 
     path('dashboard/', teacher_dashboard, name='teacher_dashboard'),
     path('save-scores/', save_student_scores, name='save_student_scores'),
+    path('score-sheet/<int:class_id>/<int:subject_id>/', download_score_sheet, name='download_score_sheet'),
+    path('score-sheet/upload/', upload_score_sheet, name='upload_score_sheet'),
+    path('score-grid/<int:class_id>/<int:subject_id>/<int:term_id>/', score_grid, name='score_grid'),
+    path('score-sync/', sync_scores, name='sync_scores'),
     # Add these URLs:
     path('teachers/profile/', teacher_profile, name='teacher_profile'),
     path('teachers/classes/', teacher_assigned_classes, name='teacher_classes'),
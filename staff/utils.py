@@ -0,0 +1,396 @@
+# staff/utils.py
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from academics import reference
+from core import caching, outbox
+from students import totals
+from students.models import ScoreSheet, ScoreSyncBatch, StudentClass, StudentScore
+from .models import TeacherSubject
+
+WORKLOAD_TIMEOUT = 60 * 60
+
+
+def _workload_tag(academic_year_id):
+    return f"teacher_workload:{academic_year_id}"
+
+
+def invalidate_teacher_workload(academic_year_id):
+    """Drop every cached workload for an academic year (bumps the year's tag)"""
+    caching.invalidate(_workload_tag(academic_year_id))
+
+
+def teacher_workload(teacher, academic_year):
+    """
+    Assignments, distinct classes with headcounts and unique student total
+    for a teacher in an academic year.
+
+    Assignments come back with each class headcount annotated by one grouped
+    query, plus one distinct count across the classes. Results are cached
+    per (teacher, academic year) in the aggregates tier and invalidated by
+    staff.signals.
+    """
+    if teacher is None or academic_year is None:
+        return {
+            'assignments': [],
+            'classes': [],
+            'subjects': [],
+            'total_students': 0,
+        }
+
+    return caching.get_or_set(
+        'aggregates',
+        f"teacher_workload:{academic_year.pk}:{teacher.pk}",
+        lambda: _load_teacher_workload(teacher, academic_year),
+        tags=(_workload_tag(academic_year.pk),),
+        timeout=WORKLOAD_TIMEOUT,
+    )
+
+
+def _load_teacher_workload(teacher, academic_year):
+    enrolled = StudentClass.objects.filter(
+        school_class=OuterRef('class_assigned'),
+        academic_year=academic_year,
+        is_current=True,
+    ).order_by().values('school_class')
+
+    assignments = list(
+        TeacherSubject.objects.filter(
+            teacher=teacher,
+            academic_year=academic_year,
+        ).select_related('subject', 'class_assigned').annotate(
+            headcount=Coalesce(
+                Subquery(enrolled.annotate(n=Count('student')).values('n')),
+                Value(0),
+                output_field=IntegerField(),
+            )
+        )
+    )
+
+    classes = {}
+    subjects = {}
+    for assignment in assignments:
+        school_class = assignment.class_assigned
+        classes.setdefault(school_class.id, {
+            'school_class': school_class,
+            'headcount': assignment.headcount,
+            'subjects': [],
+        })['subjects'].append(assignment.subject)
+        subjects.setdefault(assignment.subject.id, assignment.subject)
+
+    total_students = 0
+    if classes:
+        total_students = StudentClass.objects.filter(
+            school_class_id__in=classes.keys(),
+            academic_year=academic_year,
+            is_current=True,
+        ).values('student').distinct().count()
+
+    return {
+        'assignments': assignments,
+        'classes': list(classes.values()),
+        'subjects': sorted(subjects.values(), key=lambda subject: subject.name),
+        'total_students': total_students,
+    }
+
+
+def is_assigned(workload, class_id, subject_id):
+    """Whether a workload includes the (class, subject) pair"""
+    return any(
+        str(assignment.class_assigned_id) == str(class_id)
+        and str(assignment.subject_id) == str(subject_id)
+        for assignment in workload['assignments']
+    )
+
+
+# ======================
+# SCORE GRID
+# ======================
+
+def max_scores():
+    """{score_type_id: maximum mark} for validating entered scores"""
+    return {score_type.id: score_type.max_score for score_type in reference.score_types()}
+
+
+class StaleScoreSheet(Exception):
+    """The score grid was saved by someone else since the client loaded it"""
+
+    def __init__(self, version):
+        super().__init__(f"Score sheet has changed (now at version {version})")
+        self.version = version
+
+
+def _sheet_filter(class_id, subject_id, academic_year_id, term_id):
+    return {
+        'school_class_id': class_id,
+        'subject_id': subject_id,
+        'academic_session_id': academic_year_id,
+        'term_id': term_id,
+    }
+
+
+def enrolled_student_ids(class_id, academic_year_id):
+    """Ids of students currently in a class for an academic year"""
+    return set(
+        StudentClass.objects.filter(
+            school_class_id=class_id,
+            academic_year_id=academic_year_id,
+            is_current=True,
+        ).values_list('student_id', flat=True)
+    )
+
+
+def load_score_grid(class_id, subject_id, academic_year_id, term_id):
+    """
+    Score grid for a class/subject/term as plain JSON-ready data: the sheet
+    version, the score types and one row per student with scores and
+    weighted subject total (students.totals).
+    """
+    records = StudentClass.objects.filter(
+        school_class_id=class_id,
+        academic_year_id=academic_year_id,
+        is_current=True,
+    ).select_related('student__user').order_by('student__user__last_name', 'student__user__first_name')
+
+    scores = StudentScore.objects.filter(
+        student__class_records__school_class_id=class_id,
+        student__class_records__academic_year_id=academic_year_id,
+        student__class_records__is_current=True,
+        subject_id=subject_id,
+        academic_session_id=academic_year_id,
+        term_id=term_id,
+    )
+    cells = {}
+    for student_id, score_type_id, score in scores.values_list('student_id', 'score_type_id', 'score'):
+        cells.setdefault(student_id, {})[score_type_id] = score
+    subject_totals = {row['student_id']: row['total'] for row in totals.subject_totals(scores)}
+
+    students = []
+    for record in records:
+        student = record.student
+        scores = cells.get(student.id, {})
+        students.append({
+            'id': student.id,
+            'name': student.user.get_full_name(),
+            'student_id': student.student_id,
+            'scores': {str(type_id): str(score) for type_id, score in scores.items()},
+            'total': str(subject_totals.get(student.id, 0)),
+        })
+
+    version = ScoreSheet.objects.filter(
+        **_sheet_filter(class_id, subject_id, academic_year_id, term_id)
+    ).values_list('version', flat=True).first() or 0
+
+    return {
+        'version': version,
+        'score_types': [
+            {'id': score_type.id, 'name': score_type.name, 'max_score': str(score_type.max_score)}
+            for score_type in reference.score_types()
+        ],
+        'students': students,
+    }
+
+
+def clean_score_cells(cells, student_ids, score_limits):
+    """
+    Validate raw ``{"student", "score_type", "score"}`` cells against the
+    class's students and ``score_limits`` (see max_scores).
+
+    Returns ``(student_id, score_type_id, score)`` tuples where score is a
+    Decimal, or None for a cleared cell. Raises ValueError on bad input.
+    """
+    cleaned = {}
+    for cell in cells:
+        try:
+            student_id = int(cell['student'])
+            score_type_id = int(cell['score_type'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("Each cell needs a student and a score_type")
+
+        if student_id not in student_ids:
+            raise ValueError(f"Student {student_id} is not in this class")
+        if score_type_id not in score_limits:
+            raise ValueError(f"Unknown score type {score_type_id}")
+
+        value = cell.get('score')
+        if value is None or value == '':
+            score = None
+        else:
+            try:
+                score = Decimal(str(value)).quantize(Decimal('0.01'))
+            except InvalidOperation:
+                raise ValueError(f"Invalid score {value!r}")
+            maximum = score_limits[score_type_id]
+            if score < 0 or score > maximum:
+                raise ValueError(f"Scores must be between 0 and {maximum}")
+
+        # Last edit of a cell wins
+        cleaned[(student_id, score_type_id)] = score
+
+    return [(student_id, type_id, score) for (student_id, type_id), score in cleaned.items()]
+
+
+def save_score_cells(class_id, subject_id, academic_year_id, term_id, cells, version=None):
+    """
+    Write cleaned cells with one bulk upsert (plus one delete for cleared
+    cells) and bump the sheet version.
+
+    When ``version`` is given it must match the stored version, otherwise
+    StaleScoreSheet is raised and nothing is written. Returns the new
+    version and the subject totals of the students that were touched.
+    """
+    sheet_filter = _sheet_filter(class_id, subject_id, academic_year_id, term_id)
+    score_filter = {
+        'subject_id': subject_id,
+        'academic_session_id': academic_year_id,
+        'term_id': term_id,
+    }
+
+    with transaction.atomic():
+        sheet, _ = ScoreSheet.objects.get_or_create(**sheet_filter)
+        bumped = ScoreSheet.objects.filter(pk=sheet.pk)
+        if version is not None:
+            bumped = bumped.filter(version=version)
+        if not bumped.update(version=F('version') + 1):
+            raise StaleScoreSheet(
+                ScoreSheet.objects.filter(pk=sheet.pk).values_list('version', flat=True).get()
+            )
+
+        upserts = [
+            StudentScore(student_id=student_id, score_type_id=type_id, score=score, **score_filter)
+            for student_id, type_id, score in cells
+            if score is not None
+        ]
+        if upserts:
+            StudentScore.objects.bulk_create(
+                upserts,
+                update_conflicts=True,
+                # MySQL upserts on any unique key and rejects an explicit target
+                unique_fields=(
+                    ['student', 'subject', 'academic_session', 'term', 'score_type']
+                    if connection.features.supports_update_conflicts_with_target else None
+                ),
+                update_fields=['score'],
+            )
+
+        cleared = [(student_id, type_id) for student_id, type_id, score in cells if score is None]
+        if cleared:
+            lookup = Q()
+            for student_id, type_id in cleared:
+                lookup |= Q(student_id=student_id, score_type_id=type_id)
+            StudentScore.objects.filter(lookup, **score_filter).delete()
+
+        # The bulk upsert sends no model signals
+        outbox.emit_many('students.StudentScore', upserts)
+        outbox.emit_many('students.StudentScore', [
+            {'student_id': student_id, **score_filter} for student_id, _ in cleared
+        ], 'deleted')
+
+        if version is not None:
+            new_version = version + 1
+        else:
+            new_version = ScoreSheet.objects.filter(pk=sheet.pk).values_list('version', flat=True).get()
+
+    subject_totals = totals.subject_totals(StudentScore.objects.filter(
+        student_id__in={student_id for student_id, _, _ in cells},
+        **score_filter,
+    ))
+    return new_version, {row['student_id']: row['total'] for row in subject_totals}
+
+
+# ======================
+# OFFLINE SCORE SYNC
+# ======================
+
+MAX_SYNC_EDITS = 5000
+
+# Largest sync body once decompressed; MAX_SYNC_EDITS edits fit well within
+MAX_SYNC_BYTES = 2 * 1024 * 1024
+
+
+def _group_sync_edits(edits):
+    """Group queued edits by their (class, subject, term) score sheet"""
+    sheets = {}
+    for edit in edits:
+        try:
+            sheet = (int(edit['class_id']), int(edit['subject_id']), int(edit['term_id']))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("Each edit needs a class_id, subject_id and term_id")
+        sheets.setdefault(sheet, []).append(edit)
+    return sheets
+
+
+def sync_score_batch(teacher, academic_year, batch_id, edits):
+    """
+    Apply a batch of queued offline edits exactly once.
+
+    The batch is recorded under its client ``batch_id`` in the same
+    transaction as the score writes, so a retry (or a concurrent duplicate)
+    gets the stored result back without writing again. Edits are grouped by
+    score sheet and saved last-write-wins through save_score_cells.
+
+    Returns ``(result, duplicate)``. Raises ValueError on bad input or an
+    edit for a class/subject the teacher is not assigned to.
+    """
+    batch_id = str(batch_id or '').strip()
+    if not batch_id or len(batch_id) > 64:
+        raise ValueError("A batch_id of up to 64 characters is required")
+
+    # Batch ids are the client's, so they are only unique per teacher
+    replays = ScoreSyncBatch.objects.filter(teacher=teacher, batch_id=batch_id).values_list('result', flat=True)
+    stored = replays.first()
+    if stored is not None:
+        return stored, True
+
+    if not isinstance(edits, list) or len(edits) > MAX_SYNC_EDITS:
+        raise ValueError(f"A batch holds a list of at most {MAX_SYNC_EDITS} edits")
+
+    workload = teacher_workload(teacher, academic_year)
+    limits = max_scores()
+    grouped = _group_sync_edits(edits)
+    # Only this year's terms: scores are saved under academic_year
+    term_ids = {term.id for term in reference.snapshot().terms_for(academic_year)}
+
+    cleaned = {}
+    for (class_id, subject_id, term_id), sheet_edits in grouped.items():
+        if not is_assigned(workload, class_id, subject_id):
+            raise ValueError(f"You are not assigned to class {class_id} / subject {subject_id}")
+        if term_id not in term_ids:
+            raise ValueError(f"Unknown term {term_id} for {academic_year}")
+        cleaned[(class_id, subject_id, term_id)] = clean_score_cells(
+            sheet_edits,
+            enrolled_student_ids(class_id, academic_year.id),
+            limits,
+        )
+
+    try:
+        with transaction.atomic():
+            batch = ScoreSyncBatch.objects.create(
+                batch_id=batch_id, teacher=teacher, edit_count=len(edits),
+            )
+            sheets = []
+            for (class_id, subject_id, term_id), cells in cleaned.items():
+                version, totals = save_score_cells(
+                    class_id, subject_id, academic_year.id, term_id, cells,
+                )
+                sheets.append({
+                    'class_id': class_id,
+                    'subject_id': subject_id,
+                    'term_id': term_id,
+                    'version': version,
+                    'saved': len(cells),
+                    'totals': {str(student_id): str(total) for student_id, total in totals.items()},
+                })
+            batch.result = {'batch_id': batch_id, 'saved': len(edits), 'sheets': sheets}
+            batch.save(update_fields=['result'])
+    except IntegrityError:
+        # Lost the race to a concurrent retry of the same batch
+        stored = replays.first()
+        if stored is None:
+            raise
+        return stored, True
+
+    return batch.result, False
@@ -1,16 +1,28 @@
 # teachers/views.py
+import gzip
+import io
 import json
 from django.shortcuts import render,get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, require_http_methods
+from django.http import HttpResponse, JsonResponse
 from django.db.models import Prefetch
+from django.urls import reverse
 
 from .models import TeacherProfile, TeacherSubject, TeacherBankDetails
 from .forms import TeacherProfileForm, TeacherBankDetailsForm
+from . import score_sheets
+from .utils import (
+    teacher_workload, is_assigned, enrolled_student_ids, max_scores,
+    load_score_grid, clean_score_cells, save_score_cells, StaleScoreSheet,
+    sync_score_batch, MAX_SYNC_BYTES,
+)
 
+from students.totals import total_weight
 from students.models import StudentClass, StudentScore
-from academics.models import SchoolClass, ScoreType, Subject, AcademicYear, Term
+from academics import reference
+from academics.models import SchoolClass, Subject, AcademicYear, Term
 
 
 
@@ -24,15 +36,13 @@ def teacher_dashboard(request):
         return redirect('login')
 
     # Get current academic year
-    current_year = AcademicYear.objects.filter(is_active=True).first()
+    current_year = reference.current_year()
     if not current_year:
         current_year = AcademicYear.objects.last()
 
-    # Teacher assigned classes
-    assigned_classes = TeacherSubject.objects.filter(
-        teacher=teacher,
-        academic_year=current_year
-    ).select_related('class_assigned')
+    # Teacher assigned classes (cached per teacher and year)
+    workload = teacher_workload(teacher, current_year)
+    assigned_classes = workload['assignments']
 
     selected_class_id = request.GET.get('class_id')
     selected_subject_id = request.GET.get('subject_id')
@@ -46,31 +56,30 @@ def teacher_dashboard(request):
         selected_class = get_object_or_404(SchoolClass, id=selected_class_id)
         selected_subject = get_object_or_404(Subject, id=selected_subject_id)
 
-        is_assigned = TeacherSubject.objects.filter(
-            teacher=teacher,
-            class_assigned=selected_class,
-            subject=selected_subject,
-            academic_year=current_year
-        ).exists()
-
-        if is_assigned:
+        if is_assigned(workload, selected_class.id, selected_subject.id):
             students = StudentClass.objects.filter(
                 school_class=selected_class,
                 academic_year=current_year,
                 is_current=True
             ).select_related('student')
 
-            score_types = ScoreType.objects.all()
+            score_types = reference.score_types()
 
     context = {
         'teacher': teacher,
         'assigned_classes': assigned_classes,
+        'teacher_classes': workload['classes'],
         'students': students,
         'selected_class': selected_class,
         'selected_subject': selected_subject,
         'score_types': score_types,
+        'score_total_weight': total_weight(),
+        'excel_sheets': score_sheets.EXCEL,
         'current_year': current_year,
-        'terms': Term.objects.all(),
+        # Scores are saved against the current year, so only its terms are offered
+        'terms': reference.snapshot().terms_for(current_year),
+        'assigned_classes_count': len(workload['classes']),
+        'total_students_count': workload['total_students'],
     }
 
     return render(request, 'teachers/teacher_dashboard.html', context)
@@ -86,44 +95,43 @@ def save_student_scores(request):
         subject_id = request.POST.get('subject_id')
         term_id = request.POST.get('term')
         
-        # Validate teacher assignment
-        is_assigned = TeacherSubject.objects.filter(
-            teacher=teacher,
-            class_assigned_id=class_id,
-            subject_id=subject_id,
-            academic_year=AcademicYear.objects.filter(is_active=True).first()
-        ).exists()
+        # Get academic year
+        academic_year = reference.current_year()
         
-        if not is_assigned:
+        # Validate teacher assignment
+        if not is_assigned(teacher_workload(teacher, academic_year), class_id, subject_id):
             messages.error(request, 'You are not assigned to this class/subject.')
             return redirect('teacher_dashboard')
         
-        # Get academic year
-        academic_year = AcademicYear.objects.filter(is_active=True).first()
+        term = get_object_or_404(Term, id=term_id, academic_year=academic_year)
+        
+        # Collect the non-empty score_<student>_<type> cells in one pass
+        student_ids = set(request.POST.getlist('student_ids'))
+        cells = []
+        
+        for key, value in request.POST.items():
+            parts = key.split('_')
+            if len(parts) == 3 and parts[0] == 'score' and parts[1] in student_ids and value:
+                cells.append({
+                    'student': parts[1],
+                    'score_type': parts[2],
+                    'score': value,
+                })
         
-        # Process each student score
-        student_ids = request.POST.getlist('student_ids')
-        scores_saved = 0
+        # Validate and write all cells in one bulk upsert
+        try:
+            cells = clean_score_cells(
+                cells,
+                enrolled_student_ids(class_id, academic_year.id),
+                max_scores(),
+            )
+        except ValueError as e:
+            messages.error(request, str(e))
+            return redirect(f'{request.path}?class_id={class_id}&subject_id={subject_id}')
         
-        for student_id in student_ids:
-            for key, value in request.POST.items():
-                if key.startswith(f'score_{student_id}_') and value:
-                    try:
-                        score_type_id = key.split('_')[2]
-                        score_value = float(value)
-                        
-                        # Create or update score
-                        StudentScore.objects.update_or_create(
-                            student_id=student_id,
-                            subject_id=subject_id,
-                            academic_session=academic_year,
-                            term_id=term_id,
-                            score_type_id=score_type_id,
-                            defaults={'score': score_value}
-                        )
-                        scores_saved += 1
-                    except (ValueError, IndexError):
-                        continue
+        if cells:
+            save_score_cells(class_id, subject_id, academic_year.id, term.id, cells)
+        scores_saved = len(cells)
         
         messages.success(request, f'Successfully saved {scores_saved} scores.')
         return redirect(f'{request.path}?class_id={class_id}&subject_id={subject_id}')
@@ -131,6 +139,174 @@ def save_student_scores(request):
     return redirect('teacher_dashboard')
 
 
+@login_required
+def download_score_sheet(request, class_id, subject_id):
+    """Pre-filled score sheet of a class/subject for ?term=, as CSV or (?format=xlsx) Excel"""
+    teacher = get_object_or_404(TeacherProfile, user=request.user)
+    academic_year = reference.current_year()
+    if not is_assigned(teacher_workload(teacher, academic_year), class_id, subject_id):
+        messages.error(request, 'You are not assigned to this class/subject.')
+        return redirect('teacher_dashboard')
+
+    # Only this year's terms: the scores are saved against the current year
+    term = get_object_or_404(Term, id=request.GET.get('term') or 0, academic_year=academic_year)
+    school_class = get_object_or_404(SchoolClass, id=class_id)
+    subject = get_object_or_404(Subject, id=subject_id)
+    rows = score_sheets.template_rows(class_id, subject_id, academic_year.id, term.id)
+
+    filename = f"scores_{school_class.name}_{subject.name}_{term.name}".replace(' ', '_')
+    if request.GET.get('format') == 'xlsx' and score_sheets.EXCEL:
+        response = HttpResponse(
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+        score_sheets.write_xlsx(rows, response)
+        filename += '.xlsx'
+    else:
+        response = HttpResponse(content_type='text/csv; charset=utf-8')
+        score_sheets.write_csv(rows, response)
+        filename += '.csv'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@login_required
+@require_POST
+def upload_score_sheet(request):
+    """
+    Import a filled-in score sheet (see staff.score_sheets): every score of
+    the sheet is validated first and then saved in one bulk upsert, or none is
+    """
+    teacher = get_object_or_404(TeacherProfile, user=request.user)
+    class_id = request.POST.get('class_id')
+    subject_id = request.POST.get('subject_id')
+    academic_year = reference.current_year()
+    if not is_assigned(teacher_workload(teacher, academic_year), class_id, subject_id):
+        messages.error(request, 'You are not assigned to this class/subject.')
+        return redirect('teacher_dashboard')
+
+    term = get_object_or_404(Term, id=request.POST.get('term') or 0, academic_year=academic_year)
+    back = f"{reverse('teacher_dashboard')}?class_id={class_id}&subject_id={subject_id}"
+    upload = request.FILES.get('sheet')
+    if upload is None:
+        messages.error(request, 'Choose a score sheet to upload.')
+        return redirect(back)
+
+    students = score_sheets.student_map(class_id, academic_year.id)
+    try:
+        cells = clean_score_cells(
+            score_sheets.parse_sheet(score_sheets.read_rows(upload), students, reference.score_types()),
+            set(students.values()),
+            max_scores(),
+        )
+    except score_sheets.SheetErrors as e:
+        for error in e.errors:
+            messages.error(request, error)
+        messages.error(request, f'Nothing was imported from {upload.name}; correct the sheet and upload it again.')
+        return redirect(back)
+    except ValueError as e:
+        messages.error(request, str(e))
+        return redirect(back)
+
+    if cells:
+        save_score_cells(class_id, subject_id, academic_year.id, term.id, cells)
+    messages.success(request, f'Imported {len(cells)} scores from {upload.name}.')
+    return redirect(back)
+
+
+
+@login_required
+@require_http_methods(['GET', 'PATCH'])
+def score_grid(request, class_id, subject_id, term_id):
+    """
+    JSON score grid for a class/subject/term.
+    GET returns the grid and its version; PATCH saves only the changed cells:
+    {"version": 3, "cells": [{"student": 1, "score_type": 2, "score": "45"}]}
+    """
+    try:
+        teacher = request.user.teacher_profile
+    except TeacherProfile.DoesNotExist:
+        return JsonResponse({'success': False, 'error': 'Teacher profile not found'}, status=403)
+    
+    academic_year = reference.current_year()
+    if not is_assigned(teacher_workload(teacher, academic_year), class_id, subject_id):
+        return JsonResponse({'success': False, 'error': 'You are not assigned to this class/subject.'}, status=403)
+    
+    term = get_object_or_404(Term, id=term_id, academic_year=academic_year)
+    
+    if request.method == 'GET':
+        grid = load_score_grid(class_id, subject_id, academic_year.id, term.id)
+        return JsonResponse({'success': True, 'grid': grid})
+    
+    # PATCH: validate the dirty cells
+    try:
+        payload = json.loads(request.body)
+        version = int(payload['version'])
+        cells = clean_score_cells(
+            payload.get('cells', []),
+            enrolled_student_ids(class_id, academic_year.id),
+            max_scores(),
+        )
+    except (ValueError, KeyError, TypeError) as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    try:
+        version, totals = save_score_cells(
+            class_id, subject_id, academic_year.id, term.id, cells, version=version
+        )
+    except StaleScoreSheet as e:
+        return JsonResponse({
+            'success': False,
+            'error': 'These scores were changed by someone else. Reload the grid and try again.',
+            'version': e.version,
+        }, status=409)
+    
+    return JsonResponse({
+        'success': True,
+        'version': version,
+        'saved': len(cells),
+        'totals': {str(student_id): str(total) for student_id, total in totals.items()},
+    })
+
+
+@login_required
+@require_POST
+def sync_scores(request):
+    """
+    Idempotent bulk endpoint for the dashboard's offline score queue.
+    Body (optionally gzip-compressed, see Content-Encoding):
+    {"batch_id": "<client uuid>", "edits": [{"class_id": 1, "subject_id": 2,
+     "term_id": 1, "student": 5, "score_type": 1, "score": "45"}]}
+    Replaying a batch_id returns the stored result without writing again.
+    """
+    try:
+        teacher = request.user.teacher_profile
+    except TeacherProfile.DoesNotExist:
+        return JsonResponse({'success': False, 'error': 'Teacher profile not found'}, status=403)
+    
+    academic_year = reference.current_year()
+    if not academic_year:
+        return JsonResponse({'success': False, 'error': 'No active academic year.'}, status=400)
+    
+    try:
+        body = request.body
+        if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+            # Read no more than the cap, so a small body cannot expand without limit
+            with gzip.GzipFile(fileobj=io.BytesIO(body)) as stream:
+                body = stream.read(MAX_SYNC_BYTES + 1)
+            if len(body) > MAX_SYNC_BYTES:
+                return JsonResponse({
+                    'success': False,
+                    'error': f'The batch is larger than {MAX_SYNC_BYTES // (1024 * 1024)} MB once decompressed.',
+                }, status=413)
+        payload = json.loads(body)
+        result, duplicate = sync_score_batch(
+            teacher, academic_year, payload.get('batch_id'), payload.get('edits', [])
+        )
+    except (OSError, EOFError, ValueError, AttributeError) as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    return JsonResponse({'success': True, 'duplicate': duplicate, **result})
+
 
 @login_required(login_url='login')
 def teacher_profile(request):
@@ -142,37 +318,17 @@ def teacher_profile(request):
     bank_details, created = TeacherBankDetails.objects.get_or_create(teacher=teacher)
     
     # Get current assignments and statistics
-    current_year = AcademicYear.objects.filter(is_active=True).first()
-    
-    # Count assigned classes for current year
-    assigned_classes_count = TeacherSubject.objects.filter(
-        teacher=teacher,
-        academic_year=current_year
-    ).count()
-    
-    # Count total students across all assigned classes
-    total_students_count = 0
-    assignments = TeacherSubject.objects.filter(
-        teacher=teacher,
-        academic_year=current_year
-    ).select_related('class_assigned')
-    
-    for assignment in assignments:
-        total_students_count += StudentClass.objects.filter(
-            school_class=assignment.class_assigned,
-            academic_year=current_year,
-            is_current=True
-        ).count()
+    current_year = reference.current_year()
     
-    # Get subjects taught by this teacher
-    subjects_taught = teacher.subjects.all()
+    # Classes, headcounts and subjects for the current year
+    workload = teacher_workload(teacher, current_year)
     
     context = {
         'teacher': teacher,
         'bank_details': bank_details,
-        'assigned_classes_count': assigned_classes_count,
-        'total_students_count': total_students_count,
-        'subjects_taught': subjects_taught,
+        'assigned_classes_count': len(workload['classes']),
+        'total_students_count': workload['total_students'],
+        'subjects_taught': workload['subjects'],
         'current_year': current_year,
     }
     
@@ -223,7 +379,7 @@ def teacher_assigned_classes(request):
     except TeacherProfile.DoesNotExist:
         return redirect('login')
     
-    current_year = AcademicYear.objects.filter(is_active=True).first()
+    current_year = reference.current_year()
     
     # Get all assignments grouped by academic year
     assignments_by_year = {}
@@ -237,17 +393,15 @@ def teacher_assigned_classes(request):
             assignments_by_year[year] = []
         assignments_by_year[year].append(assignment)
     
-    # Count current assigned classes
-    assigned_classes_count = TeacherSubject.objects.filter(
-        teacher=teacher,
-        academic_year=current_year
-    ).count()
+    # Current year classes and headcounts
+    workload = teacher_workload(teacher, current_year)
     
     context = {
         'teacher': teacher,
         'assignments_by_year': assignments_by_year,
         'current_year': current_year,
-        'assigned_classes_count': assigned_classes_count,
+        'assigned_classes_count': len(workload['classes']),
+        'total_students_count': workload['total_students'],
     }
     
     return render(request, 'teachers/teacher_classes.html', context)
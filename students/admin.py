@@ -1,4 +1,5 @@
 from django.contrib import admin
-from .models import StudentScore
+from .models import AnnualResult, StudentScore
 # Register your models here.
 admin.site.register(StudentScore)
+admin.site.register(AnnualResult)
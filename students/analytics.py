@@ -0,0 +1,162 @@
+"""
+Term results analytics: per class and subject, mean, median, standard
+deviation, pass rate, grade distribution and change since the previous term.
+Grades and the pass mark come from the grading scheme (students.grading).
+
+    from students import analytics
+
+    report = analytics.term_analytics(academic_year, term)
+    report['rows']       # one dict per (class, subject)
+    report['classes']    # one dict per class, all subjects together
+    report['subjects']   # one dict per subject, school-wide
+    report['school']     # the whole term
+
+A student's result in a subject is their weighted subject total (see
+students.totals), as on the score sheets. Two grouped queries pull those
+totals for the term and for the previous term, one more maps students to
+their class for the year, and the rest is done in memory with the
+statistics module. Reports are cached per (year, term) in the aggregates
+tier and dropped when scores or enrolments of either term, or the grading
+bands, change.
+"""
+import statistics
+from collections import Counter, defaultdict
+
+from academics import reference
+from core import caching
+from .models import StudentClass, StudentScore
+from . import grading, totals
+
+ANALYTICS_TIMEOUT = 60 * 60
+
+
+def grade_names():
+    """Grades of the current scheme, best first"""
+    return [grade for _, grade in grading.scheme().scales['grade'].bands]
+
+
+def previous_term(term):
+    """The term before ``term``: earlier in its year, else the last of the year before"""
+    ordered = sorted(
+        (row for row in reference.terms() if row.academic_year_id),
+        # Year names sort as '2023-2024', term names as '1st', '2nd', '3rd'
+        key=lambda row: (row.academic_year.year, row.name, row.id),
+    )
+    index = next((i for i, row in enumerate(ordered) if row.pk == term.pk), None)
+    return ordered[index - 1] if index else None
+
+
+def _totals(academic_year_id, term_id):
+    """{(student_id, subject_id): total} for one term, in one grouped query"""
+    rows = totals.subject_totals(
+        StudentScore.objects.filter(academic_session_id=academic_year_id, term_id=term_id)
+    )
+    return {(row['student_id'], row['subject_id']): row['total'] for row in rows}
+
+
+def _class_of(academic_year_id):
+    """{student_id: school_class_id} for a year, the current record winning"""
+    records = (
+        StudentClass.objects.filter(academic_year_id=academic_year_id)
+        .order_by('is_current', 'id')
+        .values_list('student_id', 'school_class_id')
+    )
+    # Later rows overwrite earlier ones, so current records come out on top
+    return dict(records)
+
+
+def summarize(current, previous):
+    """
+    Figures for one group of results. ``current`` and ``previous`` map each
+    (student, subject) to this and last term's total; the change since last
+    term compares the students who have both.
+    """
+    scheme = grading.scheme()
+    totals = list(current.values())
+    count = len(totals)
+    grades = Counter(scheme.scales['grade'].many(totals))
+    summary = {
+        'results': count,
+        'mean': round(statistics.fmean(totals), 2),
+        'median': round(statistics.median(totals), 2),
+        'stdev': round(statistics.pstdev(totals), 2),
+        'highest': max(totals),
+        'lowest': min(totals),
+        'pass_rate': round(100 * sum(1 for total in totals if total >= scheme.pass_mark) / count, 1),
+        'grades': {grade: grades.get(grade, 0) for grade in grade_names()},
+        'previous_mean': None,
+        'change': None,
+        'improved': None,
+    }
+    paired = [(total, previous[key]) for key, total in current.items() if key in previous]
+    if paired:
+        before = statistics.fmean(prior for _, prior in paired)
+        now = statistics.fmean(total for total, _ in paired)
+        summary['previous_mean'] = round(before, 2)
+        summary['change'] = round(now - before, 2)
+        summary['improved'] = sum(1 for total, prior in paired if total > prior)
+    return summary
+
+
+def _build(academic_year, term):
+    data = reference.snapshot()
+    before = previous_term(term)
+
+    current = _totals(academic_year.pk, term.pk)
+    previous = _totals(before.academic_year_id, before.pk) if before else {}
+    class_of = _class_of(academic_year.pk)
+
+    # Every (student, subject) total counts towards its class/subject row,
+    # its class, its subject and the whole school
+    groups = defaultdict(dict)
+    for (student_id, subject_id), total in current.items():
+        class_id = class_of.get(student_id)
+        for group in (('row', class_id, subject_id), ('class', class_id), ('subject', subject_id), ('school',)):
+            groups[group][(student_id, subject_id)] = total
+
+    def class_name(class_id):
+        school_class = data.school_class(class_id)
+        return school_class.name if school_class else 'Unassigned'
+
+    def subject_name(subject_id):
+        subject = data.subject(subject_id)
+        return subject.name if subject else ''
+
+    rows, classes, subjects, school = [], [], [], None
+    for group, totals in groups.items():
+        summary = summarize(totals, previous)
+        kind, ids = group[0], group[1:]
+        if kind == 'row':
+            rows.append({
+                'school_class_id': ids[0], 'class_name': class_name(ids[0]),
+                'subject_id': ids[1], 'subject_name': subject_name(ids[1]), **summary,
+            })
+        elif kind == 'class':
+            classes.append({'school_class_id': ids[0], 'class_name': class_name(ids[0]), **summary})
+        elif kind == 'subject':
+            subjects.append({'subject_id': ids[0], 'subject_name': subject_name(ids[0]), **summary})
+        else:
+            school = summary
+
+    return {
+        'academic_year_id': academic_year.pk,
+        'term_id': term.pk,
+        'previous_term_id': before.pk if before else None,
+        'rows': sorted(rows, key=lambda row: (row['class_name'], row['subject_name'])),
+        'classes': sorted(classes, key=lambda row: row['class_name']),
+        'subjects': sorted(subjects, key=lambda row: row['subject_name']),
+        'school': school,
+    }
+
+
+def term_analytics(academic_year, term):
+    """The analytics report of a term (see the module docstring), cached"""
+    before = previous_term(term)
+    tags = ['reference', grading.TAG, f"scores:{academic_year.pk}:{term.pk}", f"enrolment:{academic_year.pk}"]
+    if before:
+        tags.append(f"scores:{before.academic_year_id}:{before.pk}")
+    return caching.get_or_set(
+        'aggregates', f"term_analytics:{academic_year.pk}:{term.pk}",
+        lambda: _build(academic_year, term),
+        tags=tags, timeout=ANALYTICS_TIMEOUT,
+    )
@@ -0,0 +1,123 @@
+"""
+Cumulative (annual) results: per student and academic year, the weighted
+totals of every term added up, the mean of the term averages and the
+position in the class by that average.
+
+    from students import annual
+
+    annual.compute(academic_year_id)                   # {class_id: [row, ...]}
+    annual.compute(academic_year_id, school_class_id)  # one class
+    annual.save(academic_year_id)                      # write AnnualResult rows
+
+A class (or a whole year) costs one grouped query: students.totals gives
+each student's total and average per term, which are folded and ranked in
+memory. save() writes the rows with one bulk upsert.
+
+``manage.py compute_annual_results`` writes a year at the end of it (and
+whenever promotions are due). Once a year has results, the outbox handler
+in students.signals keeps them up to date as scores and enrolments change.
+"""
+import statistics
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+
+from core import caching
+from .models import AnnualResult, StudentClass, StudentScore
+from . import totals
+
+CENT = Decimal('0.01')
+
+
+def tag(academic_year_id):
+    """Cache tag bumped when a year's annual results are rewritten"""
+    return f"annual:{academic_year_id}"
+
+
+def _class_of(academic_year_id, school_class_id=None):
+    """{student_id: school_class_id} for a year, the current record winning"""
+    records = StudentClass.objects.filter(academic_year_id=academic_year_id)
+    if school_class_id is not None:
+        records = records.filter(school_class_id=school_class_id)
+    # Later rows overwrite earlier ones, so current records come out on top
+    return dict(records.order_by('is_current', 'id').values_list('student_id', 'school_class_id'))
+
+
+def rank(rows):
+    """Set each row's position by average, best first; ties share (1, 2, 2, 4)"""
+    rows.sort(key=lambda row: -row['average'])
+    for index, row in enumerate(rows):
+        tied = index and rows[index - 1]['average'] == row['average']
+        row['position'] = rows[index - 1]['position'] if tied else index + 1
+        row['class_size'] = len(rows)
+    return rows
+
+
+def compute(academic_year_id, school_class_id=None):
+    """
+    Ranked annual rows per class, ``{school_class_id: [row, ...]}``, for every
+    class of the year or just ``school_class_id``. Students without scores
+    are left out.
+    """
+    class_of = _class_of(academic_year_id, school_class_id)
+    scores = StudentScore.objects.filter(academic_session_id=academic_year_id)
+    if school_class_id is not None:
+        scores = scores.filter(student_id__in=list(class_of))
+
+    by_student = defaultdict(list)
+    for row in totals.term_totals(scores):
+        by_student[row['student_id']].append(row)
+
+    classes = defaultdict(list)
+    for student_id, terms in by_student.items():
+        class_id = class_of.get(student_id)
+        if class_id is None:
+            continue
+        classes[class_id].append({
+            'student_id': student_id,
+            'school_class_id': class_id,
+            'terms': len(terms),
+            'total': Decimal(str(sum(term['total'] for term in terms))).quantize(CENT),
+            'average': Decimal(str(statistics.fmean(term['average'] for term in terms))).quantize(CENT),
+        })
+    return {class_id: rank(rows) for class_id, rows in classes.items()}
+
+
+def save(academic_year_id, school_class_id=None):
+    """
+    Compute and write the year's AnnualResult rows (one class or all),
+    dropping rows of students who no longer have results. Returns the count.
+    """
+    results = [
+        AnnualResult(academic_year_id=academic_year_id, **row)
+        for rows in compute(academic_year_id, school_class_id).values()
+        for row in rows
+    ]
+
+    with transaction.atomic():
+        stale = AnnualResult.objects.filter(academic_year_id=academic_year_id)
+        if school_class_id is not None:
+            stale = stale.filter(school_class_id=school_class_id)
+        stale.exclude(student_id__in=[result.student_id for result in results]).delete()
+
+        AnnualResult.objects.bulk_create(
+            results,
+            update_conflicts=True,
+            # MySQL upserts on any unique key and rejects an explicit target
+            unique_fields=(
+                ['student', 'academic_year']
+                if connection.features.supports_update_conflicts_with_target else None
+            ),
+            update_fields=['school_class', 'terms', 'total', 'average', 'position', 'class_size', 'updated_at'],
+        )
+        transaction.on_commit(lambda: caching.invalidate(tag(academic_year_id)))
+    return len(results)
+
+
+def written_years(academic_year_ids):
+    """The years among ``academic_year_ids`` that already have results"""
+    return set(
+        AnnualResult.objects.filter(academic_year_id__in=academic_year_ids)
+        .values_list('academic_year_id', flat=True).distinct()
+    )
@@ -0,0 +1,176 @@
+"""
+Grading scales: a score's grade, remark, teacher's comment, performance
+label and colour.
+
+The bands are GradingBand rows, edited on the System Settings page; a
+scale without rows uses DEFAULT_SCALES. Each scale is compiled once per
+process into ascending thresholds and looked up with bisect. Like
+academics.reference, the compiled Scheme is shared by the process and
+reloaded when the 'grading' cache tag moves (GradingBand writes bump it,
+see core.caching.MODEL_TAGS).
+
+    from students import grading
+
+    scheme = grading.scheme()
+    scheme.grade(72.5)                  # 'A'
+    results = scheme.grade_all(totals)  # one Result per score, in order
+
+Score pages ({% load grading_tags %}), report card PDFs and the analytics
+all grade through here, so they always agree.
+"""
+import threading
+import time
+from bisect import bisect_right
+from collections import defaultdict
+from dataclasses import dataclass
+
+from core import caching
+from school_admin.models import GradingBand
+
+TAG = 'grading'
+
+CHECK_INTERVAL = 5
+
+# scale: (lowest score, value) bands
+DEFAULT_SCALES = {
+    'grade': ((70, 'A'), (60, 'B'), (50, 'C'), (40, 'D'), (0, 'F')),
+    'remark': ((80, 'Excellent'), (60, 'Good'), (0, 'Needs Improvement')),
+    'comment': (
+        (90, 'Outstanding performance!'),
+        (80, 'Very good work.'),
+        (70, 'Good effort shown.'),
+        (60, 'Satisfactory.'),
+        (50, 'Can do better.'),
+        (0, 'Needs more attention.'),
+    ),
+    'performance': (
+        (80, 'EXCELLENT'), (70, 'VERY GOOD'), (60, 'GOOD'), (50, 'AVERAGE'), (0, 'NEEDS IMPROVEMENT'),
+    ),
+    'color': (
+        (90, '#27AE60'), (80, '#2ECC71'), (70, '#F1C40F'), (60, '#E67E22'), (50, '#E74C3C'), (0, '#C0392B'),
+    ),
+}
+
+SCALES = tuple(DEFAULT_SCALES)
+
+
+class Scale:
+    """One scale's bands as ascending thresholds with their values"""
+
+    __slots__ = ('thresholds', 'values')
+
+    def __init__(self, bands):
+        ordered = sorted((float(min_score), value) for min_score, value in bands)
+        self.thresholds = [min_score for min_score, _ in ordered]
+        self.values = [value for _, value in ordered]
+
+    def __call__(self, score):
+        # Scores below the lowest band get the lowest band's value
+        return self.values[max(bisect_right(self.thresholds, float(score)) - 1, 0)]
+
+    def many(self, scores):
+        thresholds, values = self.thresholds, self.values
+        return [values[max(bisect_right(thresholds, float(score)) - 1, 0)] for score in scores]
+
+    @property
+    def bands(self):
+        """(lowest score, value) from the top band down"""
+        return list(zip(reversed(self.thresholds), reversed(self.values)))
+
+
+@dataclass(frozen=True)
+class Result:
+    score: float
+    grade: str
+    remark: str
+    comment: str
+    performance: str
+    color: str
+
+
+@dataclass(frozen=True)
+class Scheme:
+    version: int
+    scales: dict
+
+    def grade(self, score):
+        return self.scales['grade'](score)
+
+    def remark(self, score):
+        return self.scales['remark'](score)
+
+    def comment(self, score):
+        return self.scales['comment'](score)
+
+    def performance(self, score):
+        return self.scales['performance'](score)
+
+    def color(self, score):
+        return self.scales['color'](score)
+
+    @property
+    def pass_mark(self):
+        """Lowest score above the bottom grade"""
+        thresholds = self.scales['grade'].thresholds
+        return thresholds[1] if len(thresholds) > 1 else thresholds[0]
+
+    def grade_all(self, scores):
+        """Every scale for a whole list of scores (a class, a term): one Result per score"""
+        scores = [float(score) for score in scores]
+        columns = [self.scales[name].many(scores) for name in SCALES]
+        return [Result(score, *values) for score, *values in zip(scores, *columns)]
+
+
+def default_bands():
+    """DEFAULT_SCALES as unsaved GradingBand rows, to show before any are stored"""
+    return [
+        GradingBand(scale=scale, min_score=min_score, value=value)
+        for scale, bands in DEFAULT_SCALES.items()
+        for min_score, value in bands
+    ]
+
+
+def seed_bands(system_settings):
+    """Store DEFAULT_SCALES as GradingBand rows when none are stored yet"""
+    if system_settings.grading_bands.exists():
+        return
+    bands = default_bands()
+    for band in bands:
+        band.settings = system_settings
+    GradingBand.objects.bulk_create(bands)
+
+
+def _load(version):
+    bands = defaultdict(list)
+    for scale, min_score, value in GradingBand.objects.values_list('scale', 'min_score', 'value'):
+        bands[scale].append((min_score, value))
+    return Scheme(
+        version=version,
+        scales={name: Scale(bands.get(name) or DEFAULT_SCALES[name]) for name in SCALES},
+    )
+
+
+_scheme = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def scheme():
+    """The current Scheme, reloaded when the shared version has moved"""
+    global _scheme, _checked_at
+    current = _scheme
+    if current is not None and time.monotonic() - _checked_at < CHECK_INTERVAL:
+        return current
+
+    version = caching.tag_versions([TAG])[TAG]
+    with _lock:
+        if _scheme is None or _scheme.version != version:
+            _scheme = _load(version)
+        _checked_at = time.monotonic()
+        return _scheme
+
+
+def expire():
+    """Check the shared version on the next access"""
+    global _checked_at
+    _checked_at = 0.0
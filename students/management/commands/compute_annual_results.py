@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from academics import reference
+from students import annual
+
+
+class Command(BaseCommand):
+    help = "Write cumulative annual results (totals, averages and class positions) for an academic year"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, help="Academic year id (default the current year)")
+        parser.add_argument('--class', dest='school_class', type=int, help="Only this class id")
+
+    def handle(self, *args, **options):
+        academic_year = reference.snapshot().year(options['year']) if options['year'] else reference.current_year()
+        if academic_year is None:
+            raise CommandError("No such academic year" if options['year'] else "No current academic year")
+
+        began = time.perf_counter()
+        count = annual.save(academic_year.pk, options['school_class'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {count} annual results for {academic_year.year} in {time.perf_counter() - began:.1f}s"
+        ))
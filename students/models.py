@@ -1,5 +1,6 @@
 from django.db import models
-from django.db.models import Avg
+
+from . import totals
 
 # Create your models here.
 
@@ -33,45 +34,30 @@ class StudentProfile(models.Model):
 
 
     def average_score(self, academic_session, term):
-        return StudentScore.objects.filter(
+        """Weighted term total per subject (see students.totals)"""
+        rows = totals.term_totals(StudentScore.objects.filter(
             student=self,
             academic_session=academic_session,
             term=term
-        ).aggregate(avg_score=Avg('score'))['avg_score']
+        ))
+        return next((row['average'] for row in rows), None)
     
 
     def class_rank(self, academic_session, term):
-        # Step 1: get this student's average
-        my_avg = StudentScore.objects.filter(
-            student=self,
-            academic_session=academic_session,
-            term=term
-        ).aggregate(avg=Avg('score'))['avg']
-
-        if my_avg is None:
+        """Position by term average among the current classmates; ties share it"""
+        current_record = self.class_records.filter(is_current=True).first()
+        if current_record is None:
             return None
 
-        # Step 2: get all students' averages in the same class
-        class_averages = (
+        positions = totals.ranked(
             StudentScore.objects.filter(
                 academic_session=academic_session,
                 term=term,
                 student__class_records__is_current=True,
-                student__class_records__school_class=
-                self.class_records.filter(is_current=True).first().school_class
+                student__class_records__school_class=current_record.school_class
             )
-            .values('student')
-            .annotate(avg=Avg('score'))
-            .order_by('-avg')
         )
-
-        # Step 3: calculate rank
-        rank = 1
-        for record in class_averages:
-            if record['avg'] > my_avg:
-                rank += 1
-
-        return rank
+        return next((row['position'] for row in positions if row['student_id'] == self.id), None)
 
 
     def __str__(self):
@@ -121,5 +107,69 @@ class StudentScore(models.Model):
     def __str__(self):
         return f"{self.student} - {self.subject} ({self.score_type}): {self.score}"
 
-    
 
+class AnnualResult(models.Model):
+    """
+    A student's cumulative result for an academic year: every term's
+    weighted total added up, the mean of the term averages and the position
+    in the class by it. Written by students.annual, read for promotions and
+    end-of-year report cards.
+    """
+    student = models.ForeignKey(
+        StudentProfile,
+        on_delete=models.CASCADE,
+        related_name="annual_results"
+    )
+    school_class = models.ForeignKey('academics.SchoolClass', on_delete=models.CASCADE)
+    academic_year = models.ForeignKey('academics.AcademicYear', on_delete=models.CASCADE)
+    terms = models.PositiveSmallIntegerField()  # terms with scores
+    total = models.DecimalField(max_digits=10, decimal_places=2)
+    average = models.DecimalField(max_digits=6, decimal_places=2)
+    position = models.PositiveIntegerField()  # ties share a position
+    class_size = models.PositiveIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('student', 'academic_year')
+        ordering = ['academic_year', 'school_class', 'position']
+
+    def __str__(self):
+        return f"{self.student} - {self.academic_year}: {self.average} ({self.position}/{self.class_size})"
+
+
+class ScoreSheet(models.Model):
+    """
+    Version counter for one (class, subject, session, term) score grid.
+    Bumped on every save so stale grid edits can be rejected.
+    """
+    school_class = models.ForeignKey('academics.SchoolClass', on_delete=models.CASCADE)
+    subject = models.ForeignKey('academics.Subject', on_delete=models.CASCADE)
+    academic_session = models.ForeignKey('academics.AcademicYear', on_delete=models.CASCADE)
+    term = models.ForeignKey('academics.Term', on_delete=models.CASCADE)
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('school_class', 'subject', 'academic_session', 'term')
+
+    def __str__(self):
+        return f"{self.school_class} - {self.subject} ({self.term}) v{self.version}"
+
+
+class ScoreSyncBatch(models.Model):
+    """
+    A batch of offline score edits, recorded once per teacher and client
+    batch id so a retried sync returns the stored result instead of writing
+    twice.
+    """
+    batch_id = models.CharField(max_length=64)
+    teacher = models.ForeignKey('staff.TeacherProfile', on_delete=models.CASCADE, related_name='score_sync_batches')
+    edit_count = models.PositiveIntegerField(default=0)
+    result = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('teacher', 'batch_id')
+
+    def __str__(self):
+        return f"{self.batch_id} ({self.edit_count} edits)"
@@ -0,0 +1,32 @@
+# students/signals.py
+from core import outbox
+from . import annual
+from .models import StudentClass
+
+
+@outbox.handler('students.StudentScore')
+def refresh_annual_results(events):
+    """
+    Scores changed in a year whose annual results are written: recompute
+    the classes of the students concerned, once each
+    """
+    students_by_year = {}
+    for event in events:
+        students_by_year.setdefault(event.payload['academic_session_id'], set()).add(event.payload['student_id'])
+
+    for academic_year_id in sorted(annual.written_years(students_by_year)):
+        class_ids = set(
+            StudentClass.objects.filter(
+                academic_year_id=academic_year_id, student_id__in=students_by_year[academic_year_id],
+            ).values_list('school_class_id', flat=True)
+        )
+        for school_class_id in sorted(class_ids):
+            annual.save(academic_year_id, school_class_id)
+
+
+@outbox.handler('students.StudentClass')
+def rerank_annual_results(events):
+    """Enrolments changed: students moved between classes, so the whole year is ranked again"""
+    years = {event.payload['academic_year_id'] for event in events}
+    for academic_year_id in sorted(annual.written_years(years)):
+        annual.save(academic_year_id)
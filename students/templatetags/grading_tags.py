@@ -0,0 +1,20 @@
+from django import template
+
+from students import grading
+
+register = template.Library()
+
+
+@register.filter
+def grade(score):
+    return grading.scheme().grade(score) if score not in (None, '') else ''
+
+
+@register.filter
+def remark(score):
+    return grading.scheme().remark(score) if score not in (None, '') else ''
+
+
+@register.filter
+def score_color(score):
+    return grading.scheme().color(score) if score not in (None, '') else ''
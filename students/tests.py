@@ -1,3 +1,264 @@
-from django.test import TestCase
+import statistics
+from decimal import Decimal
 
-# Create your tests here.
+from django.test import SimpleTestCase
+from django.urls import reverse
+
+from academics import reference
+from academics.models import ScoreType
+from core import caching
+from core.testing import SchoolTestCase
+from school_admin.models import GradingBand, SystemSettings
+from . import analytics, annual, grading, totals
+from .models import AnnualResult, StudentClass, StudentScore
+
+
+class AnalyticsTests(SchoolTestCase):
+    school = dict(classes=2, students_per_class=3, subjects=2, score_types=2, terms=2)
+
+    def setUp(self):
+        super().setUp()
+        self.year = reference.current_year()
+        self.term = reference.current_term()
+        self.first = analytics.previous_term(self.term)
+
+    def results(self, term):
+        rows = totals.subject_totals(StudentScore.objects.filter(academic_session=self.year, term=term))
+        return {(row['student_id'], row['subject_id']): row['total'] for row in rows}
+
+    def test_summary(self):
+        current = {(1, 1): 70, (2, 1): 50, (3, 1): 40}
+        summary = analytics.summarize(current, {(1, 1): 60, (2, 1): 55, (4, 1): 90})
+        self.assertEqual(summary['results'], 3)
+        self.assertEqual(summary['mean'], 53.33)
+        self.assertEqual(summary['median'], 50)
+        self.assertEqual(summary['stdev'], 12.47)
+        self.assertEqual((summary['highest'], summary['lowest']), (70, 40))
+        passed = sum(1 for total in current.values() if total >= grading.scheme().pass_mark)
+        self.assertEqual(summary['pass_rate'], round(100 * passed / 3, 1))
+        self.assertEqual(sum(summary['grades'].values()), 3)
+        # Only students 1 and 2 have both terms
+        self.assertEqual(summary['previous_mean'], 57.5)
+        self.assertEqual(summary['change'], 2.5)
+        self.assertEqual(summary['improved'], 1)
+
+    def test_without_a_previous_term(self):
+        self.assertIsNone(analytics.previous_term(self.first))
+        report = analytics.term_analytics(self.year, self.first)
+        self.assertIsNone(report['previous_term_id'])
+        self.assertIsNone(report['school']['change'])
+
+    def test_change_since_the_previous_term(self):
+        report = analytics.term_analytics(self.year, self.term)
+        self.assertEqual(report['previous_term_id'], self.first.pk)
+        self.assertEqual(len(report['classes']), 2)
+        self.assertEqual(len(report['subjects']), 2)
+        self.assertEqual(len(report['rows']), 4)
+
+        current, previous = self.results(self.term), self.results(self.first)
+        self.assertEqual(report['school']['results'], len(current))
+        self.assertEqual(report['school']['mean'], round(statistics.fmean(current.values()), 2))
+        change = statistics.fmean(current.values()) - statistics.fmean(previous.values())
+        self.assertEqual(report['school']['change'], round(change, 2))
+        self.assertEqual(
+            report['school']['improved'], sum(1 for key, total in current.items() if total > previous[key]),
+        )
+
+    def test_score_change_drops_the_cached_report(self):
+        before = analytics.term_analytics(self.year, self.term)['school']
+        score = StudentScore.objects.filter(academic_session=self.year, term=self.term).order_by('id').first()
+        score.score = 0 if score.score else score.score_type.max_score
+        with self.captureOnCommitCallbacks(execute=True):
+            score.save()
+        after = analytics.term_analytics(self.year, self.term)['school']
+        self.assertNotEqual(after['mean'], before['mean'])
+
+
+class GradingScaleTests(SimpleTestCase):
+    def test_highest_band_reached(self):
+        scale = grading.Scale(grading.DEFAULT_SCALES['grade'])
+        self.assertEqual([scale(score) for score in (100, 70, 69.99, 40, 39.5, 0)], ['A', 'A', 'B', 'D', 'F', 'F'])
+        # Below the lowest band still gets its value
+        self.assertEqual(grading.Scale([(40, 'P'), (60, 'C')])(10), 'P')
+        self.assertEqual(scale.many([55, 85]), ['C', 'A'])
+        self.assertEqual(scale.bands[0], (70.0, 'A'))
+
+    def test_grade_all(self):
+        scheme = grading.Scheme(version=0, scales={
+            name: grading.Scale(bands) for name, bands in grading.DEFAULT_SCALES.items()
+        })
+        first, second = scheme.grade_all(['91', 45])
+        self.assertEqual(
+            (first.grade, first.remark, first.performance, first.color), ('A', 'Excellent', 'EXCELLENT', '#27AE60'),
+        )
+        self.assertEqual((second.score, second.grade, second.comment), (45.0, 'D', 'Needs more attention.'))
+        self.assertEqual(scheme.pass_mark, 40)
+
+
+class GradingBandTests(SchoolTestCase):
+    school = dict(classes=1, students_per_class=1, subjects=1, score_types=1, terms=1)
+
+    def setUp(self):
+        super().setUp()
+        grading.expire()
+        self.defaults = sum(len(bands) for bands in grading.DEFAULT_SCALES.values())
+        self.client.force_login(self.generated['admin'])
+
+    def post(self, **data):
+        return self.client.post(reverse('system_settings'), {
+            'school_name': 'Test School',
+            'default_student_password': 'Password123',
+            'student_id_option': 'auto',
+            'student_id_prefix': 'STU',
+            'bands-TOTAL_FORMS': '1',
+            'bands-INITIAL_FORMS': '0',
+            'bands-0-scale': 'grade',
+            'bands-0-min_score': '',
+            'bands-0-value': '',
+            **data,
+        })
+
+    def test_stored_bands_replace_their_scale_only(self):
+        settings = SystemSettings.get_settings()
+        GradingBand.objects.bulk_create([
+            GradingBand(settings=settings, scale='grade', min_score=50, value='Pass'),
+            GradingBand(settings=settings, scale='grade', min_score=0, value='Fail'),
+        ])
+        caching.invalidate(grading.TAG)
+        grading.expire()
+
+        scheme = grading.scheme()
+        self.assertEqual((scheme.grade(75), scheme.grade(49)), ('Pass', 'Fail'))
+        self.assertEqual(scheme.remark(85), 'Excellent')
+
+    def test_settings_page_does_not_store_the_defaults(self):
+        response = self.client.get(reverse('system_settings'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['default_bands']), self.defaults)
+        self.assertFalse(GradingBand.objects.exists())
+
+        grading.seed_bands(SystemSettings.get_settings())
+        grading.seed_bands(SystemSettings.get_settings())
+        self.assertEqual(GradingBand.objects.count(), self.defaults)
+
+    def test_invalid_save_stores_no_bands(self):
+        response = self.post(**{'bands-0-min_score': '150', 'bands-0-value': 'E'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(GradingBand.objects.exists())
+
+        response = self.post(school_name='')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(GradingBand.objects.exists())
+
+    def test_first_save_stores_the_defaults_and_the_new_band(self):
+        response = self.post(**{'bands-0-min_score': '30', 'bands-0-value': 'E'})
+        self.assertRedirects(response, reverse('system_settings'))
+        self.assertEqual(GradingBand.objects.count(), self.defaults + 1)
+        self.assertEqual(grading.scheme().grade(35), 'E')
+
+    def test_new_band_on_a_default_score_is_an_error(self):
+        response = self.post(**{'bands-0-min_score': '70', 'bands-0-value': 'A+'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['band_formset'].non_form_errors())
+        self.assertFalse(GradingBand.objects.exists())
+        self.assertEqual(SystemSettings.get_settings().school_name, 'Our School')
+
+
+class ResultsTestCase(SchoolTestCase):
+    """One class of three students, two subjects, two score types and two terms"""
+    school = dict(classes=1, students_per_class=3, subjects=2, score_types=2, terms=2)
+
+    def setUp(self):
+        super().setUp()
+        self.set_weights((50, 50), (50, 50))
+        self.year = reference.current_year()
+        self.terms = sorted(reference.snapshot().terms_for(self.year), key=lambda term: term.id)
+        self.students = list(
+            StudentClass.objects.filter(academic_year=self.year).order_by('student_id')
+            .values_list('student_id', flat=True)
+        )
+
+    def set_weights(self, *types):
+        """(max_score, weight) per score type, in id order"""
+        for score_type, (max_score, weight) in zip(ScoreType.objects.order_by('id'), types):
+            score_type.max_score, score_type.weight = max_score, weight
+            score_type.save()
+
+    def set_scores(self, student_id, term, *scores):
+        """Every subject's scores of a term, one per score type in id order"""
+        for score_type_id, score in zip(ScoreType.objects.order_by('id').values_list('id', flat=True), scores):
+            StudentScore.objects.filter(
+                student_id=student_id, term=term, score_type_id=score_type_id,
+            ).update(score=score)
+
+    def scores(self, term):
+        return StudentScore.objects.filter(academic_session=self.year, term=term)
+
+
+class TotalsTests(ResultsTestCase):
+    def test_weighted_subject_totals(self):
+        term = self.terms[0]
+        self.set_scores(self.students[0], term, 40, 20)
+        self.assertEqual(
+            {row['total'] for row in totals.subject_totals(self.scores(term)) if row['student_id'] == self.students[0]},
+            {60.0},
+        )
+
+        # 25% and 75% of the subject: 40/50 * 25 + 20/50 * 75
+        self.set_weights((50, 25), (50, 75))
+        self.assertEqual(
+            {row['total'] for row in totals.subject_totals(self.scores(term)) if row['student_id'] == self.students[0]},
+            {50.0},
+        )
+
+    def test_totals_are_out_of_100_whatever_the_weights(self):
+        term = self.terms[0]
+        self.set_weights((50, 100), (50, 100))
+        self.set_scores(self.students[0], term, 50, 50)
+        self.set_scores(self.students[1], term, 40, 20)
+        rows = {row['student_id']: row for row in totals.term_totals(self.scores(term))}
+        self.assertEqual(rows[self.students[0]]['average'], 100.0)
+        self.assertEqual(rows[self.students[1]]['average'], 60.0)
+        self.assertEqual(rows[self.students[1]]['total'], 120.0)
+        self.assertEqual(rows[self.students[1]]['subjects'], 2)
+
+    def test_ties_share_a_position(self):
+        term = self.terms[0]
+        for student_id, score in zip(self.students, (40, 10, 40)):
+            self.set_scores(student_id, term, score, score)
+        rows = list(totals.ranked(self.scores(term)))
+        self.assertEqual([row['position'] for row in rows], [1, 1, 3])
+        self.assertEqual(
+            {row['student_id']: row['position'] for row in rows},
+            {self.students[0]: 1, self.students[2]: 1, self.students[1]: 3},
+        )
+        self.assertEqual(rows[0]['average'], 80.0)
+
+
+class AnnualResultTests(ResultsTestCase):
+    def test_rank(self):
+        rows = annual.rank([{'average': 50}, {'average': 70}, {'average': 50}, {'average': 40}])
+        self.assertEqual([(row['average'], row['position']) for row in rows], [(70, 1), (50, 2), (50, 2), (40, 4)])
+        self.assertEqual({row['class_size'] for row in rows}, {4})
+
+    def test_compute_folds_the_terms(self):
+        first, second = self.terms
+        # Term averages 80 and 60, 70 and 70, then 20 and 20
+        for student_id, scores in zip(self.students, ((40, 30), (35, 35), (10, 10))):
+            self.set_scores(student_id, first, scores[0], scores[0])
+            self.set_scores(student_id, second, scores[1], scores[1])
+
+        (class_id, rows), = annual.compute(self.year.id).items()
+        results = {row['student_id']: row for row in rows}
+        self.assertEqual(results[self.students[0]]['average'], Decimal('70.00'))
+        self.assertEqual(results[self.students[0]]['total'], Decimal('280.00'))
+        self.assertEqual(results[self.students[0]]['terms'], 2)
+        self.assertEqual(
+            [results[student_id]['position'] for student_id in self.students], [1, 1, 3],
+        )
+        self.assertEqual(annual.compute(self.year.id, class_id), {class_id: rows})
+
+        self.assertEqual(annual.save(self.year.id), 3)
+        self.assertEqual(
+            AnnualResult.objects.get(student_id=self.students[2], academic_year=self.year).position, 3,
+        )
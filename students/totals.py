@@ -0,0 +1,95 @@
+"""
+Weighted score totals, computed in SQL.
+
+Every ScoreType is entered out of its ``max_score`` and its ``weight`` is
+its share of the subject total, which is always out of 100: a score counts
+``score / max_score * weight * 100 / (sum of all weights)``. Grading bands
+run from 0 to 100 and so fit any weights. When the weights add up to 100
+and each equals its maximum mark (CA 20, CA 20, Exam 60) a score counts as
+entered and a subject total is the plain sum, as before weights existed.
+
+    from students import totals
+
+    scores = StudentScore.objects.filter(academic_session=year, term=term)
+    totals.subject_totals(scores)   # rows: student_id, subject_id, total
+    totals.term_totals(scores)      # rows: student_id, total, subjects, average
+    totals.ranked(scores)           # term_totals plus position, by average
+
+Rows carry academic_session_id and term_id too, so one query covers
+several terms. Ranks, score pages, report cards, the dashboards and the
+analytics all read their totals from here.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Sum, Value, Window
+from django.db.models.functions import Cast, Rank, Round
+
+from academics import reference
+
+TERM_FIELDS = ('academic_session_id', 'term_id', 'student_id')
+
+FULL_MARKS = Decimal(100)
+
+
+def total_weight():
+    """The weights of all score types added up (FULL_MARKS when there are none)"""
+    return sum((score_type.weight for score_type in reference.score_types()), Decimal(0)) or FULL_MARKS
+
+
+def _float(field):
+    # SQLite stores whole decimals as integers and would divide them as such
+    return Cast(field, FloatField())
+
+
+def weighted_score():
+    """A score's contribution to its subject total (out of FULL_MARKS)"""
+    return ExpressionWrapper(
+        _float('score') * _float('score_type__weight') * Value(float(FULL_MARKS))
+        / (_float('score_type__max_score') * Value(float(total_weight()))),
+        output_field=FloatField(),
+    )
+
+
+def _rounded(expression):
+    # Rounded in SQL and read as float: every backend returns the same value
+    # (SQLite would hand computed decimals back unquantized)
+    return Round(expression, 2, output_field=FloatField())
+
+
+def subject_totals(scores):
+    """One row per student, subject and term with the weighted ``total``"""
+    return (
+        scores.values(*TERM_FIELDS, 'subject_id')
+        .annotate(total=_rounded(Sum(weighted_score())))
+        .order_by()
+    )
+
+
+def term_totals(scores):
+    """
+    One row per student and term: the weighted ``total`` over all subjects,
+    the number of ``subjects`` and their ``average`` (total per subject)
+    """
+    return (
+        scores.values(*TERM_FIELDS)
+        .annotate(
+            total=_rounded(Sum(weighted_score())),
+            subjects=Count('subject_id', distinct=True),
+        )
+        .annotate(average=_rounded(F('total') / F('subjects')))
+        .order_by()
+    )
+
+
+def ranked(scores):
+    """
+    term_totals with each student's ``position`` by average within the term;
+    ties share a position (1, 2, 2, 4). Filter ``scores`` to a class first.
+    """
+    return term_totals(scores).annotate(
+        position=Window(
+            Rank(),
+            partition_by=[F('academic_session_id'), F('term_id')],
+            order_by=F('average').desc(),
+        ),
+    ).order_by('position')
@@ -10,10 +10,16 @@ from reportlab.pdfbase.pdfmetrics import registerFontFamily
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
 
+from . import grading
+
 
 
 def register_fonts():
     ROBOTO_DIR = os.path.join(settings.BASE_DIR, 'static', 'Roboto', 'static')
+    # Latin-only copies from `manage.py subset_fonts` load faster when present
+    subset_dir = os.path.join(settings.BASE_DIR, 'static', 'Roboto', 'subset')
+    if os.path.isfile(os.path.join(subset_dir, 'Roboto-Regular.ttf')):
+        ROBOTO_DIR = subset_dir
 
     try:
         pdfmetrics.registerFont(
@@ -57,18 +63,10 @@ def normalize_name(name):
     return ' '.join(normalized_words)
 
 
-# Helper functions
+# Helper functions (one score at a time; see students.grading for whole classes)
 def get_performance_label(average_score):
-    if average_score >= 80:
-        return "EXCELLENT"
-    elif average_score >= 70:
-        return "VERY GOOD"
-    elif average_score >= 60:
-        return "GOOD"
-    elif average_score >= 50:
-        return "AVERAGE"
-    else:
-        return "NEEDS IMPROVEMENT"
+    return grading.scheme().performance(average_score)
+
 
 def get_best_subject(scores):
     if scores.exists():
@@ -82,51 +80,18 @@ def get_weakest_subject(scores):
         return f"{weakest.subject.name} ({weakest.score}%)"
     return "N/A"
 
+
 def get_grade(score):
-    if score >= 70:
-        return "A"
-    elif score >= 60:
-        return "B"
-    elif score >= 50:
-        return "C"
-    elif score >= 40:
-        return "D"
-    else:
-        return "F"
+    return grading.scheme().grade(score)
 
 
 def get_remarks(score):
-    if score >= 80:
-        return "Excellent"
-    elif score >= 60:
-        return "Good"
-    else:
-        return "Needs Improvement"
+    return grading.scheme().remark(score)
+
 
 def get_teacher_comment(score):
-    if score >= 90:
-        return "Outstanding performance!"
-    elif score >= 80:
-        return "Very good work."
-    elif score >= 70:
-        return "Good effort shown."
-    elif score >= 60:
-        return "Satisfactory."
-    elif score >= 50:
-        return "Can do better."
-    else:
-        return "Needs more attention."
+    return grading.scheme().comment(score)
+
 
 def get_score_color(score):
-    if score >= 90:
-        return colors.HexColor('#27AE60')  # Green
-    elif score >= 80:
-        return colors.HexColor('#2ECC71')  # Light Green
-    elif score >= 70:
-        return colors.HexColor('#F1C40F')  # Yellow
-    elif score >= 60:
-        return colors.HexColor('#E67E22')  # Orange
-    elif score >= 50:
-        return colors.HexColor('#E74C3C')  # Red
-    else:
-        return colors.HexColor('#C0392B')  # Dark Red
+    return colors.HexColor(grading.scheme().color(score))
@@ -1,17 +1,22 @@
+import asyncio
 from io import BytesIO
 from collections import defaultdict
 
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.http import HttpResponse
-from django.db.models import Avg, Q, Sum
+from django.db.models import Prefetch, Q
 from django.conf import settings
 
-from .models import StudentProfile, StudentScore, StudentClass
+from .models import AnnualResult, StudentProfile, StudentScore, StudentClass
+from . import annual, grading, totals
 from school_admin.models import SystemSettings
-from finance.models import Invoice, Sponsorship
+from finance.models import Invoice, Payment, Sponsorship
+from academics import reference
 from academics.models import AcademicYear, Term, ScoreType
 from staff.models import TeacherSubject
+from core import caching
+from core.async_views import alist, arender
 # PDF Generation imports
 from reportlab.lib import colors
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image, PageBreak
@@ -24,137 +29,124 @@ from .utils import *
 
 
 @login_required
-def student_dashboard(request):
-    try:
-        student = StudentProfile.objects.get(id=2)  # For testing
-    except:
-        student = StudentProfile.objects.first()
-    academic_session = AcademicYear.objects.filter(is_active=True).first()
-    current_term = academic_session.terms.filter(is_current=True).first() if academic_session else None
-    
+async def student_dashboard(request):
+    """
+    Student dashboard: term averages, ranks and subject scores, invoices by
+    term and sponsorship.
+
+    Grouped queries per section instead of queries per term; the sections
+    are independent and awaited together.
+    """
+    student = (
+        await StudentProfile.objects.select_related('user').filter(id=2).afirst()  # For testing
+        or await StudentProfile.objects.select_related('user').afirst()
+    )
+    reference_data, current_record, sponsorship = await asyncio.gather(
+        reference.asnapshot(),
+        student.class_records.filter(is_current=True).select_related('school_class').afirst(),
+        Sponsorship.objects.filter(student=student).afirst(),
+    )
+    academic_session = reference_data.current_year
+    current_class = current_record.school_class if current_record else None
+
+    terms = term_averages = subject_totals = class_positions = invoices = []
+    class_size = None
+    if academic_session:
+        terms = list(reference_data.terms_for(academic_session))
+        scores = StudentScore.objects.filter(academic_session=academic_session)
+        (
+            term_averages, subject_totals, class_positions, invoices, class_size,
+        ) = await asyncio.gather(
+            alist(totals.term_totals(scores.filter(student=student))),
+            alist(totals.subject_totals(scores.filter(student=student)).order_by('term_id', '-total')),
+            # The class ranked per term, for the student's positions
+            alist(
+                totals.ranked(scores.filter(
+                    student__class_records__is_current=True,
+                    student__class_records__school_class=current_class,
+                ))
+            ),
+            alist(
+                Invoice.objects.filter(student=student, academic_year=academic_session)
+                .select_related('term', 'academic_year')
+                .prefetch_related(Prefetch(
+                    'payments',
+                    queryset=Payment.objects.filter(status='completed').order_by('-payment_date'),
+                    to_attr='completed_payments',
+                ))
+            ),
+            StudentClass.objects.filter(
+                school_class=current_class,
+                academic_year=academic_session,
+                is_current=True
+            ).acount(),
+        )
+        if not current_class:
+            class_size = None
+
+    average_by_term = {row['term_id']: row['average'] for row in term_averages}
+    subjects_by_term = defaultdict(list)
+    for row in subject_totals:
+        subject = reference_data.subject(row['subject_id'])
+        subjects_by_term[row['term_id']].append({
+            'subject': subject.name if subject else '',
+            'score': row['total'],
+        })
+    rank_by_term = {row['term_id']: row['position'] for row in class_positions if row['student_id'] == student.id}
+    invoice_by_term = {invoice.term_id: invoice for invoice in invoices}
+
     # Calculate scores for all terms in current academic year
     term_scores = []
+    current_term = None
     current_term_average = None
     current_term_rank = None
-    if academic_session:
-        terms = academic_session.terms.all()
-        for term in terms:
-            # Get average score for this term
-            avg_result = StudentScore.objects.filter(
-                student=student,
-                academic_session=academic_session,
-                term=term
-            ).aggregate(avg_score=Avg('score'))
-            
-            average_score = avg_result['avg_score']
-            if average_score is not None:
-                average_score = round(average_score, 2)
-            
-            # Get class rank for this term
-            rank = student.class_rank(academic_session, term)
-            
-            # Get class size for this term
-            current_class_record = student.class_records.filter(is_current=True).first()
-            class_size = None
-            if current_class_record:
-                class_size = StudentClass.objects.filter(
-                    school_class=current_class_record.school_class,
-                    academic_year=academic_session,
-                    is_current=True
-                ).count()
-            
-            # Get subject scores for this term
-            subject_scores = StudentScore.objects.filter(
-                student=student,
-                academic_session=academic_session,
-                term=term
-            ).select_related('subject').values('subject__name').annotate(
-                avg_score=Avg('score')
-            ).order_by('-avg_score')
-            
-            # Format subject scores
-            formatted_subject_scores = [
-                {
-                    'subject': score['subject__name'],
-                    'score': round(score['avg_score'], 2) if score['avg_score'] else None
-                }
-                for score in subject_scores
-            ]
-            term_scores.append({
-                'term': term,
-                'academic_year': academic_session,
-                'average_score': average_score,
-                'rank': rank,
-                'class_size': class_size,
-                'subject_scores': formatted_subject_scores,
-            })
-            
-            # Store current term data separately
-            if term.is_current:
-                current_term_average = average_score
-                current_term_rank = rank
-    
-    # Get invoices organized by term
     all_invoices_by_term = []
     recent_invoices = []
-    
-    if academic_session:
-        terms = academic_session.terms.all()
-        
-        for term in terms:
-            invoice = Invoice.objects.filter(
-                student=student,
-                academic_year=academic_session,
-                term=term
-            ).first()
-            
-            if invoice:
-                payments = invoice.payments.filter(status='completed').order_by('-payment_date')
-                recent_invoices.append(invoice)
-                
-                all_invoices_by_term.append({
-                    'term': term,
-                    'invoice': invoice,
-                    'payments': payments
-                })
-            else:
-                all_invoices_by_term.append({
-                    'term': term,
-                    'invoice': None,
-                    'payments': []
-                })
-    
-    # Get current invoice for dashboard
-    current_invoice = None
-    if academic_session and current_term:
-        current_invoice = Invoice.objects.filter(
-            student=student,
-            academic_year=academic_session,
-            term=current_term
-        ).first()
-    
-    # Get sponsorship info
-    sponsorship = Sponsorship.objects.filter(student=student).first()
-    
+    for term in terms:
+        average_score = average_by_term.get(term.id)
+        # Same ranking as StudentProfile.class_rank
+        rank = rank_by_term.get(term.id) if current_class else None
+
+        term_scores.append({
+            'term': term,
+            'academic_year': academic_session,
+            'average_score': average_score,
+            'rank': rank,
+            'class_size': class_size,
+            'subject_scores': subjects_by_term[term.id],
+        })
+
+        # Store current term data separately
+        if term.is_current:
+            current_term = term
+            current_term_average = average_score
+            current_term_rank = rank
+
+        # Get invoices organized by term
+        invoice = invoice_by_term.get(term.id)
+        if invoice:
+            recent_invoices.append(invoice)
+        all_invoices_by_term.append({
+            'term': term,
+            'invoice': invoice,
+            'payments': invoice.completed_payments if invoice else [],
+        })
+
     context = {
         "student": student,
         "academic_session": academic_session,
         "current_term": current_term,
         "current_term_average": current_term_average,
         "current_term_rank": current_term_rank,
-        "class_size": StudentClass.objects.filter(
-            school_class=student.class_records.filter(is_current=True).first().school_class,
-            academic_year=academic_session,
-            is_current=True
-        ).count() if academic_session else None,
-        "current_invoice": current_invoice,
+        "class_size": class_size,
+        "current_invoice": invoice_by_term.get(current_term.id) if current_term else None,
         "term_scores": term_scores,
         "all_invoices_by_term": all_invoices_by_term,
         "recent_invoices": recent_invoices[:3],  # Last 3 invoices
         "sponsorship": sponsorship,
     }
-    
-    return render(request, "student/student_dashboard.html", context)
+
+    return await arender(request, "student/student_dashboard.html", context)
 
 
 @login_required
@@ -174,7 +166,7 @@ def student_invoices(request):
     ).distinct().order_by('-year')
     
     # Get current academic year
-    current_academic_year = AcademicYear.objects.filter(is_active=True).first()
+    current_academic_year = reference.current_year()
     
     # Get all invoices with related data
     invoices = Invoice.objects.filter(
@@ -220,7 +212,7 @@ def student_invoices(request):
     # Get current invoice for download button
     current_invoice = None
     if current_academic_year:
-        current_term = Term.objects.filter(is_current=True).first()
+        current_term = reference.current_term()
         if current_term:
             current_invoice = invoices.filter(
                 academic_year=current_academic_year,
@@ -263,7 +255,7 @@ def student_academic_scores(request):
     ).distinct().order_by('-year')
     
     # Get current academic year
-    current_academic_year = AcademicYear.objects.filter(is_active=True).first()
+    current_academic_year = reference.current_year()
     
     # Get all scores
     scores = StudentScore.objects.filter(
@@ -300,6 +292,16 @@ def student_academic_scores(request):
     if subject_filter != 'all':
         scores = scores.filter(subject__name__icontains=subject_filter)
     
+    # Weighted subject totals and term averages, from the same filters
+    subject_totals = {
+        (row['academic_session_id'], row['term_id'], row['subject_id']): row['total']
+        for row in totals.subject_totals(scores)
+    }
+    term_averages = {
+        (row['academic_session_id'], row['term_id']): row['average']
+        for row in totals.term_totals(scores)
+    }
+
     # Group scores by academic year and term
     scores_by_term = {}
     for score in scores:
@@ -313,16 +315,17 @@ def student_academic_scores(request):
                 'term': score.term,
                 'scores': [],
                 'subjects': set(),
-                'subject_table': defaultdict(lambda: {"1st CA": 0, "2nd CA": 0, "Exam": 0, "total": 0})
+                'subject_table': {},
             }
         
         # Populate scores and subject table
         subject_name = score.subject.name
-        score_type = score.score_type.name
         score_value = float(score.score)
         
-        scores_by_term[key]['subject_table'][subject_name][score_type] = score_value
-        scores_by_term[key]['subject_table'][subject_name]["total"] += score_value
+        row = scores_by_term[key]['subject_table'].setdefault(subject_name, {
+            "total": subject_totals[(score.academic_session_id, score.term_id, score.subject_id)],
+        })
+        row[score.score_type.name] = score_value
         scores_by_term[key]['scores'].append(score_value)
         scores_by_term[key]['subjects'].add(subject_name)
 
@@ -334,8 +337,7 @@ def student_academic_scores(request):
         for term_data in scores_by_term.values():
             scores_list = term_data['scores']
             if scores_list:
-                total_score = sum(scores_list)  # Already floats
-                term_data['average_score'] = round(total_score / len(scores_list), 2)
+                term_data['average_score'] = term_averages[(term_data['academic_year'].id, term_data['term'].id)]
                 
                 # Rank
                 term_data['rank'] = student.class_rank(
@@ -372,7 +374,7 @@ def student_academic_scores(request):
         # Current term scores for download button
         current_term_scores = None
         if current_academic_year:
-            current_term = Term.objects.filter(is_current=True).first()
+            current_term = reference.current_term()
             if current_term:
                 current_scores = scores.filter(
                     academic_session=current_academic_year,
@@ -388,13 +390,17 @@ def student_academic_scores(request):
         # Prepare data for template
         years_list = AcademicYear.objects.values_list('year', flat=True).distinct().order_by('-year')
         subject_scores = list(grouped_scores.values())
-        score_types = ScoreType.objects.all().order_by("id")
+        score_types = reference.score_types()
 
+        subject_table = first_term_data['subject_table']
+        results = grading.scheme().grade_all(row.get("total", 0) for row in subject_table.values())
         subject_data = {}
-        for subject_name, scores_dict in first_term_data['subject_table'].items():
+        for (subject_name, scores_dict), result in zip(subject_table.items(), results):
             subject_data[subject_name] = {
                 "scores": scores_dict,  # includes all score types + total
-                "total": scores_dict.get("total", 0)
+                "total": scores_dict.get("total", 0),
+                "grade": result.grade,
+                "remark": result.remark,
             }
 
         context = {
@@ -639,16 +645,35 @@ def download_invoice_pdf(request, invoice_id):
 
 @login_required
 def download_report_card_pdf(request, academic_year_id, term_id):
+    student = get_object_or_404(StudentProfile, id=2)
+    academic_year = get_object_or_404(AcademicYear, id=academic_year_id)
+    term = get_object_or_404(Term, id=term_id)
+
+    # Kept until a score of the term, an enrolment, the settings, the score
+    # types (weights) or the year's annual results change
+    pdf = caching.get_or_set(
+        'pdfs',
+        f"report_card:{student.id}:{academic_year.id}:{term.id}",
+        lambda: _report_card_pdf(student, academic_year, term),
+        tags=('settings', 'enrolment', 'reference', f"scores:{academic_year.id}:{term.id}", annual.tag(academic_year.id)),
+    )
+
+    response = HttpResponse(pdf, content_type="application/pdf")
+    response["Content-Disposition"] = (
+        f'attachment; filename="report_{student.student_id}.pdf"'
+    )
+    return response
+
+
+def _report_card_pdf(student, academic_year, term):
+    """A student's report card for one term, as PDF bytes"""
 
     # =========================
     # BASIC DATA
     # =========================
-    student = get_object_or_404(StudentProfile, id=2)
-    academic_year = get_object_or_404(AcademicYear, id=academic_year_id)
-    term = get_object_or_404(Term, id=term_id)
     settings = SystemSettings.get_settings()
 
-    score_types = ScoreType.objects.all().order_by("id")
+    score_types = reference.score_types()
 
     scores = StudentScore.objects.filter(
         student=student,
@@ -674,40 +699,28 @@ def download_report_card_pdf(request, academic_year_id, term_id):
     total_students = class_students.count()
 
     # =========================
-    # POSITION CALCULATION
+    # POSITION AND STATS
     # =========================
-    student_totals = (
-        StudentScore.objects.filter(
-            student__in=class_students,
-            academic_session=academic_year,
-            term=term
-        )
-        .values("student")
-        .annotate(total=Sum("score"))
-        .order_by("-total")
+    # The class ranked by weighted term average in one query (students.totals)
+    standing = next(
+        (
+            row for row in totals.ranked(StudentScore.objects.filter(
+                student__in=class_students,
+                academic_session=academic_year,
+                term=term
+            ))
+            if row["student_id"] == student.id
+        ),
+        None,
     )
-
-    position = 0
-    for index, record in enumerate(student_totals, start=1):
-        if record["student"] == student.id:
-            position = index
-            break
-
-    # =========================
-    # STATS
-    # =========================
-    total_subjects = scores.values("subject").distinct().count()
-    average_score = scores.aggregate(avg=Avg("score"))["avg"] or 0
+    position = standing["position"] if standing else 0
+    total_subjects = standing["subjects"] if standing else 0
+    average_score = standing["average"] if standing else 0
 
     # =========================
     # PDF SETUP
     # =========================
     buffer = BytesIO()
-    response = HttpResponse(content_type="application/pdf")
-    response["Content-Disposition"] = (
-        f'attachment; filename="report_{student.student_id}.pdf"'
-    )
-
     doc = SimpleDocTemplate(
         buffer,
         pagesize=A4,
@@ -771,6 +784,16 @@ def download_report_card_pdf(request, academic_year_id, term_id):
         ["Position", f"{position} out of {total_students}", "Class Size", total_students],
     ]
 
+    # The last term's report card also carries the year (students.annual)
+    year_terms = reference.snapshot().terms_for(academic_year)
+    if year_terms and term.pk == max(year_terms, key=lambda row: (row.name, row.id)).pk:
+        result = AnnualResult.objects.filter(student=student, academic_year=academic_year).first()
+        if result:
+            summary_data.append([
+                "Annual Average", f"{result.average:.1f}%",
+                "Annual Position", f"{result.position} out of {result.class_size}",
+            ])
+
     summary_table = Table(summary_data, colWidths=[90, 150, 90, 150])
     summary_table.setStyle(TableStyle([
         ("GRID", (0, 0), (-1, -1), 1, colors.black),
@@ -784,9 +807,10 @@ def download_report_card_pdf(request, academic_year_id, term_id):
     # SUBJECT SCORE TABLE
     # =========================
     subject_scores = defaultdict(dict)
+    subject_totals = {row["subject_id"]: row["total"] for row in totals.subject_totals(scores)}
 
     for s in scores:
-        subject_scores[s.subject.name][s.score_type.name] = s.score
+        subject_scores[(s.subject_id, s.subject.name)][s.score_type.name] = s.score
 
     table_data = [["Subject"]]
     for st in score_types:
@@ -794,21 +818,14 @@ def download_report_card_pdf(request, academic_year_id, term_id):
 
     table_data[0] += ["Total", "Grade", "Remark"]
 
-    for subject, score_map in subject_scores.items():
-        row = [subject]
-        total = 0
-
-        for st in score_types:
-            val = score_map.get(st.name, 0)
-            row.append(val)
-            total += val
+    rows = []
+    for (subject_id, subject), score_map in subject_scores.items():
+        values = [score_map.get(st.name, "-") for st in score_types]
+        rows.append([subject, *values, subject_totals[subject_id]])
 
-        row.extend([
-            total,
-            get_grade(total),
-            get_remarks(total)
-        ])
-        table_data.append(row)
+    # The whole table is graded in one pass
+    for row, result in zip(rows, grading.scheme().grade_all(row[-1] for row in rows)):
+        table_data.append([*row, result.grade, result.remark])
 
     score_table = Table(table_data, repeatRows=1)
     score_table.setStyle(TableStyle([
@@ -826,9 +843,9 @@ def download_report_card_pdf(request, academic_year_id, term_id):
     # BUILD PDF
     # =========================
     doc.build(elements)
-    response.write(buffer.getvalue())
+    pdf = buffer.getvalue()
     buffer.close()
 
-    return response
+    return pdf
 
 